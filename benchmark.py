@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Relational
+# Copyright (C) 2008-2017  Salvo "LtWorf" Tomaselli
+#
+# Relational is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# author Salvo "LtWorf" Tomaselli <tiposchi@tiscali.it>
+#
+# Measures the joins of relational.parallel on relations divided in
+# partitions, with different numbers of processes, compared to the serial
+# methods of Relation, and checks that they give the same results.
+#
+# The time to divide the relations is shown separately, since it is done
+# in the current process, and takes about as long as the serial join.
+#
+# Usage: ./benchmark.py [-t tuples] [-w max_workers]
+
+import getopt
+import sys
+from time import perf_counter
+
+from relational.parallel import Scheduler, PARTITIONED, partition
+from relational.relation import Relation, Header
+
+
+def usage() -> None:
+    print('Usage: %s [-t tuples] [-w max_workers]' % sys.argv[0])
+    sys.exit(1)
+
+
+def generate(header, tuples: int, seed: int) -> Relation:
+    '''Returns a relation with the given attributes, where the
+    first attribute has about tuples / 4 distinct values'''
+    r = Relation()
+    r.header = Header(header)
+    for i in range(tuples):
+        r.insert(tuple(str((i * (seed + j) + j) % (tuples // 4 + j + 1)) for j in range(len(header))))
+    return r
+
+
+def timed(f):
+    start = perf_counter()
+    result = f()
+    return perf_counter() - start, result
+
+
+def main() -> None:
+    tuples = 200000
+    max_workers = 8
+    try:
+        switches, args = getopt.getopt(sys.argv[1:], 't:w:')
+    except getopt.GetoptError:
+        usage()
+    for switch, value in switches:
+        if switch == '-t':
+            tuples = int(value)
+        elif switch == '-w':
+            max_workers = int(value)
+
+    workers = [1]
+    while workers[-1] * 2 <= max_workers:
+        workers.append(workers[-1] * 2)
+
+    left = generate(('k', 'x', 'y'), tuples, 3)
+    right = generate(('k', 'z'), tuples, 5)
+
+    print('%d tuples per relation' % tuples)
+    print('%-12s%10s%10s%10s%10s' % ('operation', 'processes', 'divide', 'operation', 'speedup'))
+    for operation in PARTITIONED:
+        serial, expected = timed(lambda: getattr(left, operation)(right))
+        print('%-12s%10s%10s%9.2fs%10s' % (operation, 'serial', '', serial, ''))
+        for i in workers:
+            divide, parts = timed(lambda: (partition(left, ['k'], i), partition(right, ['k'], i)))
+            with Scheduler(i, 0) as s:
+                # Starting the processes is not measured
+                list(s.pool().map(int, range(i)))
+                elapsed, result = timed(lambda: s.partitioned(operation, *parts))
+            if result != expected:
+                raise Exception('Different result for %s with %d processes' % (operation, i))
+            print('%-12s%10d%9.2fs%9.2fs%9.2fx' % (operation, i, divide, elapsed, serial / elapsed))
+
+if __name__ == '__main__':
+    main()
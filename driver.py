@@ -22,7 +22,7 @@ from sys import exit
 import sys
 import traceback
 
-from relational import relation, parser, optimizer
+from relational import relation, parser, optimizer, engine, codegen
 from xtermcolor import colorize
 
 
@@ -214,6 +214,18 @@ def run_fail_test(testname):
     except:
         pass
 
+    try:
+        engine.execute(parser.tree(query), rels)
+        test_succeed = False
+    except:
+        pass
+
+    try:
+        codegen.execute(query, rels)
+        test_succeed = False
+    except:
+        pass
+
     if test_succeed:
         print (colorize('Test passed', COLOR_GREEN))
     else:
@@ -252,7 +264,15 @@ def run_test(testname):
         c_expr = parser.tree(query).toCode()
         c_result = eval(c_expr, rels)
 
-        if (o_result == result_rel) and (result == result_rel) and (c_result == result_rel):
+        p_result = engine.execute(parser.tree(query), rels)
+        po_result = engine.execute(parser.tree(o_query), rels)
+
+        g_result = codegen.execute(query, rels)
+        go_result = codegen.execute(o_query, rels)
+
+        if (o_result == result_rel) and (result == result_rel) and (c_result == result_rel) and \
+                (p_result == result_rel) and (po_result == result_rel) and \
+                (g_result == result_rel) and (go_result == result_rel):
             print (colorize('Test passed', COLOR_GREEN))
             return True
     except Exception as inst:
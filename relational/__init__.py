@@ -4,4 +4,13 @@ __all__ = (
     "optimizer",
     "optimizations",
     "rtypes",
+    "columnar",
+    "vectorized",
+    "index",
+    "engine",
+    "codegen",
+    "querycache",
+    "parallel",
+    "statistics",
+    "cost",
 )
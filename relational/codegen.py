@@ -0,0 +1,587 @@
+# Relational
+# Copyright (C) 2008-2017  Salvo "LtWorf" Tomaselli
+#
+# Relational is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# author Salvo "LtWorf" Tomaselli <tiposchi@tiscali.it>
+#
+# This module converts a whole query into a single Python function.
+#
+# Unlike Node.toPython, which calls a method of Relation for every
+# operation, the generated function has one loop for every scan of a
+# relation. Selections, projections and renames over a scan or over the
+# probe side of a join are inside that loop: the values used by a
+# selection are bound to local variables named like the attributes and
+# the expression is written as it is in the query.
+#
+# Tuples are only collected in sets for the build side of joins and
+# products, for the operands of set operations and for the operations
+# done by Relation (outer joins, division and multiway joins).
+#
+# The code depends on the attributes of the relations used by the query,
+# so compiled functions are cached using the query and those attributes
+# as key.
+
+from collections import OrderedDict
+from io import StringIO
+from tokenize import generate_tokens, untokenize, TokenError, NAME, NEWLINE, NL
+from typing import Callable, Dict, List, Optional, Tuple
+
+from relational import parser
+from relational.relation import Relation, Header, _split_equalities, _range_condition
+
+# How many compiled queries to keep
+CACHE_SIZE = 128
+
+_cache = OrderedDict() #  type: OrderedDict
+
+
+def execute(query: str, rels: Dict[str, Relation]) -> Relation:
+    '''Executes the query on the relations in rels'''
+    return compile_query(query, rels)(rels)
+
+
+def compile_query(query: str, rels: Dict[str, Relation]) -> Callable[[Dict[str, Relation]], Relation]:
+    '''
+    Returns a function that executes the query, when called with
+    a dictionary of relations.
+
+    The function can be reused as long as the relations it uses
+    keep the same attributes.
+    '''
+    names = _names_cache.get(query)
+    if names is None:
+        tree = parser.tree(query)
+        names = _names_cache[query] = tuple(sorted(_relation_names(tree)))
+    else:
+        tree = None
+
+    try:
+        key = (query, tuple(tuple(rels[i].header) for i in names))
+    except KeyError as e:
+        raise Exception('Unknown relation: %s' % e.args[0])
+
+    function = _cache.get(key)
+    if function is not None:
+        _cache.move_to_end(key)
+        return function
+
+    if tree is None:
+        tree = parser.tree(query)
+    function = Generator(tree, rels).function()
+    _cache[key] = function
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    if len(_names_cache) > CACHE_SIZE:
+        _names_cache.clear()
+    return function
+
+
+_names_cache = {} #  type: Dict[str, Tuple[str, ...]]
+
+
+def _relation_names(node: parser.Node) -> set:
+    if node.kind == parser.RELATION:
+        return {node.name}
+    elif node.kind == parser.UNARY:
+        return _relation_names(node.child)
+    return _relation_names(node.left) | _relation_names(node.right)
+
+
+class Columns:
+
+    '''
+    The tuple flowing in a generated loop.
+
+    exprs contains the Python expression for the value of every attribute
+    in header. If the tuple is available as it is, whole is the name of
+    the variable containing it.
+    '''
+
+    def __init__(self, header: Header, exprs: List[str], whole: Optional[str] = None) -> None:
+        self.header = header
+        self.exprs = exprs
+        self.whole = whole
+
+    def tuple(self) -> str:
+        if self.whole is not None:
+            return self.whole
+        return '(%s,)' % ', '.join(self.exprs)
+
+
+class Generator:
+
+    '''Generates the function for a parse tree.'''
+
+    def __init__(self, tree: parser.Node, rels: Dict[str, Relation]) -> None:
+        self.tree = tree
+        self.rels = rels
+        self.lines = [] #  type: List[str]
+        self.count = 0
+
+        # Prefix for the generated variables, so that they don't collide
+        # with the attributes, that become local variables too
+        attributes = set()
+        for i in _relation_names(tree):
+            attributes.update(rels[i].header)
+        attributes.update(_renamed_attributes(tree))
+        self.prefix = '_q'
+        while any(i.startswith(self.prefix) for i in attributes):
+            self.prefix += '_'
+
+    def var(self, name: str) -> str:
+        '''Returns a new variable name'''
+        self.count += 1
+        return '%s%s%d' % (self.prefix, name, self.count)
+
+    def emit(self, indent: int, line: str) -> None:
+        self.lines.append('    ' * indent + line)
+
+    def function(self) -> Callable[[Dict[str, Relation]], Relation]:
+        if self.tree.kind == parser.RELATION:
+            name = self.tree.name
+            return lambda rels: rels[name]
+
+        rels = self.prefix + 'rels'
+        header = self.header(self.tree)
+        out = self.materialize(self.tree, 1)
+        self.emit(1, 'return %s' % out)
+
+        code = 'def %squery(%s):\n' % (self.prefix, rels) + '\n'.join(self.lines)
+        context = {
+            self.prefix + 'make': _make_relation,
+            self.prefix + 'candidates': _candidates,
+            self.prefix + 'op': _operation,
+        }
+        try:
+            exec(compile(code, '<relational_query>', 'exec'), context)
+        except SyntaxError as e:
+            raise Exception('Failed to compile expression: %s' % e.text)
+        query = context[self.prefix + 'query']
+        text = str(self.tree)
+
+        # Renames of a relation return its content, that is then shared
+        node = self.tree
+        while node.name == parser.RENAME:
+            node = node.child
+        shared = node.name if node.kind == parser.RELATION else None
+
+        def run(rels: Dict[str, Relation]) -> Relation:
+            try:
+                content = query(rels)
+            except Exception as e:
+                raise Exception('Failed to evaluate %s\n%s' % (text, e))
+            r = _make_relation(header, content)
+            if shared is not None:
+                rels[shared]._make_duplicate(r)
+            return r
+        run.code = code
+        return run
+
+    def relation(self, name: str, indent: int) -> str:
+        '''Emits the code to get a relation, and returns its variable'''
+        var = self.var('rel')
+        self.emit(indent, '%s = %srels[%r]' % (var, self.prefix, name))
+        return var
+
+    def materialize(self, node: parser.Node, indent: int) -> str:
+        '''Emits the code to put the result of node in a set, and returns
+        the variable containing it'''
+        # Renames don't change the tuples
+        while node.name == parser.RENAME:
+            node = node.child
+        if node.kind == parser.RELATION:
+            var = self.relation(node.name, indent)
+            content = self.var('set')
+            self.emit(indent, '%s = %s.content' % (content, var))
+            return content
+
+        content = self.var('set')
+        self.emit(indent, '%s = set()' % content)
+        self.produce(node, indent, lambda cols, ind: self.emit(
+            ind, '%s.add(%s)' % (content, cols.tuple())
+        ), root=True)
+        return content
+
+    def header(self, node: parser.Node) -> Header:
+        '''Returns the header of the result of node'''
+        if node.kind == parser.RELATION:
+            try:
+                return self.rels[node.name].header
+            except KeyError:
+                raise Exception('Unknown relation: %s' % node.name)
+        elif node.name == parser.SELECTION:
+            return self.header(node.child)
+        elif node.name == parser.PROJECTION:
+            header = self.header(node.child)
+            ids = header.getAttributesId(_projection_attributes(node))
+            if len(ids) == 0:
+                raise Exception('Invalid attributes for projection')
+            return Header(header[i] for i in ids)
+        elif node.name == parser.RENAME:
+            return self.header(node.child).rename(_rename_params(node))
+
+        left = self.header(node.left)
+        right = self.header(node.right)
+        if node.name in (parser.JOIN, parser.MULTIJOIN, parser.REDUCEDJOIN):
+            return Header(left + tuple(i for i in right if i not in left))
+        elif node.name in (parser.SEMIJOIN, parser.ANTIJOIN):
+            return left
+        elif node.name in (parser.PRODUCT, parser.THETAJOIN):
+            if left.sharedAttributes(right) != 0:
+                raise Exception(
+                    'Unable to perform product on relations with colliding attributes'
+                )
+            return Header(left + right)
+        elif node.name in (parser.UNION, parser.INTERSECTION, parser.DIFFERENCE):
+            _rearrange(left, right)
+            return left
+        # Operations done by Relation, trying them on empty relations
+        return _operation(
+            parser.op_functions[node.name],
+            _make_relation(left, set()),
+            _make_relation(right, set()),
+        ).header
+
+    def produce(self, node: parser.Node, indent: int, consume, root: bool = False) -> None:
+        '''
+        Emits the code that produces the tuples of node, and calls
+        consume(cols, indent) to emit the code that uses every tuple.
+
+        If root is set, the consumer removes duplicates.
+        '''
+        header = self.header(node)
+
+        if node.kind == parser.RELATION:
+            var = self.relation(node.name, indent)
+            row = self.var('t')
+            self.emit(indent, 'for %s in %s.content:' % (row, var))
+            consume(self.columns(header, row), indent + 1)
+
+        elif node.name == parser.SELECTION:
+            self.selection(node, indent, consume)
+
+        elif node.name == parser.PROJECTION:
+            chheader = self.header(node.child)
+            ids = chheader.getAttributesId(_projection_attributes(node))
+            seen = self.var('seen')
+            if not root:
+                self.emit(indent, '%s = set()' % seen)
+
+            def project(cols: Columns, ind: int) -> None:
+                pcols = Columns(header, [cols.exprs[i] for i in ids])
+                if root:
+                    consume(pcols, ind)
+                    return
+                # Removing duplicates, to not repeat the work after this
+                row = self.var('p')
+                self.emit(ind, '%s = %s' % (row, pcols.tuple()))
+                self.emit(ind, 'if %s not in %s:' % (row, seen))
+                self.emit(ind + 1, '%s.add(%s)' % (seen, row))
+                pcols.whole = row
+                consume(pcols, ind + 1)
+            self.produce(node.child, indent, project)
+
+        elif node.name == parser.RENAME:
+            def rename(cols: Columns, ind: int) -> None:
+                consume(Columns(header, cols.exprs, cols.whole), ind)
+            self.produce(node.child, indent, rename)
+
+        elif node.name in (parser.JOIN, parser.SEMIJOIN, parser.ANTIJOIN):
+            self.join(node, indent, consume)
+
+        elif node.name == parser.THETAJOIN:
+            self.thetajoin(node, indent, consume)
+
+        elif node.name in parser.multiway_operators:
+            # Done by Relation, on all the operands at once
+            operands = parser.multijoin_operands(node)
+            args = ['%smake(%r, %s)' % (
+                self.prefix, tuple(self.header(i)), self.materialize(i, indent)
+            ) for i in operands]
+            result = self.var('res')
+            self.emit(indent, '%s = %s.%s(%s)' % (
+                result, args[0], parser.op_functions[node.name], ', '.join(args[1:])
+            ))
+            row = self.var('t')
+            self.emit(indent, 'for %s in %s.content:' % (row, result))
+            consume(self.columns(header, row), indent + 1)
+
+        elif node.name == parser.PRODUCT:
+            right = self.materialize(node.right, indent)
+            rheader = self.header(node.right)
+
+            def product(cols: Columns, ind: int) -> None:
+                row = self.var('t')
+                self.emit(ind, 'for %s in %s:' % (row, right))
+                consume(Columns(
+                    header,
+                    cols.exprs + self.columns(rheader, row).exprs,
+                    '%s + %s' % (cols.tuple(), row)
+                ), ind + 1)
+            self.produce(node.left, indent, product)
+
+        elif node.name in (parser.INTERSECTION, parser.DIFFERENCE):
+            right = self.materialize(node.right, indent)
+            ids = _rearrange(header, self.header(node.right))
+            condition = 'in' if node.name == parser.INTERSECTION else 'not in'
+
+            def filter_(cols: Columns, ind: int) -> None:
+                row = self.var('r')
+                self.emit(ind, '%s = %s' % (row, cols.tuple()))
+                if ids is None:
+                    self.emit(ind, 'if %s %s %s:' % (row, condition, right))
+                else:
+                    self.emit(ind, 'if %s %s %s:' % (
+                        _tuple('%s[%d]' % (row, i) for i in ids), condition, right
+                    ))
+                consume(Columns(header, cols.exprs, row), ind + 1)
+            self.produce(node.left, indent, filter_)
+
+        elif node.name == parser.UNION:
+            left = self.materialize(node.left, indent)
+            right = self.materialize(node.right, indent)
+            ids = _rearrange(self.header(node.right), header)
+            content = self.var('set')
+            if ids is None:
+                self.emit(indent, '%s = %s.union(%s)' % (content, left, right))
+            else:
+                self.emit(indent, '%s = %s.union(%s for %st in %s)' % (
+                    content, left, _tuple('%st[%d]' % (self.prefix, i) for i in ids),
+                    self.prefix, right
+                ))
+            row = self.var('t')
+            self.emit(indent, 'for %s in %s:' % (row, content))
+            consume(self.columns(header, row), indent + 1)
+
+        else:
+            # Operations done by Relation
+            left = self.materialize(node.left, indent)
+            right = self.materialize(node.right, indent)
+            result = self.var('res')
+            self.emit(indent, '%s = %sop(%r, %smake(%r, %s), %smake(%r, %s))' % (
+                result, self.prefix, parser.op_functions[node.name],
+                self.prefix, tuple(self.header(node.left)), left,
+                self.prefix, tuple(self.header(node.right)), right,
+            ))
+            row = self.var('t')
+            self.emit(indent, 'for %s in %s.content:' % (row, result))
+            consume(self.columns(header, row), indent + 1)
+
+    def condition(self, expr: str, header: Header, consume):
+        '''Returns a consumer that calls consume only for the tuples
+        that satisfy expr'''
+        # The attributes become local variables, with the prefix
+        expr, names = _rename_names(expr, header, self.prefix + 'v_')
+
+        def select(cols: Columns, ind: int) -> None:
+            for attr, expr_ in zip(cols.header, cols.exprs):
+                if attr in names:
+                    self.emit(ind, '%sv_%s = %s.autocast()' % (self.prefix, attr, expr_))
+            self.emit(ind, 'if %s:' % expr)
+            consume(cols, ind + 1)
+        return select
+
+    def selection(self, node: parser.Node, indent: int, consume) -> None:
+        header = self.header(node)
+        select = self.condition(node.prop, header, consume)
+
+        if node.child.kind == parser.RELATION:
+            # Using the indexes of the relation, if there are any
+            var = self.relation(node.child.name, indent)
+            row = self.var('t')
+            self.emit(indent, 'for %s in %scandidates(%s, %r):' % (
+                row, self.prefix, var, node.prop
+            ))
+            select(self.columns(header, row), indent + 1)
+        else:
+            self.produce(node.child, indent, select)
+
+    def join(self, node: parser.Node, indent: int, consume) -> None:
+        '''Natural join, semijoin and antijoin. The right operand is
+        put in a hash table, the left operand probes it.'''
+        header = self.header(node)
+        lheader = self.header(node.left)
+        rheader = self.header(node.right)
+        shared = [i for i in lheader if i in rheader]
+        sid = lheader.getAttributesId(shared)
+        oid = rheader.getAttributesId(shared)
+        noid = [i for i in range(len(rheader)) if i not in oid]
+
+        right = self.materialize(node.right, indent)
+        table = self.var('table')
+        right_key = _tuple('%st[%d]' % (self.prefix, i) for i in oid)
+        if node.name == parser.JOIN:
+            self.emit(indent, '%s = {}' % table)
+            self.emit(indent, 'for %st in %s:' % (self.prefix, right))
+            self.emit(indent + 1, '%s.setdefault(%s, []).append(%st)' % (table, right_key, self.prefix))
+        else:
+            self.emit(indent, '%s = {%s for %st in %s}' % (table, right_key, self.prefix, right))
+
+        def probe(cols: Columns, ind: int) -> None:
+            key = _tuple(cols.exprs[i] for i in sid)
+            if node.name == parser.SEMIJOIN:
+                self.emit(ind, 'if %s in %s:' % (key, table))
+                consume(cols, ind + 1)
+            elif node.name == parser.ANTIJOIN:
+                self.emit(ind, 'if %s not in %s:' % (key, table))
+                consume(cols, ind + 1)
+            else:
+                row = self.var('t')
+                self.emit(ind, 'for %s in %s.get(%s, ()):' % (row, table, key))
+                consume(Columns(
+                    header,
+                    cols.exprs + ['%s[%d]' % (row, i) for i in noid],
+                ), ind + 1)
+        self.produce(node.left, indent, probe)
+
+    def thetajoin(self, node: parser.Node, indent: int, consume) -> None:
+        '''Theta join. The right operand is put in a hash table, using as
+        key the casted values of the attributes compared for equality with
+        attributes of the left operand. The condition is evaluated on the
+        pairs found in the table, unless it only contains those equalities.
+
+        Without equalities, but with comparisons between attributes of
+        the operands, it is done by Relation.thetajoin.'''
+        header = self.header(node)
+        lheader = self.header(node.left)
+        rheader = self.header(node.right)
+        pairs, residual = _split_equalities(node.prop, lheader, rheader)
+        sid = lheader.getAttributesId([i[0] for i in pairs])
+        oid = rheader.getAttributesId([i[1] for i in pairs])
+
+        if not pairs and residual is not None and \
+                _range_condition(residual, lheader, rheader) is not None:
+            # Done by Relation, that sorts the right operand
+            left = self.materialize(node.left, indent)
+            right = self.materialize(node.right, indent)
+            result = self.var('res')
+            self.emit(indent, '%s = %smake(%r, %s).thetajoin(%smake(%r, %s), %r)' % (
+                result, self.prefix, tuple(lheader), left,
+                self.prefix, tuple(rheader), right, node.prop
+            ))
+            row = self.var('t')
+            self.emit(indent, 'for %s in %s.content:' % (row, result))
+            consume(self.columns(header, row), indent + 1)
+            return
+
+        right = self.materialize(node.right, indent)
+        table = self.var('table')
+        right_key = _tuple('%st[%d].autocast()' % (self.prefix, i) for i in oid)
+        self.emit(indent, '%s = {}' % table)
+        self.emit(indent, 'for %st in %s:' % (self.prefix, right))
+        self.emit(indent + 1, '%s.setdefault(%s, []).append(%st)' % (table, right_key, self.prefix))
+
+        if residual is not None:
+            consume = self.condition(node.prop, header, consume)
+
+        def probe(cols: Columns, ind: int) -> None:
+            key = _tuple('%s.autocast()' % cols.exprs[i] for i in sid)
+            row = self.var('t')
+            self.emit(ind, 'for %s in %s.get(%s, ()):' % (row, table, key))
+            consume(Columns(
+                header,
+                cols.exprs + self.columns(rheader, row).exprs,
+                '%s + %s' % (cols.tuple(), row)
+            ), ind + 1)
+        self.produce(node.left, indent, probe)
+
+    def columns(self, header: Header, row: str) -> Columns:
+        return Columns(header, ['%s[%d]' % (row, i) for i in range(len(header))], row)
+
+
+def _tuple(exprs) -> str:
+    return '(%s)' % ''.join('%s, ' % i for i in exprs)
+
+
+def _projection_attributes(node: parser.Node) -> List[str]:
+    return [i.strip() for i in node.prop.split(',')]
+
+
+def _rename_params(node: parser.Node) -> Dict[str, str]:
+    params = {}
+    for i in node.prop.split(','):
+        q = i.split(parser.ARROW)
+        params[q[0].strip()] = q[1].strip()
+    return params
+
+
+def _rename_names(expr: str, header: Header, prefix: str) -> Tuple[str, set]:
+    '''Adds the prefix to the names of attributes used in the
+    expression. Returns the new expression and the attributes used.'''
+    try:
+        tokens = list(generate_tokens(StringIO(expr).readline))
+    except (TokenError, IndentationError):
+        raise Exception('Failed to compile expression: %s' % expr)
+
+    names = set()
+    r = []
+    for pos, token in enumerate(tokens):
+        kind, value = token[0], token[1]
+        if kind == NAME and value in header:
+            previous = tokens[pos - 1][1] if pos > 0 else None
+            following = tokens[pos + 1][1] if pos + 1 < len(tokens) else None
+            # Not an attribute of an object or a keyword argument
+            if previous != '.' and not (following == '=' and previous in ('(', ',')):
+                names.add(value)
+                value = prefix + value
+        if kind in (NEWLINE, NL):
+            value = ' '
+        r.append((kind, value))
+    return '(%s)' % untokenize(r).strip(), names
+
+
+def _rearrange(header: Header, other: Header) -> Optional[List[int]]:
+    '''Returns None if the headers are the same, or the positions in
+    header of the attributes of other. Raises an exception if they
+    differ.'''
+    if header == other:
+        return None
+    elif len(header) == len(other) and header.sharedAttributes(other) == len(header):
+        return header.getAttributesId(other)
+    raise TypeError('Relations differ: [%s] [%s]' % (
+        ','.join(other), ','.join(header)
+    ))
+
+
+def _renamed_attributes(node: parser.Node) -> set:
+    '''Returns the names given to attributes by renames'''
+    if node.kind == parser.RELATION:
+        return set()
+    elif node.kind == parser.UNARY:
+        r = _renamed_attributes(node.child)
+        if node.name == parser.RENAME:
+            for i in node.prop.split(','):
+                r.add(i.split(parser.ARROW)[-1].strip())
+        return r
+    return _renamed_attributes(node.left) | _renamed_attributes(node.right)
+
+
+def _make_relation(header, content) -> Relation:
+    r = Relation()
+    r.header = Header(header)
+    r.content = content
+    return r
+
+
+def _operation(name: str, left: Relation, right: Relation) -> Relation:
+    return getattr(left, name)(right)
+
+
+def _candidates(rel: Relation, expr: str):
+    '''Returns the tuples of rel that might satisfy expr'''
+    r = rel._index_lookup(expr)
+    if r is None:
+        return rel.content
+    return r
@@ -0,0 +1,201 @@
+# Relational
+# Copyright (C) 2008-2017  Salvo "LtWorf" Tomaselli
+#
+# Relational is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# author Salvo "LtWorf" Tomaselli <tiposchi@tiscali.it>
+#
+# This module provides a columnar storage for the content of a relation.
+# It behaves like the set of tuples normally used, so a relation can
+# use either of them.
+
+from array import array
+from collections.abc import MutableSet
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+
+class ColumnarContent(MutableSet):
+
+    '''
+    Set of tuples, stored by column.
+
+    Every column is an array of integer codes, and every code
+    refers to a distinct value of that column, which is stored
+    only once. This way repeated values do not take more memory
+    and share the same object.
+
+    Duplicated tuples are detected using a dictionary from the
+    hash of the codes of a tuple to its position.
+
+    Removing a tuple moves the last one in its place, so the
+    order of the tuples is not preserved.
+
+    The set operations intersection, union and difference
+    return a regular set, which remains the reference storage
+    for relations.
+    '''
+
+    def __init__(self, iterable: Iterable[tuple] = ()) -> None:
+        self._columns = None #  type: Optional[List[array]]
+        self._values = [] #  type: List[List[Any]]
+        self._codes = [] #  type: List[Dict[Any, int]]
+        self._rows = {} #  type: Dict[int, Any]
+        self._len = 0
+        for i in iterable:
+            self.add(i)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[tuple]:
+        if self._columns is None:
+            return
+        values = self._values
+        for codes in zip(*self._columns):
+            yield tuple(v[c] for v, c in zip(values, codes))
+
+    def __contains__(self, row) -> bool:
+        codes = self._encode(row, False)
+        return codes is not None and self._find(codes) is not None
+
+    def _encode(self, row: tuple, create: bool) -> Optional[tuple]:
+        '''Returns the codes for the values of row.
+
+        If create is false and a value was never seen,
+        None is returned, otherwise the value gets a new code.'''
+        if self._columns is None:
+            if not create:
+                return None
+            self._columns = [array('I') for i in row]
+            self._values = [[] for i in row]
+            self._codes = [{} for i in row]
+
+        if len(row) != len(self._columns):
+            return None
+
+        r = []
+        for value, codes, values in zip(row, self._codes, self._values):
+            code = codes.get(value)
+            if code is None:
+                if not create:
+                    return None
+                code = len(values)
+                codes[value] = code
+                values.append(value)
+            r.append(code)
+        return tuple(r)
+
+    def _row_codes(self, position: int) -> tuple:
+        return tuple(c[position] for c in self._columns)
+
+    def _find(self, codes: tuple) -> Optional[int]:
+        '''Returns the position of the tuple with the given codes
+        or None'''
+        entry = self._rows.get(hash(codes))
+        if entry is None:
+            return None
+        if isinstance(entry, int):
+            entry = (entry,)
+        for position in entry:
+            if self._row_codes(position) == codes:
+                return position
+        return None
+
+    def _register(self, codes: tuple, position: int) -> None:
+        key = hash(codes)
+        entry = self._rows.get(key)
+        if entry is None:
+            self._rows[key] = position
+        elif isinstance(entry, int):
+            self._rows[key] = [entry, position]
+        else:
+            entry.append(position)
+
+    def _unregister(self, codes: tuple, position: int) -> None:
+        key = hash(codes)
+        entry = self._rows[key]
+        if isinstance(entry, int):
+            del self._rows[key]
+        else:
+            entry.remove(position)
+            if len(entry) == 1:
+                self._rows[key] = entry[0]
+
+    def add(self, row: tuple) -> None:
+        codes = self._encode(row, True)
+        if codes is None:
+            raise ValueError('Tuple has the wrong size')
+        if self._find(codes) is not None:
+            return
+        for column, code in zip(self._columns, codes):
+            column.append(code)
+        self._register(codes, self._len)
+        self._len += 1
+
+    def discard(self, row: tuple) -> None:
+        codes = self._encode(row, False)
+        if codes is None:
+            return
+        position = self._find(codes)
+        if position is None:
+            return
+
+        self._unregister(codes, position)
+        last = self._len - 1
+        if position != last:
+            # Moving the last tuple in the free position
+            last_codes = self._row_codes(last)
+            self._unregister(last_codes, last)
+            for column, code in zip(self._columns, last_codes):
+                column[position] = code
+            self._register(last_codes, position)
+        for column in self._columns:
+            column.pop()
+        self._len -= 1
+
+    def column(self, index: int) -> Iterator[Any]:
+        '''Returns an iterator over the values of one column'''
+        if self._columns is None:
+            return iter(())
+        values = self._values[index]
+        return (values[c] for c in self._columns[index])
+
+    def project(self, ids: List[int]) -> Iterator[tuple]:
+        '''Returns an iterator over the tuples, restricted to the
+        columns in ids. Might contain duplicates.'''
+        return zip(*(self.column(i) for i in ids))
+
+    def copy(self) -> 'ColumnarContent':
+        r = ColumnarContent()
+        if self._columns is not None:
+            r._columns = [array(c.typecode, c) for c in self._columns]
+            r._values = [list(v) for v in self._values]
+            r._codes = [dict(c) for c in self._codes]
+            r._rows = {
+                k: v if isinstance(v, int) else list(v)
+                for k, v in self._rows.items()
+            }
+            r._len = self._len
+        return r
+
+    def union(self, other: Iterable[tuple]) -> Set[tuple]:
+        r = set(self)
+        r.update(other)
+        return r
+
+    def intersection(self, other: Iterable[tuple]) -> Set[tuple]:
+        return {i for i in self if i in other}
+
+    def difference(self, other: Iterable[tuple]) -> Set[tuple]:
+        return {i for i in self if i not in other}
@@ -0,0 +1,446 @@
+# Relational
+# Copyright (C) 2008-2017  Salvo "LtWorf" Tomaselli
+#
+# Relational is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# author Salvo "LtWorf" Tomaselli <tiposchi@tiscali.it>
+#
+# This module estimates, from the statistics of the relations, the number
+# of tuples returned by every node of a parse tree and the work needed to
+# compute it.
+#
+# The work of an operation is the number of values it reads plus the number
+# of values it returns, so that narrower tuples cost less. The cost of a
+# tree is the sum of the work of all its operations. Renames only change
+# the header, so they cost nothing.
+#
+# Attributes are assumed to be independent, and values to be uniformly
+# distributed among the distinct ones, except for comparisons with
+# constants, which use the histograms of the relations. Equality between
+# two attributes keeps 1/distinct of the tuples, like a natural join.
+
+import ast
+import math
+import operator
+from typing import Any, Dict, List, Optional, Tuple
+
+from relational import parser
+from relational.relation import _range_condition, _variable_order, _join_tree, _top_down, _tree_order
+from relational.vectorized import parse_comparison
+
+# Fraction of tuples kept by a selection that can't be estimated
+SELECTIVITY = 0.25
+
+
+class Column:
+
+    '''
+    Estimate of the values of an attribute.
+
+    statistics are the ones of the attribute in the relation it comes
+    from, or None if it isn't known.
+    '''
+
+    def __init__(self, distinct: float, statistics=None) -> None:
+        self.distinct = distinct
+        self.statistics = statistics
+
+
+class Estimate:
+
+    '''
+    Estimated result of a node.
+
+    rows is the number of tuples, attributes contains the
+    Column of every attribute and cost the work needed to
+    compute it.
+    '''
+
+    def __init__(self, rows: float, attributes: Dict[str, Column], cost: float) -> None:
+        self.rows = rows
+        self.attributes = attributes
+        self.cost = cost
+        for i in attributes.values():
+            i.distinct = max(1.0, min(i.distinct, rows))
+
+    def size(self) -> float:
+        '''Estimated number of values'''
+        return self.rows * max(1, len(self.attributes))
+
+    def __str__(self) -> str:
+        return 'rows ~%d, cost ~%d' % (round(self.rows), round(self.cost))
+
+
+def estimate(node: parser.Node, rels: Dict[str, Any]) -> Optional[Estimate]:
+    '''Returns the estimate for the tree, or None if it uses
+    relations that are not in rels.'''
+    try:
+        return _estimate(node, rels)
+    except KeyError:
+        return None
+
+
+def cost(node: parser.Node, rels: Dict[str, Any]) -> Optional[float]:
+    '''Returns the estimated cost of the tree, or None if it
+    uses relations that are not in rels.'''
+    e = estimate(node, rels)
+    return None if e is None else e.cost
+
+
+def _estimate(node: parser.Node, rels: Dict[str, Any]) -> Estimate:
+    if node.kind == parser.RELATION:
+        rel = rels[node.name]
+        stats = rel.statistics()
+        attributes = {
+            name: Column(len(column.distinct), column)
+            for name, column in zip(rel.header, stats.columns)
+        }
+        return Estimate(stats.rows, attributes, 0)
+    elif node.kind == parser.UNARY:
+        child = _estimate(node.child, rels)
+        return _unary[node.name](node, child)
+    elif node.name in parser.multiway_operators:
+        operands = [_estimate(i, rels) for i in parser.multijoin_operands(node)]
+        return _multiway[node.name](operands)
+    left = _estimate(node.left, rels)
+    right = _estimate(node.right, rels)
+    if node.name == parser.THETAJOIN:
+        return _thetajoin(node, left, right)
+    return _binary[node.name](left, right)
+
+
+def _column(e: Estimate, name: str) -> Column:
+    return e.attributes.get(name, Column(e.rows))
+
+
+def _copy(e: Estimate) -> Dict[str, Column]:
+    return {k: Column(v.distinct, v.statistics) for k, v in e.attributes.items()}
+
+
+def _conjuncts(expr: str) -> Optional[List[ast.expr]]:
+    '''Returns the conditions in the top level "and" of the
+    expression, or None if it can't be parsed'''
+    try:
+        tree = ast.parse(expr, mode='eval').body
+    except SyntaxError:
+        return None
+    if isinstance(tree, ast.BoolOp) and isinstance(tree.op, ast.And):
+        return tree.values
+    return [tree]
+
+
+def _equality(c: ast.expr, e: Estimate) -> Optional[Tuple[str, str]]:
+    '''Returns the attributes, if c is an equality between
+    two attributes'''
+    if isinstance(c, ast.Compare) and \
+            len(c.ops) == 1 and \
+            isinstance(c.ops[0], ast.Eq) and \
+            isinstance(c.left, ast.Name) and \
+            isinstance(c.comparators[0], ast.Name) and \
+            c.left.id in e.attributes and \
+            c.comparators[0].id in e.attributes:
+        return c.left.id, c.comparators[0].id
+    return None
+
+
+def selectivity(expr: str, e: Estimate) -> float:
+    '''Returns the estimated fraction of the tuples of e
+    that satisfy the expression'''
+    if expr.strip() == 'False':
+        return 0.0
+    conjuncts = _conjuncts(expr)
+    if conjuncts is None:
+        return SELECTIVITY
+
+    r = 1.0
+    for c in conjuncts:
+        pair = _equality(c, e)
+        if pair is not None:
+            r /= max(e.attributes[i].distinct for i in pair)
+            continue
+        conditions = parse_comparison(c, e.attributes)
+        if conditions is None:
+            r *= SELECTIVITY
+            continue
+        for name, op, value in conditions:
+            column = e.attributes[name]
+            if op is operator.eq:
+                r *= 1 / column.distinct
+            elif op is operator.ne:
+                r *= 1 - 1 / column.distinct
+            else:
+                r *= _range_selectivity(column, op, value)
+    return r
+
+
+def _range_selectivity(column: Column, op, value) -> float:
+    stats = column.statistics
+    if stats is None or stats.histogram is None:
+        return SELECTIVITY
+    below = stats.histogram.fraction_below(value)
+    if below is None:
+        return SELECTIVITY
+    if op in (operator.lt, operator.le):
+        return below
+    return 1 - below
+
+
+def _filter(expr: str, e: Estimate, *operands: Estimate) -> Estimate:
+    '''Returns the estimate of the tuples of e that satisfy the
+    expression, computed by reading the operands'''
+    rows = e.rows * selectivity(expr, e)
+    attributes = _copy(e)
+    for c in _conjuncts(expr) or ():
+        pair = _equality(c, e)
+        if pair is not None:
+            distinct = min(attributes[i].distinct for i in pair)
+            for i in pair:
+                attributes[i].distinct = distinct
+            continue
+        for name, op, value in parse_comparison(c, attributes) or ():
+            if op is operator.eq:
+                attributes[name].distinct = 1
+    return _result(rows, attributes, *operands)
+
+
+def _selection(node: parser.Node, child: Estimate) -> Estimate:
+    return _filter(node.prop, child, child)
+
+
+def _thetajoin(node: parser.Node, left: Estimate, right: Estimate) -> Estimate:
+    '''Hash join on the equalities between attributes of the two
+    operands, sorting for comparisons between them, or a nested
+    loop without either'''
+    product = _product(left, right)
+    r = _filter(node.prop, product, left, right)
+    conjuncts = _conjuncts(node.prop) or []
+    pairs = [_equality(i, product) for i in conjuncts]
+    # Only equalities between the two operands are used for the hash join
+    if any(i and (i[0] in left.attributes) != (i[1] in left.attributes) for i in pairs):
+        return r
+    tree = ast.Expression(body=ast.BoolOp(op=ast.And(), values=conjuncts))
+    if _range_condition(tree, left.attributes, right.attributes) is not None:
+        r.cost += right.size() * math.log2(max(2, right.rows))
+    else:
+        # Every pair of tuples is checked
+        r.cost += product.size()
+    return r
+
+
+def _projection(node: parser.Node, child: Estimate) -> Estimate:
+    return _project(child, [i.strip() for i in node.prop.split(',')])
+
+
+def _project(child: Estimate, names: List[str]) -> Estimate:
+    attributes = {}
+    rows = 1.0
+    for i in names:
+        column = _column(child, i)
+        attributes[i] = Column(column.distinct, column.statistics)
+        rows *= column.distinct
+    rows = min(rows, child.rows)
+    return _result(rows, attributes, child)
+
+
+def _rename(node: parser.Node, child: Estimate) -> Estimate:
+    params = {}
+    for i in node.prop.split(','):
+        q = i.split(parser.ARROW)
+        params[q[0].strip()] = q[1].strip()
+    attributes = {params.get(k, k): v for k, v in _copy(child).items()}
+    return Estimate(child.rows, attributes, child.cost)
+
+
+def join(left: Estimate, right: Estimate) -> Estimate:
+    '''Returns the estimate of the natural join of two results,
+    which is their product if they have no attributes in common'''
+    return _binary[parser.JOIN](left, right)
+
+
+def _result(rows: float, attributes: Dict[str, Column], *operands: Estimate) -> Estimate:
+    '''Returns the estimate of an operation that reads the operands'''
+    r = Estimate(rows, attributes, 0)
+    r.cost = r.size() + sum(i.cost + i.size() for i in operands)
+    return r
+
+
+def _product(left: Estimate, right: Estimate) -> Estimate:
+    rows = left.rows * right.rows
+    attributes = _copy(left)
+    attributes.update(_copy(right))
+    return _result(rows, attributes, left, right)
+
+
+def _join_rows(left: Estimate, right: Estimate) -> float:
+    '''Estimated tuples of the natural join'''
+    rows = left.rows * right.rows
+    for name in left.attributes.keys() & right.attributes.keys():
+        rows /= max(left.attributes[name].distinct, right.attributes[name].distinct)
+    return rows
+
+
+def _joins(outer_left: bool, outer_right: bool):
+    def join(left: Estimate, right: Estimate) -> Estimate:
+        rows = _join_rows(left, right)
+        matched = rows
+        if outer_left:
+            rows += max(0.0, left.rows - matched)
+        if outer_right:
+            rows += max(0.0, right.rows - matched)
+        attributes = _copy(right)
+        for name, column in _copy(left).items():
+            if name in attributes:
+                column.distinct = min(column.distinct, attributes[name].distinct)
+            attributes[name] = column
+        return _result(rows, attributes, left, right)
+    return join
+
+
+def _multijoin(operands: List[Estimate]) -> Estimate:
+    '''Multiway join, with hash tries. Besides reading the operands
+    and building their tries, every combination of values of the
+    first attributes that is in all the operands is visited once.'''
+    result = operands[0]
+    for i in operands[1:]:
+        result = join(result, i)
+    order = _variable_order([tuple(i.attributes) for i in operands])
+
+    visited = 0.0
+    for level in range(1, len(order)):
+        prefix = set(order[:level])
+        partial = None
+        for i in operands:
+            names = [j for j in i.attributes if j in prefix]
+            if names:
+                p = _project(i, names)
+                partial = p if partial is None else join(partial, p)
+        visited += partial.rows * level
+    r = _result(result.rows, _copy(result), *operands)
+    r.cost += visited + sum(i.size() for i in operands)
+    return r
+
+
+def _reduced_join(operands: List[Estimate]) -> Estimate:
+    '''Join after the semijoin reduction along the join tree. Every
+    edge of the tree is a semijoin in both directions, then the
+    reduced operands are joined along the tree, and no intermediate
+    result is bigger than the final one.'''
+    parents = _join_tree([set(i.attributes) for i in operands])
+    if parents is None:
+        return _multijoin(operands)
+    result = operands[0]
+    for i in operands[1:]:
+        result = join(result, i)
+
+    order = _top_down(parents)
+    reduced = list(operands)
+    work = 0.0
+    # The semijoins only read the shared attributes, and return some
+    # of the tuples they got, without making new ones
+    for i in reversed(order):
+        parent = parents[i]
+        if parent is not None:
+            shared = len(reduced[i].attributes.keys() & reduced[parent].attributes.keys())
+            work += (reduced[parent].rows + reduced[i].rows) * shared
+            reduced[parent] = _semijoin(reduced[parent], reduced[i])
+    for i in order:
+        parent = parents[i]
+        if parent is not None:
+            shared = len(reduced[i].attributes.keys() & reduced[parent].attributes.keys())
+            work += (reduced[i].rows + reduced[parent].rows) * shared
+            reduced[i] = _semijoin(reduced[i], reduced[parent])
+
+    # Reading the operands and writing the result are counted by
+    # _result, so only the intermediate results are added
+    joins = _tree_order(parents, [i.rows for i in reduced])
+    joined = reduced[joins[0]]
+    for i in joins[1:-1]:
+        joined = join(joined, reduced[i])
+        joined.rows = min(joined.rows, result.rows)
+        work += 2 * joined.size()
+    r = _result(result.rows, _copy(result), *operands)
+    r.cost += work
+    return r
+
+
+def _semijoin_fraction(left: Estimate, right: Estimate) -> float:
+    '''Estimated fraction of the tuples of left that have a match
+    in right'''
+    if right.rows == 0:
+        return 0.0
+    r = 1.0
+    for name in left.attributes.keys() & right.attributes.keys():
+        r *= min(1.0, right.attributes[name].distinct / left.attributes[name].distinct)
+    return r
+
+
+def _semijoin(left: Estimate, right: Estimate) -> Estimate:
+    rows = left.rows * _semijoin_fraction(left, right)
+    return _result(rows, _copy(left), left, right)
+
+
+def _antijoin(left: Estimate, right: Estimate) -> Estimate:
+    rows = left.rows * (1 - _semijoin_fraction(left, right))
+    return _result(rows, _copy(left), left, right)
+
+
+def _union(left: Estimate, right: Estimate) -> Estimate:
+    rows = left.rows + right.rows
+    attributes = _copy(left)
+    for name, column in attributes.items():
+        column.distinct += _column(right, name).distinct
+    return _result(rows, attributes, left, right)
+
+
+def _intersection(left: Estimate, right: Estimate) -> Estimate:
+    rows = min(left.rows, right.rows)
+    return _result(rows, _copy(left), left, right)
+
+
+def _difference(left: Estimate, right: Estimate) -> Estimate:
+    return _result(left.rows, _copy(left), left, right)
+
+
+def _division(left: Estimate, right: Estimate) -> Estimate:
+    attributes = {
+        k: v for k, v in _copy(left).items() if k not in right.attributes
+    }
+    rows = left.rows / max(1.0, right.rows)
+    return _result(rows, attributes, left, right)
+
+
+_unary = {
+    parser.SELECTION: _selection,
+    parser.PROJECTION: _projection,
+    parser.RENAME: _rename,
+}
+
+_multiway = {
+    parser.MULTIJOIN: _multijoin,
+    parser.REDUCEDJOIN: _reduced_join,
+}
+
+_binary = {
+    parser.PRODUCT: _product,
+    parser.JOIN: _joins(False, False),
+    parser.JOIN_LEFT: _joins(True, False),
+    parser.JOIN_RIGHT: _joins(False, True),
+    parser.JOIN_FULL: _joins(True, True),
+    parser.SEMIJOIN: _semijoin,
+    parser.ANTIJOIN: _antijoin,
+    parser.UNION: _union,
+    parser.INTERSECTION: _intersection,
+    parser.DIFFERENCE: _difference,
+    parser.DIVISION: _division,
+}
@@ -0,0 +1,278 @@
+# Relational
+# Copyright (C) 2008-2017  Salvo "LtWorf" Tomaselli
+#
+# Relational is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# author Salvo "LtWorf" Tomaselli <tiposchi@tiscali.it>
+#
+# This module executes a parse tree as a pipeline of iterators, instead of
+# calling the methods of Relation, which create a new relation for every
+# operation.
+#
+# Every node becomes a stream: a header and an iterator over tuples.
+# Tuples are pulled from the root, so selections, projections, renames and
+# the probe side of joins don't keep their results in memory. Operations
+# that need all of an operand (the build side of joins, the right operand
+# of set operations) keep only that operand in memory.
+#
+# Every stream yields each tuple only once, so the result is the same set
+# that the methods of Relation would return.
+
+from typing import Any, Dict, Iterator, Tuple
+
+from relational import parser
+from relational.relation import Relation, Header, _Predicate, _hash_table, _cast_hash_table, _split_equalities, _range_condition, _band_join, _generic_join, _reduced_join
+
+Stream = Tuple[Header, Iterator[tuple]]
+
+
+def execute(node: parser.Node, rels: Dict[str, Relation]) -> Relation:
+    '''Executes the parse tree on the relations in rels and returns
+    the resulting relation.'''
+    if node.kind == parser.RELATION:
+        return _get_relation(node.name, rels)
+    header, rows = stream(node, rels)
+    r = Relation()
+    r.header = header
+    r.content = set(rows)
+    return r
+
+
+def _get_relation(name: str, rels: Dict[str, Relation]) -> Relation:
+    try:
+        return rels[name]
+    except KeyError:
+        raise Exception('Unknown relation: %s' % name)
+
+
+def _relation_stream(rel: Relation) -> Stream:
+    return rel.header, iter(rel.content)
+
+
+def stream(node: parser.Node, rels: Dict[str, Relation]) -> Stream:
+    '''Returns the stream for the node'''
+    if node.kind == parser.RELATION:
+        return _relation_stream(_get_relation(node.name, rels))
+    elif node.kind == parser.UNARY:
+        return _unary[node.name](node, rels)
+    elif node.name in _binary:
+        return _binary[node.name](node, rels)
+
+    # Blocking operations, done by Relation
+    left = execute(node.left, rels)
+    right = execute(node.right, rels)
+    return _relation_stream(getattr(left, parser.op_functions[node.name])(right))
+
+
+def _selection(node: parser.Node, rels) -> Stream:
+    if node.child.kind == parser.RELATION:
+        # Relation can use indexes and vectorized selections
+        rel = _get_relation(node.child.name, rels)
+        return _relation_stream(rel.selection(node.prop))
+
+    header, rows = stream(node.child, rels)
+    predicate = _Predicate(node.prop, header)
+    return header, filter(predicate, rows)
+
+
+def _projection(node: parser.Node, rels) -> Stream:
+    attributes = [i.strip() for i in node.prop.split(',')]
+    header, rows = stream(node.child, rels)
+
+    ids = header.getAttributesId(attributes)
+    if len(ids) == 0:
+        raise Exception('Invalid attributes for projection')
+
+    def project():
+        seen = set()
+        for i in rows:
+            row = tuple(i[j] for j in ids)
+            if row not in seen:
+                seen.add(row)
+                yield row
+    return Header(header[i] for i in ids), project()
+
+
+def _rename(node: parser.Node, rels) -> Stream:
+    params = {}
+    for i in node.prop.split(','):
+        q = i.split(parser.ARROW)
+        params[q[0].strip()] = q[1].strip()
+    header, rows = stream(node.child, rels)
+    return header.rename(params), rows
+
+
+def _join(node: parser.Node, rels) -> Stream:
+    lheader, lrows = stream(node.left, rels)
+    rheader, rrows = stream(node.right, rels)
+
+    shared = lheader.intersection(rheader)
+    sid = lheader.getAttributesId(shared)
+    oid = rheader.getAttributesId(shared)
+    noid = [i for i in range(len(rheader)) if i not in oid]
+    header = Header(lheader + tuple(rheader[i] for i in noid))
+
+    def join():
+        table = _hash_table(rrows, oid)
+        for i in lrows:
+            for j in table.get(tuple(i[l] for l in sid), ()):
+                yield i + tuple(j[l] for l in noid)
+    return header, join()
+
+
+def _thetajoin(node: parser.Node, rels) -> Stream:
+    lheader, lrows = stream(node.left, rels)
+    rheader, rrows = stream(node.right, rels)
+
+    if lheader.sharedAttributes(rheader) != 0:
+        raise Exception(
+            'Unable to perform product on relations with colliding attributes'
+        )
+    header = Header(lheader + rheader)
+    pairs, residual = _split_equalities(node.prop, lheader, rheader)
+    predicate = None
+    if residual is not None:
+        predicate = _Predicate(node.prop, header, residual)
+    sid = lheader.getAttributesId([i[0] for i in pairs])
+    oid = rheader.getAttributesId([i[1] for i in pairs])
+    band = None
+    if not pairs and residual is not None:
+        band = _range_condition(residual, lheader, rheader)
+
+    def thetajoin():
+        nonlocal lrows, rrows
+        if band is not None:
+            lrows = list(lrows)
+            rrows = list(rrows)
+            rows = _band_join(lrows, rrows, lheader, rheader, band, predicate)
+            if rows is not None:
+                yield from rows
+                return
+        table = _cast_hash_table(rrows, oid)
+        for i in lrows:
+            for j in table.get(tuple(i[l].autocast() for l in sid), ()):
+                row = i + j
+                if predicate is None or predicate(row):
+                    yield row
+    return header, thetajoin()
+
+
+def _multijoin(node: parser.Node, rels) -> Stream:
+    streams = [stream(i, rels) for i in parser.multijoin_operands(node)]
+    join = _generic_join if node.name == parser.MULTIJOIN else _reduced_join
+    return join([i[0] for i in streams], [i[1] for i in streams])
+
+
+def _product(node: parser.Node, rels) -> Stream:
+    lheader, lrows = stream(node.left, rels)
+    rheader, rrows = stream(node.right, rels)
+
+    if lheader.sharedAttributes(rheader) != 0:
+        raise Exception(
+            'Unable to perform product on relations with colliding attributes'
+        )
+
+    def product():
+        right = list(rrows)
+        for i in lrows:
+            for j in right:
+                yield i + j
+    return Header(lheader + rheader), product()
+
+
+def _set_operands(node: parser.Node, rels) -> Tuple[Header, Iterator[tuple], Iterator[tuple]]:
+    '''Returns the header and the two operands of a set operation, with
+    the tuples of the right operand using the same order of attributes.'''
+    lheader, lrows = stream(node.left, rels)
+    rheader, rrows = stream(node.right, rels)
+
+    if lheader == rheader:
+        return lheader, lrows, rrows
+    elif len(lheader) == len(rheader) and lheader.sharedAttributes(rheader) == len(lheader):
+        ids = rheader.getAttributesId(lheader)
+        return lheader, lrows, (tuple(i[j] for j in ids) for i in rrows)
+    raise TypeError('Relations differ: [%s] [%s]' % (
+        ','.join(lheader), ','.join(rheader)
+    ))
+
+
+def _union(node: parser.Node, rels) -> Stream:
+    header, lrows, rrows = _set_operands(node, rels)
+
+    def union():
+        right = set(rrows)
+        for i in lrows:
+            right.discard(i)
+            yield i
+        yield from right
+    return header, union()
+
+
+def _intersection(node: parser.Node, rels) -> Stream:
+    header, lrows, rrows = _set_operands(node, rels)
+
+    def intersection():
+        right = set(rrows)
+        return (i for i in lrows if i in right)
+    return header, _lazy(intersection)
+
+
+def _difference(node: parser.Node, rels) -> Stream:
+    header, lrows, rrows = _set_operands(node, rels)
+
+    def difference():
+        right = set(rrows)
+        return (i for i in lrows if i not in right)
+    return header, _lazy(difference)
+
+
+def _semijoin(node: parser.Node, rels) -> Stream:
+    lheader, lrows = stream(node.left, rels)
+    rheader, rrows = stream(node.right, rels)
+
+    shared = lheader.intersection(rheader)
+    sid = lheader.getAttributesId(shared)
+    oid = rheader.getAttributesId(shared)
+    keep = node.name == parser.SEMIJOIN
+
+    def semijoin():
+        keys = {tuple(j[l] for l in oid) for j in rrows}
+        return (i for i in lrows if (tuple(i[l] for l in sid) in keys) == keep)
+    return lheader, _lazy(semijoin)
+
+
+def _lazy(function) -> Iterator[Any]:
+    '''Calls function, which returns an iterator, only when the
+    first item is requested'''
+    yield from function()
+
+
+_unary = {
+    parser.SELECTION: _selection,
+    parser.PROJECTION: _projection,
+    parser.RENAME: _rename,
+}
+
+_binary = {
+    parser.JOIN: _join,
+    parser.PRODUCT: _product,
+    parser.THETAJOIN: _thetajoin,
+    parser.MULTIJOIN: _multijoin,
+    parser.REDUCEDJOIN: _multijoin,
+    parser.UNION: _union,
+    parser.INTERSECTION: _intersection,
+    parser.DIFFERENCE: _difference,
+    parser.SEMIJOIN: _semijoin,
+    parser.ANTIJOIN: _semijoin,
+}
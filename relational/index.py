@@ -0,0 +1,278 @@
+# Relational
+# Copyright (C) 2008-2017  Salvo "LtWorf" Tomaselli
+#
+# Relational is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# author Salvo "LtWorf" Tomaselli <tiposchi@tiscali.it>
+#
+# This module provides secondary indexes for relations.
+#
+# Indexes work on the autocast values, like selections do, and
+# remember whether the values of each attribute are all numbers,
+# all strings or mixed. A selection uses an index only when it compares
+# with constants of the same kind, in every other case comparing in
+# Python could raise an exception, or give a different result.
+
+import operator
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+HASH = 'hash'
+SORTED = 'sorted'
+
+NUMBER = 'number'
+STRING = 'string'
+OTHER = 'other'
+
+
+def kind_of(value: Any) -> str:
+    '''Returns the kind of a value, for the purpose of indexing'''
+    if type(value) in (int, float):
+        return NUMBER
+    elif isinstance(value, str):
+        return STRING
+    return OTHER
+
+
+class Index:
+
+    '''
+    Base class for indexes on some attributes of a relation.
+
+    ids are the positions of the attributes in the tuples.
+    '''
+    kind = None #  type: Optional[str]
+
+    def __init__(self, ids: List[int], content: Iterable[tuple] = ()) -> None:
+        self.ids = ids
+        # Kind of the values of every attribute, None if there are no values
+        self.kinds = [None for i in ids] #  type: List[Optional[str]]
+        for i in content:
+            self.add(i)
+
+    def key(self, row: tuple) -> tuple:
+        '''Returns the key of the tuple, and updates the kinds'''
+        key = tuple(row[i].autocast() for i in self.ids)
+        for pos, value in enumerate(key):
+            k = kind_of(value)
+            if self.kinds[pos] is None:
+                self.kinds[pos] = k
+            elif self.kinds[pos] != k:
+                self.kinds[pos] = OTHER
+        return key
+
+    def usable(self, pos: int, value: Any) -> bool:
+        '''Returns true if the index can be used to compare the attribute
+        at position pos with value'''
+        k = kind_of(value)
+        return k != OTHER and self.kinds[pos] in (k, None)
+
+    def add(self, row: tuple) -> None:
+        raise NotImplementedError()
+
+    def remove(self, row: tuple) -> None:
+        raise NotImplementedError()
+
+    def add_all(self, rows: Iterable[tuple]) -> None:
+        '''Adds many tuples at once'''
+        for row in rows:
+            self.add(row)
+
+    def remove_all(self, rows: Iterable[tuple]) -> None:
+        '''Removes many tuples at once'''
+        for row in rows:
+            self.remove(row)
+
+    def copy(self) -> 'Index':
+        raise NotImplementedError()
+
+
+class HashIndex(Index):
+
+    '''Index for equality conditions on all its attributes.'''
+    kind = HASH
+
+    def __init__(self, ids: List[int], content: Iterable[tuple] = ()) -> None:
+        self.table = {} #  type: Dict[tuple, Set[tuple]]
+        super().__init__(ids, content)
+
+    def add(self, row: tuple) -> None:
+        self.table.setdefault(self.key(row), set()).add(row)
+
+    def remove(self, row: tuple) -> None:
+        key = self.key(row)
+        rows = self.table.get(key)
+        if rows is None:
+            return
+        rows.discard(row)
+        if len(rows) == 0:
+            del self.table[key]
+
+    def lookup(self, key: tuple) -> Set[tuple]:
+        return self.table.get(key, set())
+
+    def copy(self) -> 'HashIndex':
+        r = HashIndex(self.ids)
+        r.kinds = list(self.kinds)
+        r.table = {k: set(v) for k, v in self.table.items()}
+        return r
+
+
+class SortedIndex(Index):
+
+    '''
+    Index on a single attribute, for equality and range conditions.
+
+    If values that can't be compared are inserted, the index stops being
+    maintained and can't be used anymore. Dates raise AttributeError
+    when compared with anything else.
+    '''
+    kind = SORTED
+
+    def __init__(self, ids: List[int], content: Iterable[tuple] = ()) -> None:
+        if len(ids) != 1:
+            raise Exception('Sorted indexes are on a single attribute')
+        self.keys = [] #  type: Optional[List[tuple]]
+        self.rows = [] #  type: List[tuple]
+        super().__init__(ids)
+        self.add_all(content)
+
+    def add(self, row: tuple) -> None:
+        key = self.key(row)
+        if self.keys is None:
+            return
+        try:
+            pos = bisect_right(self.keys, key)
+        except (TypeError, AttributeError):
+            self.keys = None
+            self.rows = []
+            return
+        self.keys.insert(pos, key)
+        self.rows.insert(pos, row)
+
+    def remove(self, row: tuple) -> None:
+        if self.keys is None:
+            return
+        key = self.key(row)
+        pos = bisect_left(self.keys, key)
+        while pos < len(self.keys) and self.keys[pos] == key:
+            if self.rows[pos] == row:
+                del self.keys[pos]
+                del self.rows[pos]
+                return
+            pos += 1
+
+    def add_all(self, rows: Iterable[tuple]) -> None:
+        '''Adds many tuples, sorting them once instead of inserting
+        them one by one'''
+        rows = list(rows)
+        if len(rows) < 2:
+            return super().add_all(rows)
+        keys = [self.key(row) for row in rows]
+        if self.keys is None:
+            return
+        # The index is already sorted, and sorting finds the two runs
+        pairs = list(zip(self.keys, self.rows))
+        pairs.extend(zip(keys, rows))
+        try:
+            pairs.sort(key=lambda i: i[0])
+        except (TypeError, AttributeError):
+            self.keys = None
+            self.rows = []
+            return
+        self.keys = [i[0] for i in pairs]
+        self.rows = [i[1] for i in pairs]
+
+    def remove_all(self, rows: Iterable[tuple]) -> None:
+        '''Removes many tuples, rebuilding the index once instead of
+        removing them one by one'''
+        removed = set(rows)
+        if len(removed) < 2:
+            return super().remove_all(removed)
+        if self.keys is None:
+            return
+        pairs = [(k, r) for k, r in zip(self.keys, self.rows) if r not in removed]
+        self.keys = [i[0] for i in pairs]
+        self.rows = [i[1] for i in pairs]
+
+    def usable(self, pos: int, value: Any) -> bool:
+        return self.keys is not None and super().usable(pos, value)
+
+    def range(self, low: Optional[Tuple[Any, bool]], high: Optional[Tuple[Any, bool]]) -> List[tuple]:
+        '''Returns the tuples whose value is between low and high.
+
+        Both bounds are (value, inclusive) or None, if unbounded.'''
+        start = 0
+        end = len(self.keys)
+        if low is not None:
+            value, inclusive = low
+            start = (bisect_left if inclusive else bisect_right)(self.keys, (value,))
+        if high is not None:
+            value, inclusive = high
+            end = (bisect_right if inclusive else bisect_left)(self.keys, (value,))
+        return self.rows[start:end]
+
+    def copy(self) -> 'SortedIndex':
+        r = SortedIndex(self.ids)
+        r.kinds = list(self.kinds)
+        r.keys = None if self.keys is None else list(self.keys)
+        r.rows = list(self.rows)
+        return r
+
+
+def create(kind: str, ids: List[int], content: Iterable[tuple]) -> Index:
+    '''Creates an index of the given kind'''
+    if kind == HASH:
+        return HashIndex(ids, content)
+    elif kind == SORTED:
+        return SortedIndex(ids, content)
+    raise Exception('Unknown kind of index: %s' % kind)
+
+
+def lookup(indexes: Dict[tuple, Index], conditions: List[Tuple[str, Any, Any]]) -> Optional[Iterable[tuple]]:
+    '''
+    conditions is a list of (attribute, operator, constant), as
+    returned by vectorized.parse_conditions.
+
+    Returns the tuples that might satisfy the conditions, using one
+    of the indexes, or None if no index can be used.
+    '''
+    for attributes, index in indexes.items():
+        if index.kind != HASH:
+            continue
+        key = []
+        for pos, attribute in enumerate(attributes):
+            for name, op, value in conditions:
+                if name == attribute and op is operator.eq and index.usable(pos, value):
+                    key.append(value)
+                    break
+            else:
+                break
+        else:
+            return index.lookup(tuple(key))
+
+    for attributes, index in indexes.items():
+        if index.kind != SORTED:
+            continue
+        low = high = None
+        for name, op, value in conditions:
+            if name != attributes[0] or not index.usable(0, value):
+                continue
+            if op in (operator.eq, operator.ge, operator.gt):
+                low = (value, op != operator.gt)
+            if op in (operator.eq, operator.le, operator.lt):
+                high = (value, op != operator.lt)
+        if low is not None or high is not None:
+            return index.range(low, high)
+    return None
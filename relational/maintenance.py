@@ -23,10 +23,13 @@ import urllib.parse
 import os.path
 import pickle
 import base64
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 from relational.relation import Relation
 from relational import parser
+from relational import engine
+from relational import querycache
+from relational import parallel
 from relational.rtypes import is_valid_relation_name
 
 
@@ -83,11 +86,50 @@ class UserInterface:
 
     '''It is used to provide services to the user interfaces, in order to
     reduce the amount of duplicated code present in different user interfaces.
+
+    If pipelined is true, queries are executed by relational.engine,
+    otherwise they are converted to Python code and evaluated.
+
+    Parsed queries are kept in cache, a relational.querycache.QueryCache.
+
+    If result_cache_size is not 0, the results of queries and of their
+    subexpressions are kept in results, a relational.querycache.ResultCache
+    using up to about that many bytes. In this case every intermediate
+    result is computed, to be reused by later queries, instead of being
+    pipelined.
+
+    If workers is not 0, independent parts of queries, and independent
+    queries in multi_execute, are executed at the same time by that many
+    processes, when they involve at least min_tuples tuples. Results are
+    not cached in this case. The processes are stopped by close(), or at
+    the end of a with block.
     '''
 
-    def __init__(self) -> None:
+    def __init__(self, pipelined: bool = True, result_cache_size: int = 0,
+                 workers: int = 0, min_tuples: int = parallel.MIN_TUPLES) -> None:
+        self.pipelined = pipelined
+        self.cache = querycache.QueryCache()
+        if result_cache_size > 0:
+            self.results = querycache.ResultCache(result_cache_size) #  type: Optional[querycache.ResultCache]
+        else:
+            self.results = None
+        if workers:
+            self.scheduler = parallel.Scheduler(workers, min_tuples) #  type: Optional[parallel.Scheduler]
+        else:
+            self.scheduler = None
         self.session_reset()
 
+    def __enter__(self) -> 'UserInterface':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        '''Stops the processes used to execute queries in parallel'''
+        if self.scheduler is not None:
+            self.scheduler.close()
+
     def load(self, filename: str, name: str) -> None:
         '''Loads a relation from file, and gives it a name to
         be used in subsequent queries.'''
@@ -149,6 +191,16 @@ class UserInterface:
             raise Exception('Invalid name for destination relation')
         self.relations[name] = rel
 
+    def refresh_statistics(self, name: Optional[str] = None) -> None:
+        '''Computes again the statistics of a relation, or of all
+        the relations if name is None.'''
+        if name is None:
+            for rel in self.relations.values():
+                rel.refresh_statistics()
+        else:
+            self.relations[name].refresh_statistics()
+        self.cache.clear_optimized()
+
     def suggest_name(self, filename: str) -> Optional[str]:
         '''
         Returns a possible name for a relation, given
@@ -175,8 +227,14 @@ class UserInterface:
         if not is_valid_relation_name(relname):
             raise Exception('Invalid name for destination relation')
 
-        expr = parser.parse(query)
-        result = expr(self.relations)
+        if self.scheduler is not None:
+            result = self.scheduler.execute(self.cache.tree(query), self.relations)
+        elif self.results is not None:
+            result = self.results.execute(self.cache.tree(query), self.relations)
+        elif self.pipelined:
+            result = engine.execute(self.cache.tree(query), self.relations)
+        else:
+            result = eval(self.cache.code(query), self.relations)
         self.relations[relname] = result
         return result
 
@@ -206,6 +264,8 @@ class UserInterface:
         '''
         r = Relation()
         queries = query.split('\n')
+        if self.scheduler is not None:
+            return self._parallel_execute(queries)
         for query in queries:
             if query.strip() == '':
                 continue
@@ -220,3 +280,25 @@ class UserInterface:
                     str(e)
                 ))
         return r
+
+    def _parallel_execute(self, queries: List[str]) -> Relation:
+        '''Executes the queries with the scheduler, at the same time
+        when they don't depend on each other'''
+        assignments = []
+        for query in queries:
+            if query.strip() == '':
+                continue
+            relname, query = self.split_query(query)
+            try:
+                assignments.append((relname, self.cache.tree(query)))
+            except Exception as e:
+                raise Exception('Error in query: %s\n%s' % (
+                    query,
+                    str(e)
+                ))
+        if not assignments:
+            return Relation()
+
+        results = self.scheduler.execute_queries(assignments, self.relations)
+        self.relations.update(results)
+        return results[assignments[-1][0]]
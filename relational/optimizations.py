@@ -28,11 +28,14 @@
 # The class used is defined in optimizer module.
 # A function will have to return the number of changes performed on the tree.
 
+from functools import partial
 from io import StringIO
 from tokenize import generate_tokens
 
 
 from relational import parser
+from relational import cost
+from relational.relation import _split_equalities, _range_condition, _join_tree
 
 sel_op = (
     '//=', '**=', 'and', 'not', 'in', '//', '**', '<<', '>>', '==', '!=', '>=', '<=', '+=', '-=',
@@ -51,6 +54,12 @@ PROJECTION = parser.PROJECTION
 SELECTION = parser.SELECTION
 RENAME = parser.RENAME
 ARROW = parser.ARROW
+THETAJOIN = parser.THETAJOIN
+MULTIJOIN = parser.MULTIJOIN
+REDUCEDJOIN = parser.REDUCEDJOIN
+
+# Longest chains of joins that are ordered by dynamic programming
+DP_JOIN_RELATIONS = 10
 
 
 def find_duplicates(node, dups=None):
@@ -94,10 +103,29 @@ def replace_node(replace, replacement):
         replace.child = replacement.child
         replace.prop = replacement.prop
     elif replace.kind == parser.BINARY:
+        if replace.name == parser.THETAJOIN:
+            replace.prop = replacement.prop
         replace.right = replacement.right
         replace.left = replacement.left
 
 
+def copy_node(node):
+    '''Returns a copy of the tree, that can be modified
+    without changing the original one'''
+    r = parser.Node()
+    r.kind = node.kind
+    r.name = node.name
+    if node.kind == parser.UNARY:
+        r.prop = node.prop
+        r.child = copy_node(node.child)
+    elif node.kind == parser.BINARY:
+        if node.name == parser.THETAJOIN:
+            r.prop = node.prop
+        r.left = copy_node(node.left)
+        r.right = copy_node(node.right)
+    return r
+
+
 def recoursive_scan(function, node, rels=None):
     '''Does a recoursive optimization on the tree.
 
@@ -450,6 +478,9 @@ def swap_rename_projection(n):
             n.child.prop += i + ','
         n.child.prop = n.child.prop[:-1]
 
+        if len(_vars) == 0:  # Nothing left to rename, removing the rename op
+            replace_node(n, n.child)
+
     return changes + recoursive_scan(swap_rename_projection, n)
 
 
@@ -604,7 +635,7 @@ def selection_and_product(n, rels):
     i contains attributes belonging to Q and l contains attributes belonging to both'''
     changes = 0
 
-    if n.name == SELECTION and n.child.name in (PRODUCT, JOIN):
+    if n.name == SELECTION and n.child.name in (PRODUCT, JOIN, THETAJOIN):
         l_attr = n.child.left.result_format(rels)
         r_attr = n.child.right.result_format(rels)
 
@@ -708,6 +739,332 @@ def useless_projection(n, rels):
 
     return changes + recoursive_scan(useless_projection, n, rels)
 
+
+def selection_to_thetajoin(n, rels):
+    '''
+    Locates things like σ k (R * Q) where k contains a condition
+    like a == b, where a is an attribute of R and b of Q, and
+    replaces them with R ⋈θ k (Q), which is done with a hash table.
+    Conditions like a < b are used in the same way, since they
+    allow to sort Q instead of doing the product.
+
+    Also merges σ k (R ⋈θ j (Q)) into R ⋈θ j and k (Q).
+    '''
+    changes = 0
+    if n.name == SELECTION and n.child.name in (PRODUCT, JOIN, THETAJOIN):
+        child = n.child
+        l_attr = child.left.result_format(rels)
+        r_attr = child.right.result_format(rels)
+
+        if child.name == THETAJOIN:
+            prop = '(%s) and (%s)' % (child.prop, n.prop)
+        elif set(l_attr).intersection(r_attr):
+            # Natural join on some attributes
+            prop = None
+        else:
+            pairs, residual = _split_equalities(n.prop, l_attr, r_attr)
+            if pairs or (residual is not None and _range_condition(residual, l_attr, r_attr)):
+                prop = n.prop
+            else:
+                prop = None
+
+        if prop is not None:
+            n.kind = parser.BINARY
+            n.name = THETAJOIN
+            n.prop = prop
+            n.left = child.left
+            n.right = child.right
+            changes = 1
+
+    return changes + recoursive_scan(selection_to_thetajoin, n, rels)
+
+
+def projection_pushdown(n, rels):
+    '''
+    Locates projections over joins and products, like
+        π a,b (R ⋈ Q)
+    and adds projections on R and Q, keeping only the attributes
+    used by the projection and the ones needed for the join.
+
+    Selections and renames between the projection and the join are
+    passed through, keeping also the attributes used by the
+    selections. Unions are not, since their operands would end up
+    with different attributes.
+    '''
+    changes = 0
+    if n.name == PROJECTION:
+        needed = set(i.strip() for i in n.prop.split(','))
+        changes = _push_projection(n.child, needed, rels)
+    return changes + recoursive_scan(projection_pushdown, n, rels)
+
+
+def _push_projection(n, needed, rels):
+    '''Narrows the operands of the joins below n, knowing that
+    only the attributes in needed are used from the result of n'''
+    if n.name == SELECTION:
+        attributes = set(n.child.result_format(rels))
+        used = set(i.split('.')[0] for i in tokenize_select(n.prop))
+        return _push_projection(n.child, needed | (used & attributes), rels)
+    elif n.name == RENAME:
+        _vars = {}
+        for i in n.prop.split(','):
+            q = i.split(ARROW)
+            _vars[q[1].strip()] = q[0].strip()
+        return _push_projection(n.child, set(_vars.get(i, i) for i in needed), rels)
+    elif n.name in parser.multiway_operators:
+        # The operands are narrowed, not the partial multiway joins
+        operands = parser.multijoin_operands(n)
+        attributes = [i.result_format(rels) for i in operands]
+        changes = 0
+        for pos, i in enumerate(operands):
+            shared = set()
+            for j in attributes[:pos] + attributes[pos + 1:]:
+                shared.update(j)
+            changes += _narrow(i, attributes[pos], needed | shared)
+        return changes
+    elif n.name == THETAJOIN:
+        l_attr = n.left.result_format(rels)
+        r_attr = n.right.result_format(rels)
+        used = set(i.split('.')[0] for i in tokenize_select(n.prop))
+        return _narrow(n.left, l_attr, needed | used) + _narrow(n.right, r_attr, needed | used)
+    elif n.name in (JOIN, JOIN_LEFT, JOIN_RIGHT, JOIN_FULL, PRODUCT, parser.SEMIJOIN, parser.ANTIJOIN):
+        l_attr = n.left.result_format(rels)
+        r_attr = n.right.result_format(rels)
+        shared = set(l_attr).intersection(r_attr)
+        if n.name in (parser.SEMIJOIN, parser.ANTIJOIN):
+            r_needed = shared
+        else:
+            r_needed = needed | shared
+        return _narrow(n.left, l_attr, needed | shared) + _narrow(n.right, r_attr, r_needed)
+    return 0
+
+
+def _narrow(n, attributes, needed):
+    '''Projects n on the attributes in needed, if it has others'''
+    kept = [i for i in attributes if i in needed]
+    if len(kept) == len(attributes) or len(kept) == 0:
+        return 0
+
+    if n.name == PROJECTION:
+        n.prop = ','.join(kept)
+        return 1
+
+    child = parser.Node()
+    replace_node(child, n)
+
+    n.kind = parser.UNARY
+    n.name = PROJECTION
+    n.prop = ','.join(kept)
+    n.child = child
+    return 1
+
+
+def _join_leaves(n, leaves, rels):
+    '''Appends to leaves the operands of the chain of joins and
+    products starting at n, with their estimates.
+
+    Returns the attributes of n, or None if the estimates are not
+    available or if a product has operands with attributes in common,
+    since it would fail.'''
+    if n.name not in (JOIN, PRODUCT):
+        e = cost.estimate(n, rels)
+        if e is None:
+            return None
+        leaves.append((n, e))
+        return set(e.attributes)
+    left = _join_leaves(n.left, leaves, rels)
+    right = _join_leaves(n.right, leaves, rels)
+    if left is None or right is None or (n.name == PRODUCT and left & right):
+        return None
+    return left | right
+
+
+def _chain_operands(n, nodes):
+    if n.name in (JOIN, PRODUCT):
+        _chain_operands(n.left, nodes)
+        _chain_operands(n.right, nodes)
+    else:
+        nodes.append(n)
+
+
+def _join_node(left, right, left_estimate, right_estimate):
+    '''Joins the two plans, with the smaller one on the right, where
+    the hash table is built'''
+    if left_estimate.rows < right_estimate.rows:
+        left, right = right, left
+    r = parser.Node()
+    r.kind = parser.BINARY
+    if left_estimate.attributes.keys() & right_estimate.attributes.keys():
+        r.name = JOIN
+    else:
+        r.name = PRODUCT
+    r.left = left
+    r.right = right
+    return r
+
+
+def _dp_join_order(leaves, estimates):
+    '''Finds the cheapest order by dynamic programming on the sets of
+    operands, joining only sets that have attributes in common.
+
+    Returns None if the operands can't all be joined that way.'''
+    count = len(leaves)
+    # Set of operands, as bitmask -> (estimate, plan)
+    best = {1 << i: (estimates[i], leaves[i]) for i in range(count)}
+    attributes = {1 << i: set(estimates[i].attributes) for i in range(count)}
+
+    for size in range(2, count + 1):
+        for subset in range(1, 1 << count):
+            if bin(subset).count('1') != size:
+                continue
+            # Every split is seen once, with the lowest operand on the left
+            lowest = subset & -subset
+            left = (subset - 1) & subset
+            while left:
+                right = subset ^ left
+                if left & lowest and left in best and right in best and \
+                        attributes[left] & attributes[right]:
+                    l_estimate, l_plan = best[left]
+                    r_estimate, r_plan = best[right]
+                    e = cost.join(l_estimate, r_estimate)
+                    if subset not in best or e.cost < best[subset][0].cost:
+                        best[subset] = (e, _join_node(l_plan, r_plan, l_estimate, r_estimate))
+                        attributes[subset] = attributes[left] | attributes[right]
+                left = (left - 1) & subset
+    return best.get((1 << count) - 1)
+
+
+def _greedy_join_order(leaves, estimates):
+    '''Joins the pair of operands with the smallest result, until one is
+    left. Products are done only when no operands have attributes in
+    common, smallest first.'''
+    parts = list(zip(estimates, leaves))
+    while len(parts) > 1:
+        chosen = None
+        for i in range(len(parts)):
+            for j in range(i + 1, len(parts)):
+                if parts[i][0].attributes.keys() & parts[j][0].attributes.keys():
+                    e = cost.join(parts[i][0], parts[j][0])
+                    if chosen is None or e.rows < chosen[0].rows:
+                        chosen = (e, i, j)
+        if chosen is None:
+            parts.sort(key=lambda p: p[0].rows)
+            chosen = (cost.join(parts[0][0], parts[1][0]), 0, 1)
+        e, i, j = chosen
+        node = _join_node(parts[i][1], parts[j][1], parts[i][0], parts[j][0])
+        parts.pop(j)
+        parts[i] = (e, node)
+    return parts[0]
+
+
+def join_order(n, rels):
+    '''
+    Finds the chains of natural joins and products, like
+        A ⋈ B ⋈ C * D
+    and rebuilds them in the order that gives the smallest
+    estimated intermediate results, avoiding products when
+    possible.
+
+    Chains of up to DP_JOIN_RELATIONS operands are ordered by dynamic
+    programming, longer ones greedily.
+    '''
+    if n.name not in (JOIN, PRODUCT):
+        return recoursive_scan(join_order, n, rels)
+
+    changes = 0
+    leaves = []
+    if _join_leaves(n, leaves, rels) is not None:
+        operands = [i[0] for i in leaves]
+        estimates = [i[1] for i in leaves]
+        best = None
+        if len(leaves) <= DP_JOIN_RELATIONS:
+            best = _dp_join_order(operands, estimates)
+        if best is None:
+            best = _greedy_join_order(operands, estimates)
+        # Only strictly cheaper orders, so that it can't go back and forth
+        if best[0].cost < cost.cost(n, rels) * (1 - 1e-9):
+            replace_node(n, best[1])
+            changes = 1
+
+    nodes = []
+    _chain_operands(n, nodes)
+    for i in nodes:
+        changes += join_order(i, rels)
+    return changes
+
+def multiway_join(n, rels):
+    '''
+    Finds the chains of natural joins that are cyclic, like
+        R ⋈ S ⋈ T
+    where R has attributes a, b, S has b, c and T has a, c, and
+    replaces them with the multiway join
+        R ⋈* S ⋈* T
+    that joins all the operands at once, without the intermediate
+    results of the joins of two operands.
+    '''
+    if n.name not in (JOIN, PRODUCT):
+        return recoursive_scan(multiway_join, n, rels)
+
+    changes = 0
+    leaves = []
+    if _join_leaves(n, leaves, rels) is not None and len(leaves) > 2 and \
+            _join_tree([set(i[1].attributes) for i in leaves]) is None:
+        replace_node(n, _multiway_chain([i[0] for i in leaves], MULTIJOIN))
+        changes = 1
+
+    nodes = []
+    _chain_operands(n, nodes)
+    for i in nodes:
+        changes += multiway_join(i, rels)
+    return changes
+
+
+def semijoin_reduction(n, rels, always=False):
+    '''
+    Finds the chains of natural joins that are acyclic, like
+        orders ⋈ lineitems ⋈ products ⋈ suppliers
+    and replaces them with
+        orders ⋈⋉ lineitems ⋈⋉ products ⋈⋉ suppliers
+    which removes the tuples that don't take part in the result with
+    semijoins, before joining them, when that is estimated to be
+    cheaper.
+
+    The estimates assume that attributes are independent, so they
+    can't see the tuples that won't match. If always is set, the
+    chains are replaced anyway.
+    '''
+    if n.name not in (JOIN, PRODUCT):
+        return recoursive_scan(partial(semijoin_reduction, always=always), n, rels)
+
+    changes = 0
+    leaves = []
+    if _join_leaves(n, leaves, rels) is not None and len(leaves) > 2:
+        parents = _join_tree([set(i[1].attributes) for i in leaves])
+        if parents is not None and any(i is not None for i in parents):
+            chain = _multiway_chain([i[0] for i in leaves], REDUCEDJOIN)
+            if always or cost.cost(chain, rels) < cost.cost(n, rels) * (1 - 1e-9):
+                replace_node(n, chain)
+                changes = 1
+
+    nodes = []
+    _chain_operands(n, nodes)
+    for i in nodes:
+        changes += semijoin_reduction(i, rels, always)
+    return changes
+
+
+def _multiway_chain(operands, name):
+    '''Returns the chain of the operator name on the operands'''
+    chain = operands[0]
+    for i in operands[1:]:
+        r = parser.Node()
+        r.kind = parser.BINARY
+        r.name = name
+        r.left = chain
+        r.right = i
+        chain = r
+    return chain
+
 general_optimizations = [
     duplicated_select,
     down_to_unions_subtractions_intersections,
@@ -725,6 +1082,18 @@ specific_optimizations = [
     selection_and_product,
     projection_and_union,
     useless_projection,
+    selection_to_thetajoin,
+    join_order,
+    multiway_join,
+    semijoin_reduction,
+    projection_pushdown,
+]
+
+# Optimizations that need the estimates of the cost
+cost_based_optimizations = [
+    join_order,
+    multiway_join,
+    semijoin_reduction,
 ]
 
 if __name__ == "__main__":
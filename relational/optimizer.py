@@ -22,9 +22,11 @@
 # relational query, or it can be a parse tree for a relational expression (ie: class parser.node).
 # The functions will always return a string with the optimized query, but if a parse tree was provided,
 # the parse tree itself will be modified accordingly.
-from typing import Union, Optional, Dict, Any
+from functools import partial
+from typing import Union, Optional, Dict, Any, Callable, List
 
 from relational import optimizations
+from relational import cost
 from relational.parser import Node, RELATION, UNARY, BINARY, op_functions, tokenize, tree
 from relational import querysplit
 from relational.maintenance import UserInterface
@@ -37,6 +39,21 @@ def optimize_program(code, rels: ContextDict):
     Optimize an entire program, composed by multiple expressions
     and assignments.
     '''
+    return str(_program(code, rels))
+
+
+def execute_program(code, rels: ContextDict):
+    '''
+    Executes an entire program, composed by multiple expressions
+    and assignments, and returns the result of the last one.
+
+    The program is optimized and the repeated subexpressions are
+    executed only once. rels is not modified.
+    '''
+    return querysplit.execute(_program(code, rels), rels)
+
+
+def _program(code, rels: ContextDict) -> querysplit.Program:
     lines = code.split('\n')
     context = {} #  type: ContextDict
 
@@ -50,10 +67,10 @@ def optimize_program(code, rels: ContextDict):
         optimizations.replace_leaves(parsed, context)
         context[res] = parsed
     node = optimize_all(context[last_res], rels, tostr=False)
-    return querysplit.split(node, rels)
+    return querysplit.program(node, rels)
 
 
-def optimize_all(expression: Union[str, Node], rels: ContextDict, specific: bool = True, general: bool = True, debug: Optional[list] = None, tostr: bool = True) -> Union[str, Node]:
+def optimize_all(expression: Union[str, Node], rels: ContextDict, specific: bool = True, general: bool = True, debug: Optional[list] = None, tostr: bool = True, reduce_joins: bool = False) -> Union[str, Node]:
     '''This function performs all the available optimizations.
 
     expression : see documentation of this module
@@ -62,7 +79,20 @@ def optimize_all(expression: Union[str, Node], rels: ContextDict, specific: bool
     general: True if it has to perform general optimizations
     debug: if a list is provided here, after the end of the function, it
         will contain the query repeated many times to show the performed
-        steps.
+        steps. If the cost can be estimated, every step also shows its
+        estimated cost.
+    reduce_joins: True if all the acyclic chains of joins have to be
+        done after a semijoin reduction (⋈⋉), that removes the tuples
+        not taking part in the result, even if the estimated cost is
+        higher.
+
+    If rels contains all the relations used by the expression, the
+    cost of the plans is estimated from the statistics of the relations.
+    Then the optimizations are performed both unconditionally and
+    skipping the ones that make the plan more expensive, and the
+    cheapest plan among those two and the original one is returned.
+    If the estimates fail, the optimizations that don't need them are
+    performed unconditionally.
 
     Return value: this will return an optimized version of the expression'''
     if isinstance(expression, str):
@@ -72,30 +102,90 @@ def optimize_all(expression: Union[str, Node], rels: ContextDict, specific: bool
     else:
         raise (TypeError("expression must be a string or a node"))
 
+    try:
+        original = optimizations.copy_node(n)
+        steps = _optimize(n, _rules(specific, general, rels), rels, reduce_joins)
+    except Exception:
+        # The statistics of some relation can't be computed
+        optimizations.replace_node(n, original)
+        steps = []
+        _rewrite(n, _rules(specific, general, rels, estimates=False), steps)
+
     if isinstance(debug, list):
-        dbg = True
+        debug.extend(steps)
+    if tostr:
+        return str(n)
     else:
-        dbg = False
+        return n
 
+
+def _rules(specific: bool, general: bool, rels: ContextDict, estimates: bool = True) -> List[Callable[[Node], int]]:
+    '''Returns the optimizations to perform, without the ones
+    needing the estimates of the cost if estimates is false.'''
+    rules = [] #  type: List[Callable[[Node], int]]
+    if specific:
+        rules.extend(
+            partial(i, rels=rels) for i in optimizations.specific_optimizations
+            if estimates or i not in optimizations.cost_based_optimizations
+        )
+    if general:
+        rules.extend(optimizations.general_optimizations)
+    return rules
+
+
+def _optimize(n: Node, rules: list, rels: ContextDict, reduce_joins: bool) -> List[str]:
+    '''Optimizes n, guided by the cost if it can be estimated,
+    and returns the steps'''
+    original_cost = None if rels is None else cost.cost(n, rels)
+    if original_cost is None:
+        steps = [] #  type: List[str]
+        _rewrite(n, rules, steps)
+    else:
+        # Candidate plans, preferred in this order if they cost the same
+        candidates = []
+        for guided in (False, True):
+            plan = optimizations.copy_node(n)
+            steps = []
+            plan_cost = _rewrite(plan, rules, steps, rels, guided)
+            candidates.append((plan_cost, plan, steps))
+        candidates.append((original_cost, optimizations.copy_node(n), []))
+        _, plan, steps = min(candidates, key=lambda i: i[0])
+        optimizations.replace_node(n, plan)
+
+        if reduce_joins and optimizations.semijoin_reduction(n, rels, always=True):
+            steps = steps + ['%s    [cost ~%d]' % (n, round(cost.cost(n, rels)))]
+    return steps
+
+
+def _rewrite(n: Node, rules: list, steps: List[str], rels: Optional[ContextDict] = None, guided: bool = False) -> Optional[float]:
+    '''Performs the rules on the tree until they change nothing, and
+    returns the estimated cost of the result.
+
+    If guided is true, the changes that increase the cost are undone.
+
+    steps will contain the tree after every change, with its cost
+    if rels is provided.'''
+    current = None if rels is None else cost.cost(n, rels)
     total = 1
     while total != 0:
         total = 0
-        if specific:
-            for i in optimizations.specific_optimizations:
-                res = i(n, rels)  # Performs the optimization
-                if res != 0 and dbg:
-                    debug.append(str(n))
-                total += res
-        if general:
-            for i in optimizations.general_optimizations:
-                res = i(n)  # Performs the optimization
-                if res != 0 and dbg:
-                    debug.append(str(n))
-                total += res
-    if tostr:
-        return str(n)
-    else:
-        return n
+        for rule in rules:
+            if guided:
+                backup = optimizations.copy_node(n)
+            res = rule(n)  # Performs the optimization
+            if res == 0:
+                continue
+            if rels is not None:
+                new = cost.cost(n, rels)
+                if guided and new > current:
+                    optimizations.replace_node(n, backup)
+                    continue
+                current = new
+                steps.append('%s    [cost ~%d]' % (n, round(current)))
+            else:
+                steps.append(str(n))
+            total += res
+    return current
 
 
 def specific_optimize(expression, rels: ContextDict):
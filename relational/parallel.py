@@ -0,0 +1,417 @@
+# Relational
+# Copyright (C) 2008-2017  Salvo "LtWorf" Tomaselli
+#
+# Relational is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# author Salvo "LtWorf" Tomaselli <tiposchi@tiscali.it>
+#
+# This module executes independent parts of queries at the same time,
+# in different processes.
+#
+# In a tree, the operands of a binary operation don't depend on each
+# other, so they can be executed by different processes, and the
+# operation is then done with their results. In a list of assignments,
+# like a program from querysplit or the lines given to multi_execute, a
+# query can start as soon as the queries it uses are done.
+#
+# Relations are sent to the processes and back in the form of Packed:
+# for every attribute the list of its distinct values and an array with
+# the position of the value of each tuple in that list.
+#
+# A join between relations that are already divided in partitions, with
+# the hash of the join key, is done by giving every pair of partitions to
+# a different process. Dividing them takes about as long as doing the
+# join in the current process, so it is never done automatically.
+#
+# Moving relations between processes is not free, so work involving
+# fewer than min_tuples tuples is done in the current process.
+
+import atexit
+import os
+from array import array
+from collections import ChainMap
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, List, Optional, Tuple, Union
+
+from relational import parser
+from relational import engine
+from relational.relation import Relation, Header
+from relational.rtypes import Rstring
+
+# Below this amount of tuples in the operands, work is not sent to
+# other processes
+MIN_TUPLES = 50000
+
+
+class Packed:
+
+    '''
+    Compact form of a relation, to be sent to other processes.
+
+    Every attribute has its list of distinct values, as plain strings,
+    and an array of positions in that list, one for each tuple.
+
+    Tuples are added with add(), and finish() must be called before
+    sending it.
+    '''
+
+    def __init__(self, header: Tuple[str, ...]) -> None:
+        self.header = tuple(header)
+        self.size = 0
+        self.values = [] #  type: List[List[str]]
+        self.codes = [array('I') for i in self.header] #  type: List[array]
+        self._known = [{} for i in self.header] #  type: Optional[List[Dict[str, int]]]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, row: tuple) -> None:
+        self.size += 1
+        for value, column, known in zip(row, self.codes, self._known):
+            code = known.get(value)
+            if code is None:
+                code = known[value] = len(known)
+            column.append(code)
+
+    def finish(self) -> 'Packed':
+        if self._known is None:
+            return self
+        for pos, known in enumerate(self._known):
+            self.values.append([str.__str__(i) for i in known])
+            # Using the smallest integers that can hold the positions
+            if len(known) <= 0x100:
+                self.codes[pos] = array('B', self.codes[pos])
+            elif len(known) <= 0x10000:
+                self.codes[pos] = array('H', self.codes[pos])
+        self._known = None
+        return self
+
+    def unpack(self) -> Relation:
+        '''Returns the relation'''
+        r = Relation()
+        r.header = Header(self.header)
+        # Equal values of an attribute are the same object
+        values = [[Rstring(i) for i in v] for v in self.values]
+        if len(self.header) == 0:
+            r.content = {()} if self.size else set()
+            return r
+        r.content = set(zip(*(
+            map(v.__getitem__, c) for v, c in zip(values, self.codes)
+        )))
+        return r
+
+
+def pack(rel: Relation) -> Packed:
+    '''Returns the Packed form of a relation'''
+    r = Packed(rel.header)
+    for i in rel.content:
+        r.add(i)
+    return r.finish()
+
+
+def _run(node: parser.Node, rels: Dict[str, Packed]) -> Packed:
+    '''Executes a tree in another process'''
+    return pack(engine.execute(node, {k: v.unpack() for k, v in rels.items()}))
+
+
+def _operation(name: str, left: Packed, right: Packed) -> Packed:
+    '''Executes an operation of Relation in another process'''
+    return pack(getattr(left.unpack(), name)(right.unpack()))
+
+
+Value = Union[Relation, Packed]
+
+# Operations that can be done on partitions
+PARTITIONED = ('join', 'outer_left')
+
+
+def _relation(value: Value) -> Relation:
+    if isinstance(value, Packed):
+        return value.unpack()
+    return value
+
+
+def _packed(value: Value) -> Packed:
+    if isinstance(value, Packed):
+        return value
+    return pack(value)
+
+
+class Scheduler:
+
+    '''
+    Executes queries using up to the given number of
+    processes (by default, one for each CPU).
+
+    The processes are started when they are first needed, and
+    are stopped by close(), or when the interpreter exits.
+    '''
+
+    def __init__(self, workers: Optional[int] = None, min_tuples: int = MIN_TUPLES) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.min_tuples = min_tuples
+        self._pool = None #  type: Optional[ProcessPoolExecutor]
+
+    def __enter__(self) -> 'Scheduler':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        '''Stops the processes'''
+        if self._pool is not None:
+            atexit.unregister(self.close)
+            self._pool.shutdown()
+            self._pool = None
+
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+            atexit.register(self.close)
+        return self._pool
+
+    def execute(self, node: parser.Node, rels: Dict[str, Relation]) -> Relation:
+        '''
+        Executes a tree.
+
+        The tree is divided in up to workers subtrees, that are
+        executed at the same time, then the rest of the tree is
+        executed with their results.
+        '''
+        tasks = self._divide(node, rels)
+        if len(tasks) < 2:
+            return engine.execute(node, rels)
+
+        pool = self.pool()
+        packed = {} #  type: Dict[str, Packed]
+        futures = {}
+        for pos, task in enumerate(tasks):
+            if task.kind == parser.RELATION:
+                continue
+            operands = {}
+            for i in _relation_names(task):
+                if i not in packed:
+                    packed[i] = pack(_get_relation(i, rels))
+                operands[i] = packed[i]
+            futures[id(task)] = '#%d' % pos, pool.submit(_run, task, operands)
+
+        results = {} #  type: Dict[str, Relation]
+        for name, future in futures.values():
+            results[name] = future.result().unpack()
+
+        ids = {k: v[0] for k, v in futures.items()}
+        return engine.execute(_substitute(node, ids), ChainMap(results, rels))
+
+    def partitioned(self, operation: str, left: List[Packed], right: List[Packed]) -> Relation:
+        '''
+        Executes operation, the name of one of the methods of Relation in
+        PARTITIONED, as left.operation(right).
+
+        left and right are lists of partitions returned by partition(),
+        with the same number of partitions, on the attributes they have
+        in common. Matching tuples are in partitions in the same position,
+        so every pair of partitions is done by a different process, and
+        the results don't overlap.
+        '''
+        if operation not in PARTITIONED:
+            raise Exception('Operation can\'t be partitioned: %s' % operation)
+        if len(left) != len(right) or len(left) == 0:
+            raise Exception('The operands must have the same number of partitions')
+
+        pool = self.pool()
+        futures = [
+            pool.submit(_operation, operation, l, r)
+            for l, r in zip(left, right)
+        ]
+
+        r = None
+        for future in futures:
+            part = future.result().unpack()
+            if r is None:
+                r = part
+            else:
+                r.content.update(part.content)
+        return r
+
+    def _divide(self, node: parser.Node, rels: Dict[str, Relation]) -> List[parser.Node]:
+        '''Returns the subtrees to execute at the same time.
+
+        Starting from the whole tree, the biggest subtree is replaced by
+        the two operands of its topmost binary operation, while both of
+        them are operations on enough tuples and there are fewer
+        subtrees than workers.'''
+        tasks = [node]
+        while len(tasks) < self.workers:
+            candidates = []
+            for pos, task in enumerate(tasks):
+                operation = _binary(task)
+                if operation is None or parser.RELATION in (operation.left.kind, operation.right.kind):
+                    # Nothing to execute at the same time
+                    continue
+                if operation.name in parser.multiway_operators:
+                    # Its left operand is not a join to do by itself
+                    continue
+                left = _cost(operation.left, rels)
+                right = _cost(operation.right, rels)
+                if min(left, right) >= self.min_tuples:
+                    candidates.append((left + right, pos, operation))
+            if not candidates:
+                break
+            _, pos, operation = max(candidates, key=lambda i: i[0])
+            tasks[pos:pos + 1] = [operation.left, operation.right]
+        return tasks
+
+    def execute_queries(self, queries: List[Tuple[str, parser.Node]], rels: Dict[str, Relation]) -> Dict[str, Relation]:
+        '''
+        Executes a list of assignments, name = tree, where each tree can
+        use the relations in rels and the results of the previous
+        assignments.
+
+        Independent queries are executed at the same time.
+
+        Returns the final value of every assigned name.
+        '''
+        # What each query needs, previous queries by position or relations
+        needs = [] #  type: List[Dict[str, Union[int, str]]]
+        assigned = {} #  type: Dict[str, int]
+        for name, node in queries:
+            needs.append({
+                i: assigned.get(i, i) for i in _relation_names(node)
+            })
+            assigned[name] = len(needs) - 1
+
+        # Results of the queries and relations used, in the form that was
+        # last needed
+        values = {} #  type: Dict[Union[int, str], Value]
+        remaining = list(range(len(queries)))
+        futures = {}
+
+        while remaining or futures:
+            # Starts all the queries whose operands are ready
+            progress = True
+            while progress:
+                progress = False
+                for pos in list(remaining):
+                    keys = needs[pos]
+                    if not all(k in values or isinstance(k, str) for k in keys.values()):
+                        continue
+                    remaining.remove(pos)
+                    progress = True
+                    node = queries[pos][1]
+                    for key in keys.values():
+                        if key not in values:
+                            values[key] = _get_relation(key, rels)
+
+                    if sum(len(values[k]) for k in keys.values()) < self.min_tuples:
+                        for key in keys.values():
+                            values[key] = _relation(values[key])
+                        try:
+                            values[pos] = engine.execute(node, {
+                                i: values[k] for i, k in keys.items()
+                            })
+                        except Exception as e:
+                            self._cancel(futures)
+                            raise Exception('Error in query: %s\n%s' % (node, e))
+                    else:
+                        for key in keys.values():
+                            values[key] = _packed(values[key])
+                        futures[self.pool().submit(
+                            _run, node, {i: values[k] for i, k in keys.items()}
+                        )] = pos
+
+            if not futures:
+                continue
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                pos = futures.pop(future)
+                try:
+                    values[pos] = future.result()
+                except Exception as e:
+                    self._cancel(futures)
+                    raise Exception('Error in query: %s\n%s' % (queries[pos][1], e))
+
+        return {name: _relation(values[pos]) for name, pos in assigned.items()}
+
+    def _cancel(self, futures) -> None:
+        for i in futures:
+            i.cancel()
+
+
+def _get_relation(name: str, rels: Dict[str, Relation]) -> Relation:
+    try:
+        return rels[name]
+    except KeyError:
+        raise Exception('Unknown relation: %s' % name)
+
+
+def partition(rel: Relation, attributes: List[str], count: int) -> List[Packed]:
+    '''
+    Divides the tuples of rel in count partitions, using the hash of
+    the values of the given attributes, to be joined on them by
+    Scheduler.partitioned.
+
+    The hash of strings changes between runs of the interpreter, so
+    relations to be joined must be divided by the same process.
+    '''
+    ids = rel.header.getAttributesId(attributes)
+    parts = [Packed(rel.header) for i in range(count)]
+    for row in rel.content:
+        parts[hash(tuple(row[i] for i in ids)) % count].add(row)
+    return [i.finish() for i in parts]
+
+
+def _relation_names(node: parser.Node) -> set:
+    if node.kind == parser.RELATION:
+        return {node.name}
+    elif node.kind == parser.UNARY:
+        return _relation_names(node.child)
+    return _relation_names(node.left) | _relation_names(node.right)
+
+
+def _cost(node: parser.Node, rels: Dict[str, Relation]) -> int:
+    '''Amount of tuples in the relations used by a tree'''
+    return sum(len(_get_relation(i, rels).content) for i in _relation_names(node))
+
+
+def _binary(node: parser.Node) -> Optional[parser.Node]:
+    '''Returns the topmost binary operation of a tree'''
+    while node.kind == parser.UNARY:
+        node = node.child
+    if node.kind == parser.BINARY:
+        return node
+    return None
+
+
+def _substitute(node: parser.Node, names: Dict[int, str]) -> parser.Node:
+    '''Returns a copy of the tree, where the subtrees in names are
+    replaced by relations with the given names'''
+    n = parser.Node()
+    if id(node) in names:
+        n.kind = parser.RELATION
+        n.name = names[id(node)]
+        return n
+    elif node.kind == parser.RELATION:
+        return node
+    n.kind = node.kind
+    n.name = node.name
+    if node.kind == parser.UNARY:
+        n.prop = node.prop
+        n.child = _substitute(node.child, names)
+    else:
+        if node.name == parser.THETAJOIN:
+            n.prop = node.prop
+        n.left = _substitute(node.left, names)
+        n.right = _substitute(node.right, names)
+    return n
@@ -46,15 +46,21 @@ SELECTION = 'σ'
 RENAME = 'ρ'
 ARROW = '➡'
 SEMIJOIN = 'semijoin'
+ANTIJOIN = '▷'
+THETAJOIN = '⋈θ'
+MULTIJOIN = '⋈*'
+REDUCEDJOIN = '⋈⋉'
 
 b_operators = (PRODUCT, DIFFERENCE, UNION, INTERSECTION, DIVISION,
-               JOIN, JOIN_LEFT, JOIN_RIGHT, JOIN_FULL, SEMIJOIN)  # List of binary operators
+               JOIN, JOIN_LEFT, JOIN_RIGHT, JOIN_FULL, SEMIJOIN, ANTIJOIN, THETAJOIN, MULTIJOIN, REDUCEDJOIN)  # List of binary operators
 u_operators = (PROJECTION, SELECTION, RENAME)  # List of unary operators
+# Joins of all the operands of a chain of the same operator at once
+multiway_operators = (MULTIJOIN, REDUCEDJOIN)
 
 # Associates operator with python method
 op_functions = {
     PRODUCT: 'product', DIFFERENCE: 'difference', UNION: 'union', INTERSECTION: 'intersection', DIVISION: 'division', JOIN: 'join',
-    JOIN_LEFT: 'outer_left', JOIN_RIGHT: 'outer_right', JOIN_FULL: 'outer', SEMIJOIN: 'semijoin', PROJECTION: 'projection', SELECTION: 'selection', RENAME: 'rename'}
+    JOIN_LEFT: 'outer_left', JOIN_RIGHT: 'outer_right', JOIN_FULL: 'outer', SEMIJOIN: 'semijoin', ANTIJOIN: 'antijoin', THETAJOIN: 'thetajoin', MULTIJOIN: 'multijoin', REDUCEDJOIN: 'reduced_join', PROJECTION: 'projection', SELECTION: 'selection', RENAME: 'rename'}
 
 
 class TokenizerException (Exception):
@@ -126,24 +132,6 @@ class Node:
                     u"'%s' is not a valid relation name" % self.name)
             return
 
-        '''
-
-
-        people semijoin skills (id=skill_id)
-
-        if semijoin in str:
-            #parse the input up in 2 parts:
-                1) "people semijoin skills"
-                2) fieldStr = id=skills_id
-
-
-            1) Build the node from part 1
-            2) Keep as is
-            3) Call relation.semijoin(node.left, node.right, fieldStr)
-
-
-        [x, semijoin, y]
-        '''
         # Expression from right to left, searching for binary operators
         # this means that binary operators have lesser priority than
         # unary operators.
@@ -165,12 +153,21 @@ class Node:
                     raise ParserException(
                         u"Expected left operand for '%s'" % self.name)
 
-                if len(expression[i + 1:]) == 0:
+                # The theta join has the condition before the right operand
+                right = i + 1
+                if self.name == THETAJOIN:
+                    if not isinstance(expression[right], str):
+                        raise ParserException(
+                            u"Expected condition for '%s'" % self.name)
+                    self.prop = expression[right].strip()
+                    right += 1
+
+                if len(expression[right:]) == 0:
                     raise ParserException(
                         u"Expected right operand for '%s'" % self.name)
 
                 self.left = node(expression[:i])
-                self.right = node(expression[i + 1:])
+                self.right = node(expression[right:])
                 return
         '''Searches for unary operators, parsing from right to left'''
         for i in range(len(expression) - 1, -1, -1):
@@ -205,7 +202,12 @@ class Node:
         '''
         Same as toPython but returns a regular string
         '''
-        if self.name in b_operators:
+        if self.name == THETAJOIN:
+            return '%s.%s(%s, %s)' % (self.left.toPython(), op_functions[self.name], self.right.toPython(), repr(self.prop))
+        elif self.name in multiway_operators:
+            operands = multijoin_operands(self)
+            return '%s.%s(%s)' % (operands[0].toPython(), op_functions[self.name], ', '.join(i.toPython() for i in operands[1:]))
+        elif self.name in b_operators:
             return '%s.%s(%s)' % (self.left.toPython(), op_functions[self.name], self.right.toPython())
         elif self.name in u_operators:
             prop = self.prop
@@ -228,6 +230,8 @@ class Node:
         for i in range(level):
             r += '  '
         r += self.name
+        if self.name == THETAJOIN:
+            r += '\t%s\n' % self.prop
         if self.name in b_operators:
             r += self.left.printtree(level + 1)
             r += self.right.printtree(level + 1)
@@ -255,13 +259,13 @@ class Node:
 
         if self.kind == RELATION:
             return list(rels[self.name].header)
-        elif self.kind == BINARY and self.name in (DIFFERENCE, UNION, INTERSECTION):
+        elif self.kind == BINARY and self.name in (DIFFERENCE, UNION, INTERSECTION, SEMIJOIN, ANTIJOIN):
             return self.left.result_format(rels)
         elif self.kind == BINARY and self.name == DIVISION:
             return list(set(self.left.result_format(rels)) - set(self.right.result_format(rels)))
         elif self.name == PROJECTION:
             return [i.strip() for i in self.prop.split(',')]
-        elif self.name == PRODUCT:
+        elif self.name in (PRODUCT, THETAJOIN):
             return self.left.result_format(rels) + self.right.result_format(rels)
         elif self.name == SELECTION:
             return self.child.result_format(rels)
@@ -276,7 +280,7 @@ class Node:
                 if _fields[i] in _vars:
                     _fields[i] = _vars[_fields[i]]
             return _fields
-        elif self.name in (JOIN, JOIN_LEFT, JOIN_RIGHT, JOIN_FULL):
+        elif self.name in (JOIN, JOIN_LEFT, JOIN_RIGHT, JOIN_FULL, MULTIJOIN, REDUCEDJOIN):
             return list(set(self.left.result_format(rels)).union(set(self.right.result_format(rels))))
         raise ValueError('What kind of alien object is this?')
 
@@ -289,6 +293,8 @@ class Node:
                 return False
             return self.child == other.child
         if self.kind == BINARY:
+            if self.name == THETAJOIN and other.prop != self.prop:
+                return False
             return self.left == other.left and self.right == other.right
         return True
 
@@ -297,12 +303,16 @@ class Node:
             return self.name
         elif (self.kind == UNARY):
             return self.name + " " + self.prop + " (" + self.child.__str__() + ")"
+        elif self.name == THETAJOIN:
+            return '%s%s %s (%s)' % (self.left, self.name, self.prop, self.right)
         elif (self.kind == BINARY):
             le = self.left.__str__()
             if self.right.kind != BINARY:
                 re = self.right.__str__()
             else:
                 re = "(" + self.right.__str__() + ")"
+            if self.name.isalpha():  # Operators like semijoin need spaces
+                return '%s %s %s' % (le, self.name, re)
             return (le + self.name + re)
         raise ValueError('What kind of alien object is this?')
 
@@ -380,11 +390,12 @@ def tokenize(expression: str) -> list:
             # Removes the entire parentesis and content from the expression
             expression = expression[end + 1:].strip()
 
-        elif expression.startswith((SELECTION, RENAME, PROJECTION)):  # Unary operators
-            items.append(expression[0:1])
+        elif expression.startswith((SELECTION, RENAME, PROJECTION, THETAJOIN)):  # Operators with a parameter
+            op = THETAJOIN if expression.startswith(THETAJOIN) else expression[0:1]
+            items.append(op)
                          # Adding operator in the top of the list
             expression = expression[
-                1:].strip()  # Removing operator from the expression
+                len(op):].strip()  # Removing operator from the expression
 
             if expression.startswith('('):  # Expression with parenthesis, so adding what's between open and close without tokenization
                 par = expression.find(
@@ -396,6 +407,10 @@ def tokenize(expression: str) -> list:
                          # Inserting parameter of the operator
             expression = expression[
                 par:].strip()  # Removing parameter from the expression
+        elif expression.startswith(multiway_operators):
+            op = next(i for i in multiway_operators if expression.startswith(i))
+            items.append(op)
+            expression = expression[len(op):].strip()
         else:  # Relation (hopefully)
             expression += ' '  # To avoid the special case of the ending
 
@@ -415,6 +430,22 @@ def tree(expression: str) -> Node:
     return Node(tokenize(expression))
 
 
+def multijoin_operands(node: Node) -> List[Node]:
+    '''Returns the operands of the multiway join in node.
+
+    Consecutive multiway joins of the same kind, like A ⋈* B ⋈* C,
+    are a single operation on all of their operands.'''
+    if node.name not in multiway_operators:
+        return [node]
+    return _chain(node, node.name)
+
+
+def _chain(node: Node, name: str) -> List[Node]:
+    if node.name != name:
+        return [node]
+    return _chain(node.left, name) + _chain(node.right, name)
+
+
 def parse(expr: str) -> CallableString:
     '''This function parses a relational algebra expression, and returns a
     CallableString (a string that can be called) whith the corresponding
@@ -0,0 +1,329 @@
+# Relational
+# Copyright (C) 2008-2017  Salvo "LtWorf" Tomaselli
+#
+# Relational is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# author Salvo "LtWorf" Tomaselli <tiposchi@tiscali.it>
+#
+# This module caches what is obtained from the text of a query: the parse
+# tree, the Python code and the optimized tree, so that running the same
+# query again doesn't parse and compile it again.
+#
+# The optimized tree depends on the attributes of the relations, so it is
+# kept for every set of attributes the query was optimized for. It also
+# depends on their statistics, so the order of magnitude of the number
+# of tuples of every relation is part of the key too, and the query is
+# optimized again when one of them grows or shrinks too much.
+#
+# It also caches the results of queries and of their subexpressions. A
+# result is reused only if the relations it was computed from are the
+# same objects and their version didn't change, since relations are
+# changed only by insert, update and delete, which increment it.
+
+import weakref
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from relational import parser
+from relational import engine
+from relational.relation import Relation
+
+# How many queries to keep
+CACHE_SIZE = 256
+
+# Estimated memory, in bytes, used by cached results
+RESULT_CACHE_SIZE = 64 * 1024 * 1024
+
+
+def normalize(query: str) -> str:
+    '''Returns the query with the whitespace collapsed,
+    except inside string literals'''
+    r = []
+    quote = None
+    escape = False
+    space = False
+    for c in query.strip():
+        if quote is not None:
+            r.append(c)
+            if escape:
+                escape = False
+            elif c == '\\':
+                escape = True
+            elif c == quote:
+                quote = None
+        elif c.isspace():
+            space = True
+        else:
+            if space:
+                r.append(' ')
+                space = False
+            if c in ('"', "'"):
+                quote = c
+            r.append(c)
+    return ''.join(r)
+
+
+class Plan:
+
+    '''
+    What is known about a query.
+
+    The tree is shared by all the users of the cache, and must not be
+    modified.
+    '''
+
+    def __init__(self, query: str) -> None:
+        self.tree = parser.tree(query)
+        self.python = self.tree.toPython()
+        self.code = compile(self.python, '<relational_expression>', 'eval')
+        # Optimized tree and optimization steps, by attributes and sizes
+        # of relations
+        self.optimized = {} #  type: Dict[tuple, Tuple[parser.Node, List[str]]]
+        self.relations = _relation_names(self.tree)
+
+
+class QueryCache:
+
+    '''
+    LRU cache of the plans of queries, indexed by their
+    normalized text.
+
+    hits and misses count the lookups.
+    '''
+
+    def __init__(self, size: int = CACHE_SIZE) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._plans = OrderedDict() #  type: OrderedDict
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+    def __str__(self) -> str:
+        return 'Cached queries: %d, hits: %d, misses: %d' % (
+            len(self._plans), self.hits, self.misses
+        )
+
+    def clear(self) -> None:
+        '''Removes all the cached queries and resets the counters'''
+        self._plans.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def clear_optimized(self) -> None:
+        '''Removes the optimized trees, to be used when the
+        statistics of the relations are computed again'''
+        for plan in self._plans.values():
+            plan.optimized.clear()
+
+    def plan(self, query: str) -> Plan:
+        '''Returns the plan for the query, parsing it if needed.
+
+        Queries that fail to parse are not cached.'''
+        key = normalize(query)
+        plan = self._plans.get(key)
+        if plan is not None:
+            self.hits += 1
+            self._plans.move_to_end(key)
+            return plan
+
+        self.misses += 1
+        plan = Plan(key)
+        self._plans[key] = plan
+        if len(self._plans) > self.size:
+            self._plans.popitem(last=False)
+        return plan
+
+    def tree(self, query: str) -> parser.Node:
+        '''Returns the parse tree of the query'''
+        return self.plan(query).tree
+
+    def code(self, query: str) -> Any:
+        '''Returns the compiled Python code for the query, to be
+        evaluated with the relations as globals'''
+        return self.plan(query).code
+
+    def optimized(self, query: str, rels: Dict[str, Any]) -> Tuple[parser.Node, List[str]]:
+        '''Returns the optimized tree of the query for the relations
+        in rels, and the steps of the optimization.'''
+        # optimizer imports maintenance, which uses this module
+        from relational import optimizer
+
+        plan = self.plan(query)
+        try:
+            key = tuple(
+                (tuple(rels[i].header), len(rels[i]).bit_length())
+                for i in plan.relations
+            )
+        except KeyError:
+            # Unknown relations are not cached
+            trace = [] #  type: List[str]
+            return optimizer.optimize_all(query, rels, debug=trace, tostr=False), trace
+
+        if key not in plan.optimized:
+            trace = []
+            node = optimizer.optimize_all(query, rels, debug=trace, tostr=False)
+            plan.optimized[key] = node, trace
+        return plan.optimized[key]
+
+
+def _relation_names(node: parser.Node) -> Tuple[str, ...]:
+    names = set()
+    nodes = [node]
+    while nodes:
+        n = nodes.pop()
+        if n.kind == parser.RELATION:
+            names.add(n.name)
+        elif n.kind == parser.UNARY:
+            nodes.append(n.child)
+        else:
+            nodes.append(n.left)
+            nodes.append(n.right)
+    return tuple(sorted(names))
+
+
+class ResultCache:
+
+    '''
+    LRU cache of the results of queries and of all their
+    subexpressions.
+
+    Results are indexed by the subexpression, as returned by
+    str(), and by the identity and version of the relations it uses.
+
+    The memory used by results is estimated from the number of
+    tuples and attributes, and the least recently used results are
+    removed when it exceeds max_size bytes.
+    '''
+
+    def __init__(self, max_size: int = RESULT_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (result, size, weak references to the relations)
+        self._results = OrderedDict() #  type: OrderedDict
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def __str__(self) -> str:
+        return 'Cached results: %d (about %d bytes), hits: %d, misses: %d' % (
+            len(self._results), self.size, self.hits, self.misses
+        )
+
+    def clear(self) -> None:
+        '''Removes all the cached results and resets the counters'''
+        self._results.clear()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def execute(self, node: parser.Node, rels: Dict[str, Relation]) -> Relation:
+        '''Executes the tree on the relations in rels, reusing the
+        cached results of its subexpressions.'''
+        if node.kind == parser.RELATION:
+            return engine.execute(node, rels)
+        return _share(self._execute(node, rels))
+
+    def _execute(self, node: parser.Node, rels: Dict[str, Relation]) -> Relation:
+        names = _relation_names(node)
+        for name in names:
+            if name not in rels:
+                raise Exception('Unknown relation: %s' % name)
+        key = (str(node), ) + tuple(
+            (name, id(rels[name]), rels[name].version) for name in names
+        )
+
+        entry = self._results.get(key)
+        if entry is not None:
+            result, size, refs = entry
+            if all(ref() is rels[name] for name, ref in refs):
+                self.hits += 1
+                self._results.move_to_end(key)
+                return result
+            # Different relations, that got the id of deleted ones
+            self._remove(key)
+        self.misses += 1
+
+        # The operation is executed with its operands already computed
+        op = parser.Node()
+        op.kind = node.kind
+        op.name = node.name
+        context = {} #  type: Dict[str, Relation]
+        if node.name in parser.multiway_operators:
+            # All the operands at once, without the partial joins
+            operands = parser.multijoin_operands(node)
+            op = self._operand(operands[0], '#0', rels, context)
+            for pos, i in enumerate(operands[1:], 1):
+                chain = parser.Node()
+                chain.kind = parser.BINARY
+                chain.name = node.name
+                chain.left = op
+                chain.right = self._operand(i, '#%d' % pos, rels, context)
+                op = chain
+        elif node.kind == parser.UNARY:
+            op.prop = node.prop
+            op.child = self._operand(node.child, '#child', rels, context)
+        else:
+            if node.name == parser.THETAJOIN:
+                op.prop = node.prop
+            op.left = self._operand(node.left, '#left', rels, context)
+            op.right = self._operand(node.right, '#right', rels, context)
+
+        result = engine.execute(op, context)
+        self._add(key, result, tuple((name, weakref.ref(rels[name])) for name in names))
+        return result
+
+    def _operand(self, node: parser.Node, placeholder: str, rels: Dict[str, Relation], context: Dict[str, Relation]) -> parser.Node:
+        '''Computes an operand, and returns the leaf to use in its place'''
+        if node.kind == parser.RELATION:
+            # Relations are used directly, so selections can use indexes
+            context[node.name] = rels[node.name]
+            return node
+
+        context[placeholder] = self._execute(node, rels)
+        leaf = parser.Node()
+        leaf.kind = parser.RELATION
+        leaf.name = placeholder
+        return leaf
+
+    def _add(self, key: tuple, result: Relation, refs: tuple) -> None:
+        size = _estimate_size(result)
+        if size > self.max_size:
+            return
+        self._results[key] = (result, size, refs)
+        self.size += size
+        while self.size > self.max_size:
+            self._remove(next(iter(self._results)))
+
+    def _remove(self, key: tuple) -> None:
+        self.size -= self._results.pop(key)[1]
+
+
+def _estimate_size(rel: Relation) -> int:
+    '''Estimated memory used by the tuples of a relation, without
+    the values, that are mostly shared with other relations'''
+    return 64 + len(rel.content) * (64 + 8 * len(rel.header))
+
+
+def _share(rel: Relation) -> Relation:
+    '''Returns a relation with the same content, that is copied when
+    one of them is modified.'''
+    r = Relation()
+    r.header = rel.header
+    r.content = rel.content
+    rel._make_duplicate(r)
+    return r
@@ -17,9 +17,14 @@
 # author Salvo "LtWorf" Tomaselli <tiposchi@tiscali.it>
 #
 # This module splits a query into a program.
+#
+# A program can be executed directly: every query in it is executed once
+# and its result is kept only until the last query using it is done.
 
+from collections import ChainMap
 
 from relational import parser
+from relational import engine
 
 
 class Program:
@@ -54,6 +59,8 @@ def _separate(node, program):
         _separate(node.child, program)
         rel = program.append_query(node.child)
         node.child = rel
+    elif node.name in parser.multiway_operators:
+        _separate_chain(node, node.name, program)
     elif node.kind == parser.BINARY:
         if node.left.kind != parser.RELATION:
             _separate(node.left, program)
@@ -65,6 +72,22 @@ def _separate(node, program):
             node.right = rel
     program.append_query(node)
 
+def _separate_chain(node, name, program):
+    '''
+    Separates the operands of a chain of multiway joins, that
+    stays in a single query.
+    '''
+    if node.left.name == name:
+        _separate_chain(node.left, name, program)
+    elif node.left.kind != parser.RELATION:
+        _separate(node.left, program)
+        node.left = program.append_query(node.left)
+    if node.right.name == name:
+        _separate_chain(node.right, name, program)
+    elif node.right.kind != parser.RELATION:
+        _separate(node.right, program)
+        node.right = program.append_query(node.right)
+
 def vargen(avoid, prefix=''):
     '''
     Generates temp variables.
@@ -87,6 +110,16 @@ def vargen(avoid, prefix=''):
             yield r
         count += 1
 
+def program(node, rels):
+    '''
+    Split a query into a Program.
+
+    The node is modified.
+    '''
+    p = Program(rels)
+    _separate(node, p)
+    return p
+
 def split(node, rels):
     '''
     Split a query into a program.
@@ -94,6 +127,42 @@ def split(node, rels):
     The idea is that if there are duplicated subdtrees they
     get executed only once.
     '''
-    p = Program(rels)
-    _separate(node, p)
-    return str(p)
+    return str(program(node, rels))
+
+def _operands(node):
+    '''Returns the names of the relations used by a query of a program'''
+    if node.kind == parser.RELATION:
+        return {node.name}
+    elif node.kind == parser.UNARY:
+        return {node.child.name}
+    elif node.name in parser.multiway_operators:
+        return {i.name for i in parser.multijoin_operands(node)}
+    return {node.left.name, node.right.name}
+
+def execute(program, rels):
+    '''
+    Executes the queries of a program and returns the result of the
+    last one.
+
+    The intermediate results are not added to rels, and each one is
+    released as soon as the last query using it has been executed.
+    '''
+    if not program.queries:
+        raise Exception('Empty program')
+
+    # How many queries still need each intermediate result
+    users = {}
+    for name, node in program.queries:
+        for i in _operands(node):
+            users[i] = users.get(i, 0) + 1
+
+    results = {}
+    context = ChainMap(results, rels)
+    for name, node in program.queries:
+        result = engine.execute(node, context)
+        for i in _operands(node):
+            users[i] -= 1
+            if users[i] == 0 and i in results:
+                del results[i]
+        results[name] = result
+    return result
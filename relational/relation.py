@@ -19,12 +19,22 @@
 # This module provides a classes to represent relations and to perform
 # relational operations on them.
 
+import ast
 import csv
+from bisect import bisect_left, bisect_right
 from itertools import chain, repeat
 from collections import deque
-from typing import List, Union, Set
+from typing import List, Union, Set, Dict, Tuple, Optional, Any, Iterable, Iterator
 
 from relational.rtypes import *
+from relational.columnar import ColumnarContent
+from relational import vectorized
+from relational import index
+from relational import statistics
+
+# The pools of values are checked every time the number of tuples
+# reaches a power of two at least this big, see Relation._drop_pools
+POOL_CHECK_ROWS = 1024
 
 
 class Relation (object):
@@ -50,12 +60,28 @@ class Relation (object):
 
     An empty relation needs a header, and can be filled using the insert()
     method.
+
+    If columnar is set, the content is stored by column (see
+    relational.columnar), which uses less memory when values are repeated.
+    The operations work in the same way, and their results use the
+    regular set storage.
     '''
     __hash__ = None #  type: None
 
-    def __init__(self, filename : str = '') -> None:
+    def __init__(self, filename : str = '', columnar: bool = False) -> None:
         self._readonly = False
-        self.content = set() #  type: Set[tuple]
+        # Incremented every time insert, update or delete change the content
+        self.version = 0
+        self._stats = None #  type: Optional[statistics.Statistics]
+        self._columns = None #  type: Optional[vectorized.Columns]
+        # Secondary indexes, the key is the tuple of the attributes
+        self._indexes = {} #  type: Dict[Tuple[str, ...], index.Index]
+        # One pool of values for each attribute, see _intern
+        self._pools = None #  type: Optional[List[Optional[Dict[str, Rstring]]]]
+        if columnar:
+            self.content = ColumnarContent() #  type: Union[Set[tuple], ColumnarContent]
+        else:
+            self.content = set()
 
         if len(filename) == 0:  # Empty relation
             self.header = Header([])
@@ -65,6 +91,59 @@ class Relation (object):
             self.header = Header(next(reader))  # read 1st line
             iterator = ((self.insert(i) for i in reader))
             deque(iterator, maxlen=0)
+        self._drop_pools()
+        self._cast_columns()
+
+    def _intern(self, values: Union[list, tuple]) -> tuple:
+        '''Converts values into a tuple of Rstring.
+
+        Equal values of the same attribute are the same object, so
+        they take memory only once and autocast is done only once.'''
+        if self._pools is None or len(self._pools) != len(self.header):
+            self._pools = [{} for i in self.header]
+
+        r = []
+        for value, pool in zip(values, self._pools):
+            if pool is None:
+                r.append(rstring(value))
+                continue
+            if not isinstance(value, str):
+                value = str(value)
+            interned = pool.get(value)
+            if interned is None:
+                interned = value if isinstance(value, Rstring) else rstring(value)
+                pool[interned] = interned
+            r.append(interned)
+        return tuple(r)
+
+    def _drop_pools(self) -> None:
+        '''Stops interning the attributes that have mostly distinct
+        values, where the pool would only take memory.
+
+        It is done after loading a file, and while inserting tuples.'''
+        if self._pools is None:
+            return
+        limit = len(self.content) // 2
+        self._pools = [
+            None if pool is None or len(pool) > limit else pool
+            for pool in self._pools
+        ]
+
+    def _cast_columns(self) -> None:
+        '''Finds the columns whose values all have the same type and
+        stores the result of autocast in every value, so that it does not
+        need to be computed one value at a time.'''
+        for j in range(len(self.header)):
+            if isinstance(self.content, ColumnarContent):
+                values = list(self.content.column(j))
+            else:
+                values = [i[j] for i in self.content]
+
+            cast = column_caster(list(set(values)))
+            if cast is None:
+                continue
+            for i in values:
+                i._autocast = cast(i)
 
     def _make_duplicate(self, copy: 'Relation') -> None:
         '''Flag that the relation "copy" is pointing
@@ -73,6 +152,12 @@ class Relation (object):
         self._readonly = True
         copy._readonly = True
 
+        # The indexes are shared too, with the attribute names of copy
+        copy._indexes = {
+            tuple(copy.header[i] for i in idx.ids): idx
+            for idx in self._indexes.values()
+        }
+
     def _make_writable(self, copy_content : bool = True) -> None:
         '''If this relation is marked as readonly, this
         method will copy the content to make it writable too
@@ -84,7 +169,67 @@ class Relation (object):
             self._readonly = False
 
             if copy_content:
-                self.content = set(self.content)
+                self.content = self.content.copy()
+            self._indexes = {k: v.copy() for k, v in self._indexes.items()}
+
+    def create_index(self, attributes: Union[str, List[str], Tuple[str, ...]], kind: str = index.HASH) -> None:
+        '''
+        Creates an index on the given attributes.
+
+        kind can be 'hash', to speed up selections comparing all
+        the attributes for equality with constants, or 'sorted', on
+        a single attribute, to speed up equality and range comparisons
+        with constants.
+
+        The index is kept up to date by insert, update and delete.
+        '''
+        if isinstance(attributes, str):
+            attributes = (attributes, )
+        attributes = tuple(attributes)
+        ids = self.header.getAttributesId(attributes)
+        if len(ids) == 0:
+            raise Exception('Invalid attributes for index')
+        self._indexes[attributes] = index.create(kind, ids, self.content)
+
+    def drop_index(self, attributes: Union[str, List[str], Tuple[str, ...]]) -> None:
+        '''Removes the index on the given attributes'''
+        if isinstance(attributes, str):
+            attributes = (attributes, )
+        self._indexes.pop(tuple(attributes), None)
+
+    def statistics(self) -> 'statistics.Statistics':
+        '''
+        Returns the statistics on the content of the relation.
+
+        They are computed when first needed, and kept up to date by
+        insert, update and delete. When many tuples have changed,
+        they are computed again.
+        '''
+        if self._stats is None or self._stats.stale():
+            self.refresh_statistics()
+        return self._stats
+
+    def refresh_statistics(self) -> None:
+        '''Computes again the statistics on the content'''
+        self._stats = statistics.Statistics(self.content, len(self.header))
+
+    def __getstate__(self):
+        # The arrays used by vectorized selections and the pools of
+        # values are not saved
+        state = self.__dict__.copy()
+        state['_columns'] = None
+        state['_pools'] = None
+        state['_stats'] = None
+        return state
+
+    def __setstate__(self, state):
+        # Relations saved by older versions miss some attributes
+        self._columns = None
+        self._pools = None
+        self._indexes = {}
+        self.version = 0
+        self._stats = None
+        self.__dict__.update(state)
 
     def __iter__(self):
         return iter(self.content)
@@ -131,25 +276,28 @@ class Relation (object):
         newt = relation()
         newt.header = Header(self.header)
 
-        try:
-            c_expr = compile(expr, 'selection', 'eval')
-        except:
-            raise Exception('Failed to compile expression: %s' % expr)
-
-        for i in self.content:
-            # Fills the attributes dictionary with the values of the tuple
-            attributes = {attr: i[j].autocast()
-                          for j, attr in enumerate(self.header)
-                          }
+        candidates = self._index_lookup(expr)
+        if candidates is None:
+            content = vectorized.selection(self, expr)
+            if content is not None:
+                newt.content = content
+                return newt
+            candidates = self.content
 
-            try:
-                if eval(c_expr, attributes):
-                    newt.content.add(i)
-            except Exception as e:
-                raise Exception(
-                    "Failed to evaluate %s\n%s" % (expr, e.__str__()))
+        predicate = _Predicate(expr, self.header)
+        newt.content = set(filter(predicate, candidates))
         return newt
 
+    def _index_lookup(self, expr: str) -> Optional[Iterable[tuple]]:
+        '''Returns the tuples that might satisfy expr, using an index,
+        or None if no index can be used.'''
+        if not self._indexes:
+            return None
+        conditions = vectorized.parse_conditions(expr, self.header)
+        if conditions is None:
+            return None
+        return index.lookup(self._indexes, conditions)
+
     def product(self, other: 'Relation') -> 'Relation':
         '''
         Cartesian product. Attributes of the relations must differ.
@@ -195,6 +343,9 @@ class Relation (object):
         newt.header = Header(h)
 
         # Create the body
+        if isinstance(self.content, ColumnarContent):
+            newt.content = set(self.content.project(ids))
+            return newt
         for i in self.content:
             row = (i[j] for j in ids)
             newt.content.add(tuple(row))
@@ -247,24 +398,43 @@ class Relation (object):
         attribute names unique to R, i.e., in the header of R but not in the
         header of S, for which it holds that all their combinations with tuples
         in S are present in R.
+
+        It is computed by grouping the tuples of R by the attributes
+        unique to R, and counting for each group how many tuples of S
+        it contains. Since the attributes of R are the union of those
+        of the group and those of S, every tuple is counted at most once.
         '''
 
+        if not isinstance(other, relation):
+            raise Exception('Operand must be a relation')
+
         # d_headers are the headers from self that aren't also headers in other
-        d_headers = tuple(set(self.header) - set(other.header))
+        d_headers = tuple(i for i in self.header if i not in other.header)
 
-        # Wikipedia defines the division as follows:
+        if len(self.header) - len(d_headers) != len(other.header):
+            raise TypeError('Relations differ: [%s] [%s]' % (
+                ','.join(self.header), ','.join(other.header)
+            ))
 
-        # a1,....,an are the d_headers
+        did = self.header.getAttributesId(d_headers)
+        if len(did) == 0:
+            raise Exception('Invalid attributes for projection')
+        # Ids of the attributes of other, in the order they have in other
+        oid = self.header.getAttributesId(other.header)
 
-        # T := πa1,...,an(R) × S
-        # U := T - R
-        # V := πa1,...,an(U)
-        # W := πa1,...,an(R) - V
+        # For each group, how many tuples of other it contains
+        groups = {} #  type: Dict[tuple, int]
+        for i in self.content:
+            key = tuple(i[l] for l in did)
+            value = tuple(i[l] for l in oid)
+            groups[key] = groups.get(key, 0) + (value in other.content)
 
-        # W is the result that we want
+        newt = relation()
+        newt.header = Header(d_headers)
 
-        t = self.projection(d_headers).product(other)
-        return self.projection(d_headers).difference(t.difference(self).projection(d_headers))
+        required = len(other.content)
+        newt.content = {key for key, count in groups.items() if count == required}
+        return newt
 
     def union(self, other: 'Relation') -> 'Relation':
         '''Union operation. The result will contain items present in first
@@ -279,16 +449,56 @@ class Relation (object):
 
 
     def thetajoin(self, other: 'Relation', expr: str) -> 'Relation':
-        '''Defined as product and then selection with the given expression.'''
-        return self.product(other).selection(expr)
+        '''Defined as product and then selection with the given expression.
 
+        The conditions in the form attribute == attribute, between one
+        attribute of each relation, are used as key of a hash table, like
+        for the semijoin. The rest of the expression is evaluated only on
+        the pairs of tuples found in the hash table.
 
-    def outer(self, other: 'Relation') -> 'Relation':
-        '''Does a left and a right outer join and returns their union.'''
-        a = self.outer_right(other)
-        b = self.outer_left(other)
+        Otherwise, if there are conditions like a < b or a >= b, between
+        one attribute of each relation, other is sorted on its attribute
+        and every tuple of self is compared only with the tuples within
+        its bounds.
 
-        return a.union(b)
+        Without such conditions, the expression is evaluated on every
+        combination of tuples, without materializing the product.'''
+        if (not isinstance(other, relation)):
+            raise Exception('Operand must be a relation')
+        if self.header.sharedAttributes(other.header) != 0:
+            raise Exception(
+                'Unable to perform product on relations with colliding attributes'
+            )
+        newt = relation()
+        newt.header = Header(self.header + other.header)
+
+        pairs, residual = _split_equalities(expr, self.header, other.header)
+        predicate = None
+        if residual is not None:
+            predicate = _Predicate(expr, newt.header, residual)
+        sid = self.header.getAttributesId([i[0] for i in pairs])
+        oid = other.header.getAttributesId([i[1] for i in pairs])
+
+        if not pairs and residual is not None:
+            band = _range_condition(residual, self.header, other.header)
+            if band is not None:
+                content = _band_join(self.content, other.content, self.header, other.header, band, predicate)
+                if content is not None:
+                    newt.content = set(content)
+                    return newt
+
+        table = _cast_hash_table(other.content, oid)
+        for i in self.content:
+            for j in table.get(tuple(i[l].autocast() for l in sid), ()):
+                item = i + j
+                if predicate is None or predicate(item):
+                    newt.content.add(item)
+        return newt
+
+    def outer(self, other: 'Relation') -> 'Relation':
+        '''Full outer join. Same as the union of a left and a right outer
+        join, but computed in a single pass.'''
+        return other._outer_join(self, True, True)
 
     def outer_right(self, other: 'Relation') -> 'Relation':
         '''
@@ -304,6 +514,17 @@ class Relation (object):
         '''
         See documentation for outer_right
         '''
+        return self._outer_join(other, True, False)
+
+    def _outer_join(self, other: 'Relation', left: bool, right: bool) -> 'Relation':
+        '''
+        Hash based outer join.
+
+        A hash table is built on other and probed with the tuples of self.
+        If left is set, the tuples of self with no match are padded
+        with "---". If right is set, the same is done for the tuples of
+        other that never got matched.
+        '''
 
         shared = self.header.intersection(other.header)
 
@@ -321,35 +542,56 @@ class Relation (object):
         # Non shared ids of the other relation
         noid = [i for i in range(len(other.header)) if i not in oid]
 
-        for i in self.content:
-            # Tuple partecipated to the join?
-            added = False
-            for j in other.content:
-                match = True
-                for k in range(len(sid)):
-                    match = match and (i[sid[k]] == j[oid[k]])
-
-                if match:
-                    item = chain(i, (j[l] for l in noid))
+        table = _hash_table(other.content, oid)
+        # Keys of the tuples of other that partecipated to the join
+        matched = set()
 
-                    newt.content.add(tuple(item))
-                    added = True
-            # If it didn't partecipate, adds it
-            if not added:
+        for i in self.content:
+            key = tuple(i[l] for l in sid)
+            match = table.get(key)
+
+            if match:
+                matched.add(key)
+                for j in match:
+                    newt.content.add(i + tuple(j[l] for l in noid))
+            elif left:
                 item = chain(i, repeat(rstring('---'), len(noid)))
                 newt.content.add(tuple(item))
 
+        if right:
+            # Position in other of every attribute of self, None if it
+            # is not shared
+            pos = [oid[sid.index(l)] if l in sid else None
+                   for l in range(len(self.header))]
+            blank = rstring('---')
+            for key, match in table.items():
+                if key in matched:
+                    continue
+                for j in match:
+                    item = chain(
+                        (blank if l is None else j[l] for l in pos),
+                        (j[l] for l in noid)
+                    )
+                    newt.content.add(tuple(item))
+
         return newt
 
     def join(self, other: 'Relation') -> 'Relation':
         '''
         Natural join, joins on shared attributes (one or more). If there are no
         shared attributes, it will behave as the cartesian product.
+
+        It is implemented as a hash join: a hash table is built on the
+        smaller relation, keyed by the values of the shared attributes,
+        and the other relation is used to probe it.
         '''
 
         # List of attributes in common between the relations
         shared = self.header.intersection(other.header)
 
+        if len(shared) == 0:
+            return self.product(other)
+
         newt = relation()  # Creates the new relation
 
         # Creating the header with all the fields, done like that because order is
@@ -365,25 +607,138 @@ class Relation (object):
         # Non shared ids of the other relation
         noid = [i for i in range(len(other.header)) if i not in oid]
 
-        for i in self.content:
+        if len(self.content) <= len(other.content):
+            # Build on self, probe with other
+            table = _hash_table(self.content, sid)
             for j in other.content:
-                match = True
-                for k in range(len(sid)):
-                    match = match and (i[sid[k]] == j[oid[k]])
+                key = tuple(j[l] for l in oid)
+                rest = tuple(j[l] for l in noid)
+                for i in table.get(key, ()):
+                    newt.content.add(i + rest)
+        else:
+            # Build on other, probe with self
+            table = _hash_table(other.content, oid)
+            for i in self.content:
+                key = tuple(i[l] for l in sid)
+                for j in table.get(key, ()):
+                    newt.content.add(i + tuple(j[l] for l in noid))
 
-                if match:
-                    item = chain(i, (j[l] for l in noid))
-                    newt.content.add(tuple(item))
+        return newt
+
+    def multijoin(self, *others: 'Relation') -> 'Relation':
+        '''
+        Natural join of self with all the other relations, done at once.
 
+        The result is the same as joining them one after the other, but
+        no intermediate result is computed: the values of the attributes
+        are chosen one attribute at a time, intersecting the values
+        allowed by every relation that has that attribute. This is much
+        faster for cyclic joins, like R(a, b) ⋈ S(b, c) ⋈ T(a, c).
+        '''
+        for i in others:
+            if not isinstance(i, relation):
+                raise Exception('Operand must be a relation')
+        rels = (self, ) + others
+        newt = relation()
+        newt.header, rows = _generic_join([i.header for i in rels], [i.content for i in rels])
+        newt.content = set(rows)
+        return newt
+
+    def reduced_join(self, *others: 'Relation') -> 'Relation':
+        '''
+        Natural join of self with all the other relations, after
+        removing the tuples that don't take part in the result.
+
+        If the join is acyclic, the relations are arranged in a join
+        tree and reduced with semijoins, from the leaves to the root
+        and then back to the leaves (Yannakakis algorithm). Then they
+        are joined along the tree, and no intermediate result is bigger
+        than the final one.
+
+        A cyclic join is done like multijoin.
+        '''
+        for i in others:
+            if not isinstance(i, relation):
+                raise Exception('Operand must be a relation')
+        rels = (self, ) + others
+        newt = relation()
+        newt.header, rows = _reduced_join([i.header for i in rels], [i.content for i in rels])
+        newt.content = set(rows)
         return newt
 
-    def semijoin(self, other: 'Relation', expr: str) -> 'Relation':
-    #def semijoin(self, other: 'Relation') -> 'Relation':
-        s_headers = tuple(set(self.header))
-        return self.product(other).selection(expr).projection(s_headers)
+    def semijoin(self, other: 'Relation', expr: Optional[str] = None) -> 'Relation':
+        '''
+        Semijoin. The result contains the tuples of self that match at
+        least one tuple of other.
+
+        If expr is not specified, it is a natural semijoin and tuples match
+        on the shared attributes.
+
+        Otherwise expr must be a valid Python expression, that can contain
+        the field names of both relations. In this case the attributes of the
+        relations must differ, as it happens for the product.
+        '''
+        return self._semijoin(other, expr, True)
+
+    def antijoin(self, other: 'Relation', expr: Optional[str] = None) -> 'Relation':
+        '''
+        Antijoin. The result contains the tuples of self that match no
+        tuple of other.
+
+        See documentation for semijoin.
+        '''
+        return self._semijoin(other, expr, False)
+
+    def _semijoin(self, other: 'Relation', expr: Optional[str], keep: bool) -> 'Relation':
+        '''
+        Implementation of semijoin (keep=True) and antijoin (keep=False).
+
+        The tuples of other are put in a hash table and every tuple of self
+        stops probing it as soon as one match is found.
+
+        With an expression, the conditions in the form attribute == attribute,
+        between one attribute of each relation, are used as key of the hash
+        table. The rest of the expression is evaluated only on the tuples
+        found in the hash table.
+        '''
+        if not isinstance(other, relation):
+            raise Exception('Operand must be a relation')
+
+        newt = relation()
+        newt.header = Header(self.header)
+
+        if expr is None:
+            newt.content = set(_hash_semijoin(
+                self.header, self.content, other.header, other.content, keep
+            ))
+            return newt
+
+        if self.header.sharedAttributes(other.header) != 0:
+            raise Exception(
+                'Unable to perform semijoin on relations with colliding attributes'
+            )
+
+        pairs, residual = _split_equalities(expr, self.header, other.header)
+        if residual is not None:
+            residual = _Predicate(expr, Header(self.header + other.header), residual)
+        sid = self.header.getAttributesId([i[0] for i in pairs])
+        oid = other.header.getAttributesId([i[1] for i in pairs])
 
+        # Equality is on the casted values, so they are used as key
+        table = _cast_hash_table(other.content, oid)
+
+        for i in self.content:
+            key = tuple(i[l].autocast() for l in sid)
+            candidates = table.get(key, ())
 
+            if residual is None:
+                found = len(candidates) != 0
+            else:
+                found = any(residual(i + j) for j in candidates)
 
+            if bool(found) == keep:
+                newt.content.add(i)
+        return newt
 
     def __eq__(self, other):
         if not isinstance(other, relation):
@@ -438,21 +793,47 @@ class Relation (object):
         Returns the number of affected rows.
         '''
         self._make_writable(copy_content=False)
-        affected = self.selection(expr)
-        not_affected = self.difference(affected)
+        self._columns = None
+        predicate = _Predicate(expr, self.header)
+
+        affected = set()
+        not_affected = set()
+        for i in self.content:
+            if predicate(i):
+                affected.add(i)
+            else:
+                not_affected.add(i)
 
         new_values = tuple(
             zip(self.header.getAttributesId(dic.keys()), dic.values())
         )
 
-        for i in set(affected.content):
+        for idx in self._indexes.values():
+            idx.remove_all(affected)
+        if self._stats is not None:
+            for i in affected:
+                self._stats.remove(i)
+
+        added = []
+        for i in affected:
             li = list(i)
 
             for column, value in new_values:
                 li[column] = value
-            not_affected.insert(li)
-
-        self.content = not_affected.content
+            row = self._intern(li)
+            if row not in not_affected:
+                not_affected.add(row)
+                added.append(row)
+                if self._stats is not None:
+                    self._stats.add(row)
+        for idx in self._indexes.values():
+            idx.add_all(added)
+
+        if isinstance(self.content, ColumnarContent):
+            not_affected = ColumnarContent(not_affected)
+        self.content = not_affected
+        if affected:
+            self.version += 1
         return len(affected)
 
     def insert(self, values: Union[list,tuple]) -> int:
@@ -474,9 +855,20 @@ class Relation (object):
             )
 
         self._make_writable()
+        self._columns = None
 
         prevlen = len(self.content)
-        self.content.add(tuple(map(rstring, values)))
+        row = self._intern(values)
+        self.content.add(row)
+        if len(self.content) != prevlen:
+            self.version += 1
+            size = len(self.content)
+            if size >= POOL_CHECK_ROWS and size & (size - 1) == 0:
+                self._drop_pools()
+            for idx in self._indexes.values():
+                idx.add(row)
+            if self._stats is not None:
+                self._stats.add(row)
         return len(self.content) - prevlen
 
     def delete(self, expr: str) -> int:
@@ -490,10 +882,423 @@ class Relation (object):
 
         l = len(self.content)
         self._make_writable(copy_content=False)
-        self.content = self.difference(self.selection(expr)).content
+        self._columns = None
+        predicate = _Predicate(expr, self.header)
+        content = []
+        removed = []
+        for i in self.content:
+            if predicate(i):
+                removed.append(i)
+            else:
+                content.append(i)
+        for idx in self._indexes.values():
+            idx.remove_all(removed)
+        if self._stats is not None:
+            for i in removed:
+                self._stats.remove(i)
+        if isinstance(self.content, ColumnarContent):
+            self.content = ColumnarContent(content)
+        else:
+            self.content = set(content)
+        if removed:
+            self.version += 1
         return len(self.content) - l
 
 
+class _Predicate:
+
+    '''
+    A selection expression, compiled once to be evaluated on many tuples.
+
+    The expression is parsed and only the attributes it refers to are
+    bound, by position, when it is called on a tuple of a relation with
+    the given header. The values are passed through autocast.
+    '''
+
+    def __init__(self, expr: str, header: 'Header', tree: Optional[ast.Expression] = None) -> None:
+        self.expr = expr
+
+        if tree is None:
+            try:
+                tree = ast.parse(expr, mode='eval')
+            except:
+                raise Exception('Failed to compile expression: %s' % expr)
+
+        names = {i.id for i in ast.walk(tree) if isinstance(i, ast.Name)}
+        self.attributes = [i for i in header if i in names]
+        self.ids = header.getAttributesId(self.attributes)
+
+        # The expression becomes the body of a function, whose parameters
+        # are the attributes
+        function = ast.parse('lambda %s: None' % ','.join(self.attributes), mode='eval')
+        function.body.body = tree.body
+        ast.fix_missing_locations(function)
+        try:
+            self.function = eval(compile(function, 'selection', 'eval'), {})
+        except:
+            raise Exception('Failed to compile expression: %s' % expr)
+
+    def __call__(self, row: tuple) -> Any:
+        try:
+            return self.function(*(row[i].autocast() for i in self.ids))
+        except Exception as e:
+            raise Exception(
+                "Failed to evaluate %s\n%s" % (self.expr, e.__str__()))
+
+
+def _split_equalities(expr: str, left: 'Header', right: 'Header') -> Tuple[List[Tuple[str, str]], Optional[Any]]:
+    '''Splits the expression expr, that refers to the attributes of two
+    relations, in two parts.
+
+    The first is a list of the (left, right) pairs of attributes compared
+    for equality by the top level "and" of the expression.
+
+    The second is the tree with the rest of the expression or
+    None, if nothing is left.'''
+    try:
+        tree = ast.parse(expr, mode='eval')
+    except:
+        raise Exception('Failed to compile expression: %s' % expr)
+
+    if isinstance(tree.body, ast.BoolOp) and isinstance(tree.body.op, ast.And):
+        conditions = tree.body.values
+    else:
+        conditions = [tree.body]
+
+    pairs = [] #  type: List[Tuple[str, str]]
+    rest = []
+    for c in conditions:
+        if isinstance(c, ast.Compare) and \
+                len(c.ops) == 1 and \
+                isinstance(c.ops[0], ast.Eq) and \
+                isinstance(c.left, ast.Name) and \
+                isinstance(c.comparators[0], ast.Name):
+            a = c.left.id
+            b = c.comparators[0].id
+            if a in left and b in right:
+                pairs.append((a, b))
+                continue
+            elif b in left and a in right:
+                pairs.append((b, a))
+                continue
+        rest.append(c)
+
+    if len(rest) == 0:
+        return pairs, None
+    elif len(rest) == 1:
+        body = rest[0]
+    else:
+        body = ast.BoolOp(op=ast.And(), values=rest)
+    return pairs, ast.Expression(body=body)
+
+
+def _range_condition(tree: ast.Expression, left: 'Header', right: 'Header') -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+    '''Looks in the top level "and" of the expression for comparisons
+    like a < b or a >= b, between an attribute of each relation.
+
+    Returns an attribute of right and the attributes of left that
+    are its lower and upper bounds (one of them can be None), or None
+    if there are no such comparisons. An attribute with both bounds
+    is preferred.'''
+    if isinstance(tree.body, ast.BoolOp) and isinstance(tree.body.op, ast.And):
+        conditions = tree.body.values
+    else:
+        conditions = [tree.body]
+
+    # Attribute of right -> [lower bound, upper bound]
+    bounds = {} #  type: Dict[str, List[Optional[str]]]
+    for c in conditions:
+        if not isinstance(c, ast.Compare):
+            continue
+        operands = [c.left] + c.comparators
+        for op, a, b in zip(c.ops, operands, operands[1:]):
+            if not (isinstance(a, ast.Name) and isinstance(b, ast.Name)):
+                continue
+            less = isinstance(op, (ast.Lt, ast.LtE))
+            if not less and not isinstance(op, (ast.Gt, ast.GtE)):
+                continue
+            if a.id in left and b.id in right:
+                # a < b means that a is a lower bound for b
+                attribute, bound, upper = b.id, a.id, not less
+            elif a.id in right and b.id in left:
+                attribute, bound, upper = a.id, b.id, less
+            else:
+                continue
+            pair = bounds.setdefault(attribute, [None, None])
+            if pair[upper] is None:
+                pair[upper] = bound
+
+    if not bounds:
+        return None
+    attribute = next((k for k, v in bounds.items() if None not in v), next(iter(bounds)))
+    return attribute, bounds[attribute][0], bounds[attribute][1]
+
+
+def _band_join(left: Iterable[tuple], right: Iterable[tuple], lheader: 'Header', rheader: 'Header', band: Tuple[str, Optional[str], Optional[str]], predicate: '_Predicate') -> Optional[List[tuple]]:
+    '''Returns the pairs of tuples of left and right that satisfy the
+    predicate, which implies the bounds found by _range_condition.
+
+    right is sorted and every tuple of left is compared only with the
+    ones between its bounds, found by binary search.
+
+    Returns None if the values can't be ordered.'''
+    attribute, lower, upper = band
+    rid = rheader.getAttributesId([attribute])[0]
+    lid = lheader.getAttributesId([lower])[0] if lower is not None else None
+    uid = lheader.getAttributesId([upper])[0] if upper is not None else None
+
+    r = [] #  type: List[tuple]
+    try:
+        rows = sorted(((i[rid].autocast(), i) for i in right), key=lambda i: i[0])
+        keys = [i[0] for i in rows]
+        for i in left:
+            start = 0 if lid is None else bisect_left(keys, i[lid].autocast())
+            end = len(keys) if uid is None else bisect_right(keys, i[uid].autocast())
+            for j in range(start, end):
+                row = i + rows[j][1]
+                if predicate(row):
+                    r.append(row)
+    except TypeError:
+        return None
+    return r
+
+
+def _hash_table(content, ids: List[int]) -> Dict[tuple, List[tuple]]:
+    '''Builds a hash table from a set of tuples, where the key is the tuple
+    of the values found at the positions ids and the value is the list of
+    tuples having that key.'''
+    table = {} #  type: Dict[tuple, List[tuple]]
+    for i in content:
+        key = tuple(i[l] for l in ids)
+        try:
+            table[key].append(i)
+        except KeyError:
+            table[key] = [i]
+    return table
+
+
+def _cast_hash_table(content, ids: List[int]) -> Dict[tuple, List[tuple]]:
+    '''Like _hash_table, but the key contains the casted values, so
+    that it finds the tuples that are equal in a selection.'''
+    table = {} #  type: Dict[tuple, List[tuple]]
+    for i in content:
+        key = tuple(i[l].autocast() for l in ids)
+        try:
+            table[key].append(i)
+        except KeyError:
+            table[key] = [i]
+    return table
+
+
+def _variable_order(headers: List[Tuple[str, ...]]) -> List[str]:
+    '''Returns the order in which the attributes are bound by a
+    multiway join.
+
+    The attributes in more relations come first, since they restrict
+    the values the most, then the ones in the same relations as the
+    attributes already chosen.'''
+    count = {} #  type: Dict[str, int]
+    for h in headers:
+        for i in h:
+            count[i] = count.get(i, 0) + 1
+    order = [] #  type: List[str]
+    while len(order) < len(count):
+        chosen = set(order)
+        candidates = [
+            i for h in headers if chosen.intersection(h)
+            for i in h if i not in chosen
+        ]
+        if not candidates:
+            candidates = [i for i in count if i not in chosen]
+        # max returns the first, in order of appearance
+        order.append(max(candidates, key=lambda i: count[i]))
+    return order
+
+
+def _generic_join(headers: List[Tuple[str, ...]], contents: List[Iterable[tuple]]) -> Tuple['Header', Iterator[tuple]]:
+    '''Natural join of many relations at once, with hash tries.
+
+    Every relation becomes a trie of nested dictionaries, one level
+    for each of its attributes in the order of _variable_order. For
+    every attribute, the values are the keys of the smallest of the
+    current tries that have it, that are present in all the others.
+
+    Returns the header of the result, with the attributes in the
+    same order as for a chain of joins, and an iterator over its
+    tuples.'''
+    result = [] #  type: List[str]
+    for h in headers:
+        result.extend(i for i in h if i not in result)
+    header = Header(result)
+    order = _variable_order(headers)
+
+    members = [[] for i in order] #  type: List[List[int]]
+    for pos, h in enumerate(headers):
+        for i in h:
+            members[order.index(i)].append(pos)
+    out = [order.index(i) for i in result]
+
+    def extend(level: int, nodes: List[Any], binding: List[Any]) -> Iterator[tuple]:
+        if level == len(order):
+            yield tuple(binding[i] for i in out)
+            return
+        ids = members[level]
+        for value in min((nodes[i] for i in ids), key=len):
+            children = []
+            for i in ids:
+                child = nodes[i].get(value)
+                if child is None:
+                    break
+                children.append(child)
+            else:
+                nested = list(nodes)
+                for i, child in zip(ids, children):
+                    nested[i] = child
+                binding.append(value)
+                yield from extend(level + 1, nested, binding)
+                binding.pop()
+
+    def join() -> Iterator[tuple]:
+        tries = []
+        for h, content in zip(headers, contents):
+            ids = sorted(range(len(h)), key=lambda i: order.index(h[i]))
+            trie = {} #  type: Dict[Any, Any]
+            for row in content:
+                node = trie
+                for i in ids[:-1]:
+                    node = node.setdefault(row[i], {})
+                # Relations without attributes only have ()
+                node[row[ids[-1]] if ids else ()] = True
+            if not trie:
+                return
+            tries.append(trie)
+        yield from extend(0, tries, [])
+    return header, join()
+
+
+def _join_tree(attributes: List[Set[str]]) -> Optional[List[Optional[int]]]:
+    '''Finds a join tree for the natural join of operands with the
+    given sets of attributes, by GYO reduction: an operand whose
+    attributes in common with the others are all in one other
+    operand is removed, and that operand becomes its parent.
+
+    Returns the index of the parent of every operand, None for the
+    roots, or None if the join is cyclic.'''
+    parents = [None] * len(attributes) #  type: List[Optional[int]]
+    left = list(range(len(attributes)))
+    while len(left) > 1:
+        for i in left:
+            others = [j for j in left if j != i]
+            shared = set() #  type: Set[str]
+            for j in others:
+                shared.update(attributes[i] & attributes[j])
+            parent = next((j for j in others if shared <= attributes[j]), None)
+            if parent is not None:
+                if shared:
+                    parents[i] = parent
+                left.remove(i)
+                break
+        else:
+            return None
+    return parents
+
+
+def _top_down(parents: List[Optional[int]]) -> List[int]:
+    '''Returns the operands of a join tree, with every operand
+    after its parent'''
+    depth = [] #  type: List[int]
+    for i in range(len(parents)):
+        d = 0
+        parent = parents[i]
+        while parent is not None:
+            d += 1
+            parent = parents[parent]
+        depth.append(d)
+    return sorted(range(len(parents)), key=lambda i: depth[i])
+
+
+def _tree_order(parents: List[Optional[int]], sizes: List[float]) -> List[int]:
+    '''Returns the order in which to join the operands of a join tree,
+    starting from the smallest and then adding the smallest of the
+    operands adjacent to the ones already joined, so that the result
+    grows as late as possible.'''
+    order = [min(range(len(sizes)), key=lambda i: sizes[i])]
+    while len(order) < len(sizes):
+        done = set(order)
+        candidates = [
+            i for i in range(len(sizes)) if i not in done and
+            (parents[i] in done or any(parents[j] == i for j in done))
+        ]
+        if not candidates:
+            # Another tree of the forest
+            candidates = [i for i in range(len(sizes)) if i not in done]
+        order.append(min(candidates, key=lambda i: sizes[i]))
+    return order
+
+
+def _hash_semijoin(lheader: Tuple[str, ...], lrows: Iterable[tuple], rheader: Tuple[str, ...], rrows: Iterable[tuple], keep: bool = True) -> List[tuple]:
+    '''Returns the tuples of lrows that match (or, if keep is false,
+    that don't match) a tuple of rrows on the shared attributes.
+
+    The values of the shared attributes of rrows are put in a set, that
+    every tuple of lrows probes.'''
+    shared = [i for i in lheader if i in rheader]
+    sid = [lheader.index(i) for i in shared]
+    oid = [rheader.index(i) for i in shared]
+    keys = {tuple(j[l] for l in oid) for j in rrows}
+    return [i for i in lrows if (tuple(i[l] for l in sid) in keys) == keep]
+
+
+def _reduced_join(headers: List[Tuple[str, ...]], contents: List[Iterable[tuple]]) -> Tuple['Header', Iterator[tuple]]:
+    '''Natural join of many relations at once, with a full semijoin
+    reduction before joining them, if the join is acyclic.
+
+    Returns the header of the result, with the attributes in the
+    same order as for a chain of joins, and an iterator over its
+    tuples.'''
+    parents = _join_tree([set(h) for h in headers])
+    if parents is None:
+        return _generic_join(headers, contents)
+
+    result = [] #  type: List[str]
+    for h in headers:
+        result.extend(i for i in h if i not in result)
+
+    order = _top_down(parents)
+
+    def join() -> Iterator[tuple]:
+        rows = [list(i) for i in contents]
+        for i in reversed(order):
+            parent = parents[i]
+            if parent is not None:
+                rows[parent] = _hash_semijoin(headers[parent], rows[parent], headers[i], rows[i])
+        for i in order:
+            parent = parents[i]
+            if parent is not None:
+                rows[i] = _hash_semijoin(headers[i], rows[i], headers[parent], rows[parent])
+
+        joins = _tree_order(parents, [len(i) for i in rows])
+        header = tuple(headers[joins[0]])
+        joined = rows[joins[0]]
+        for i in joins[1:]:
+            shared = [j for j in headers[i] if j in header]
+            sid = [header.index(j) for j in shared]
+            oid = [headers[i].index(j) for j in shared]
+            noid = [j for j in range(len(headers[i])) if j not in oid]
+            table = _hash_table(rows[i], oid)
+            joined = [
+                row + tuple(j[l] for l in noid)
+                for row in joined
+                for j in table.get(tuple(row[l] for l in sid), ())
+            ]
+            header += tuple(headers[i][l] for l in noid)
+
+        ids = [header.index(i) for i in result]
+        for row in joined:
+            yield tuple(row[i] for i in ids)
+    return Header(result), join()
+
+
 class Header(tuple):
 
     '''This class defines the header of a relation.
@@ -23,7 +23,7 @@
 import datetime
 import keyword
 import re
-from typing import Union
+from typing import Union, Optional, Callable, Sequence, Any
 
 RELATION_NAME_REGEXP = re.compile(r'^[_a-z][_a-z0-9]*$', re.IGNORECASE)
 
@@ -160,6 +160,61 @@ class Rdate (object):
         return (self.intdate - other.intdate).days
 
 
+# Same as the regexps in Rstring, but matching a whole column of values,
+# separated by newlines. Empty values are allowed.
+_int_column_regexp = re.compile(r'(?:[\+\-]?[0-9]+)?(?:\n(?:[\+\-]?[0-9]+)?)*')
+_float_column_regexp = re.compile(
+    r'(?:[\+\-]?[0-9]+(?:\.[0-9]+)?)?(?:\n(?:[\+\-]?[0-9]+(?:\.[0-9]+)?)?)*'
+)
+_date_column_regexp = re.compile(
+    r'(?:[0-9]{1,4}[\\/-][0-9]{1,2}[\\/-][0-9]{1,2})?'
+    r'(?:\n(?:[0-9]{1,4}[\\/-][0-9]{1,2}[\\/-][0-9]{1,2})?)*'
+)
+
+
+def _cast_int(value: Rstring) -> Union[int, Rstring]:
+    return int(value) if value else value
+
+
+def _cast_float(value: Rstring) -> Union[int, float, Rstring]:
+    if not value:
+        return value
+    # Values without a dot are also matched by the int regexp
+    return float(value) if '.' in value else int(value)
+
+
+def _cast_date(value: Rstring) -> Union['Rdate', Rstring]:
+    return rdate(value) if value else value
+
+
+def column_caster(values: Sequence[Rstring]) -> Optional[Callable[[Rstring], Any]]:
+    '''
+    Scans a whole column at once and, if all of its values would be
+    converted to the same type by autocast (ignoring empty values),
+    returns a function that does the same conversion without testing
+    the value.
+
+    Returns None if the values have different types or are strings.
+    values should be the distinct values of the column, since every
+    date is checked to exist.
+    '''
+    text = '\n'.join(values)
+    if len(values) == 0 or text.count('\n') != len(values) - 1:
+        # Values containing newlines can't be told apart
+        return None
+
+    if _int_column_regexp.fullmatch(text):
+        return _cast_int
+    elif _float_column_regexp.fullmatch(text):
+        return _cast_float
+    elif _date_column_regexp.fullmatch(text):
+        # The regexp does not tell if the dates exist, columns with
+        # impossible dates are strings and dates
+        if all(i.isDate() for i in values if i):
+            return _cast_date
+    return None
+
+
 def is_valid_relation_name(name: str) -> bool:
     '''Checks if a name is valid for a relation.
     Returns boolean'''
@@ -0,0 +1,229 @@
+# Relational
+# Copyright (C) 2008-2017  Salvo "LtWorf" Tomaselli
+#
+# Relational is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# author Salvo "LtWorf" Tomaselli <tiposchi@tiscali.it>
+#
+# This module computes statistics on the content of relations, to
+# estimate the size of the results of queries.
+#
+# For every attribute there is an estimate of the number of distinct
+# values (HyperLogLog), the number of nulls ('---', used by outer joins),
+# the minimum and maximum and an equi-depth histogram of the autocast
+# values.
+#
+# insert, update and delete keep the statistics up to date where
+# possible: counts are exact, distinct values and min/max only grow, and
+# the histograms are not changed. When many tuples have changed, the
+# statistics are computed again.
+
+import math
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Registers of HyperLogLog are 2 ** HLL_BITS
+HLL_BITS = 10
+
+# Buckets of the histograms
+BUCKETS = 10
+
+# Fraction of changed tuples after which the statistics are computed again
+STALE_FRACTION = 0.1
+
+NULL = '---'
+
+
+class HyperLogLog:
+
+    '''Estimates the number of distinct values added to it, using
+    a fixed amount of memory.
+
+    It uses hash(), so it is only valid in the process that created it.'''
+
+    def __init__(self, bits: int = HLL_BITS) -> None:
+        self.bits = bits
+        self.registers = bytearray(1 << bits)
+
+    def add(self, value: Any) -> None:
+        h = hash(value) & 0xffffffffffffffff
+        # Mixing the bits, since the hash of an integer is the integer
+        h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & 0xffffffffffffffff
+        h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & 0xffffffffffffffff
+        h ^= h >> 31
+        rest = 64 - self.bits
+        register = h >> rest
+        rank = rest - (h & ((1 << rest) - 1)).bit_length() + 1
+        if rank > self.registers[register]:
+            self.registers[register] = rank
+
+    def __len__(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -i for i in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class Histogram:
+
+    '''
+    Equi-depth histogram.
+
+    bounds contains the lowest value and the upper bound of every
+    bucket, and every bucket contains about the same amount of values.
+    '''
+
+    def __init__(self, counts: List[Tuple[Any, int]], buckets: int = BUCKETS) -> None:
+        '''counts is a sorted list of (value, number of occurrences)'''
+        n = sum(i[1] for i in counts)
+        buckets = min(buckets, n)
+        self.bounds = [counts[0][0]]
+        cumulative = 0
+        bucket = 1
+        for value, count in counts:
+            cumulative += count
+            while bucket <= buckets and cumulative >= bucket * n // buckets:
+                self.bounds.append(value)
+                bucket += 1
+
+    def fraction_below(self, value: Any) -> Optional[float]:
+        '''Returns the estimated fraction of values lower than value,
+        or None if value can't be compared with them.'''
+        bounds = self.bounds
+        try:
+            if value <= bounds[0]:
+                return 0.0
+            elif value > bounds[-1]:
+                return 1.0
+            pos = bisect_left(bounds, value)
+        except (TypeError, AttributeError):
+            return None
+
+        low, high = bounds[pos - 1], bounds[pos]
+        if isinstance(value, (int, float)) and high != low:
+            within = (value - low) / (high - low)
+        else:
+            within = 0.5
+        return (pos - 1 + within) / (len(bounds) - 1)
+
+
+class ColumnStatistics:
+
+    '''
+    Statistics on the values of an attribute.
+
+    min, max and histogram are None if there are no values, or
+    if they can't be compared.
+    '''
+
+    def __init__(self, values: Iterable[Any]) -> None:
+        self.distinct = HyperLogLog()
+        self.min = None #  type: Any
+        self.max = None #  type: Any
+        self.histogram = None #  type: Optional[Histogram]
+
+        counts = {} #  type: Dict[Any, int]
+        for i in values:
+            counts[i] = counts.get(i, 0) + 1
+        self.nulls = counts.pop(NULL, 0)
+        for i in counts:
+            self.distinct.add(i)
+        if self.nulls:
+            self.distinct.add(NULL)
+
+        # Whether the autocast values can be compared, dates raise
+        # AttributeError when compared with anything else
+        self.comparable = True
+        try:
+            ordered = sorted((i.autocast(), count) for i, count in counts.items())
+        except (TypeError, AttributeError):
+            self.comparable = False
+            return
+        if ordered:
+            self.min = ordered[0][0]
+            self.max = ordered[-1][0]
+            self.histogram = Histogram(ordered)
+
+    def add(self, value) -> None:
+        self.distinct.add(value)
+        if value == NULL:
+            self.nulls += 1
+            return
+        if not self.comparable:
+            return
+        value = value.autocast()
+        try:
+            if self.min is None:
+                self.min = self.max = value
+            elif value < self.min:
+                self.min = value
+            elif value > self.max:
+                self.max = value
+        except (TypeError, AttributeError):
+            self.comparable = False
+            self.min = self.max = self.histogram = None
+
+    def remove(self, value) -> None:
+        if value == NULL:
+            self.nulls -= 1
+
+
+class Statistics:
+
+    '''
+    Statistics on a relation.
+
+    columns has the statistics of every attribute, in the same order
+    as the header.
+    '''
+
+    def __init__(self, content: Iterable[tuple], arity: int) -> None:
+        rows = list(content)
+        self.rows = len(rows)
+        self.columns = [
+            ColumnStatistics(i[j] for i in rows) for j in range(arity)
+        ]
+        # Tuples changed since the statistics were computed
+        self.changes = 0
+
+    def add(self, row: tuple) -> None:
+        self.rows += 1
+        self.changes += 1
+        for value, column in zip(row, self.columns):
+            column.add(value)
+
+    def remove(self, row: tuple) -> None:
+        self.rows -= 1
+        self.changes += 1
+        for value, column in zip(row, self.columns):
+            column.remove(value)
+
+    def stale(self) -> bool:
+        '''Returns true if so many tuples changed that the
+        statistics should be computed again'''
+        return self.changes > max(100, self.rows * STALE_FRACTION)
+
+    def describe(self, header: Iterable[str]) -> str:
+        '''Returns a readable description of the statistics'''
+        r = 'Tuples: %d\n' % self.rows
+        for name, column in zip(header, self.columns):
+            r += '%s: distinct ~%d, nulls %d' % (name, len(column.distinct), column.nulls)
+            if column.min is not None:
+                r += ', min %s, max %s' % (column.min, column.max)
+            r += '\n'
+        return r.rstrip()
@@ -0,0 +1,200 @@
+# Relational
+# Copyright (C) 2008-2017  Salvo "LtWorf" Tomaselli
+#
+# Relational is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# author Salvo "LtWorf" Tomaselli <tiposchi@tiscali.it>
+#
+# This module evaluates simple selections on whole columns at once, using
+# NumPy if it is installed.
+#
+# Only expressions that are a conjunction of comparisons between an
+# attribute and a constant are handled, for example
+#   age > 25 and rank == 3
+#   18 <= age < 30 and name != 'jack'
+# For anything else, or if NumPy is missing, None is returned and the
+# selection must be evaluated one tuple at a time.
+
+import ast
+import operator
+from itertools import compress
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Relations smaller than this are not worth the conversion
+MIN_ROWS = 1000
+
+# Integers bigger than this can't be compared exactly as floats
+_MAX_EXACT_FLOAT = 2 ** 53
+
+_operators = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+# Same comparison, with swapped operands
+_swapped = {
+    ast.Eq: ast.Eq,
+    ast.NotEq: ast.NotEq,
+    ast.Lt: ast.Gt,
+    ast.LtE: ast.GtE,
+    ast.Gt: ast.Lt,
+    ast.GtE: ast.LtE,
+}
+
+NUMERIC = 0
+STRING = 1
+
+
+def parse_conditions(expr: str, header) -> Optional[List[Tuple[str, Any, Any]]]:
+    '''
+    Returns a list of (attribute, operator, constant) whose
+    conjunction is equivalent to the expression, or None if the
+    expression has a different shape.
+    '''
+    try:
+        tree = ast.parse(expr, mode='eval').body
+    except SyntaxError:
+        return None
+
+    if isinstance(tree, ast.BoolOp) and isinstance(tree.op, ast.And):
+        comparisons = tree.values
+    else:
+        comparisons = [tree]
+
+    r = []
+    for c in comparisons:
+        conditions = parse_comparison(c, header)
+        if conditions is None:
+            return None
+        r.extend(conditions)
+    return r
+
+
+def parse_comparison(c: ast.expr, header) -> Optional[List[Tuple[str, Any, Any]]]:
+    '''
+    Same as parse_conditions, for a single comparison, possibly
+    chained, already parsed.
+    '''
+    if not isinstance(c, ast.Compare):
+        return None
+    r = []
+    operands = [c.left] + c.comparators
+    for op, left, right in zip(c.ops, operands, operands[1:]):
+        if type(op) not in _operators:
+            return None
+        if isinstance(left, ast.Name) and left.id in header:
+            name, const, op = left.id, right, type(op)
+        elif isinstance(right, ast.Name) and right.id in header:
+            name, const, op = right.id, left, _swapped[type(op)]
+        else:
+            return None
+        try:
+            value = ast.literal_eval(const)
+        except ValueError:
+            return None
+        if type(value) not in (int, float, str):
+            return None
+        r.append((name, _operators[op], value))
+    return r
+
+
+class Columns:
+
+    '''
+    Typed NumPy arrays for the columns of the content of a relation.
+
+    The arrays are built when they are first needed, from the
+    autocast values, and all follow the order of the tuples
+    in the rows list.
+    '''
+
+    def __init__(self, content) -> None:
+        self.content = content
+        self.size = len(content)
+        self.rows = list(content)
+        self.arrays = {} #  type: Dict[int, Any]
+
+    def valid(self, content) -> bool:
+        '''Returns true if the arrays are still valid for content'''
+        return content is self.content and len(content) == self.size
+
+    def get(self, column: int) -> Optional[Tuple[int, Any]]:
+        '''Returns the kind of the column (NUMERIC or STRING)
+        and its array, or None if the column has mixed types.'''
+        if column not in self.arrays:
+            self.arrays[column] = self._build(column)
+        return self.arrays[column]
+
+    def _build(self, column: int) -> Optional[Tuple[int, Any]]:
+        values = [i[column].autocast() for i in self.rows]
+        types = set(map(type, values))
+
+        if types == {int}:
+            try:
+                return NUMERIC, numpy.array(values, dtype=numpy.int64)
+            except OverflowError:
+                return None
+        elif types == {int, float} or types == {float}:
+            if any(abs(i) > _MAX_EXACT_FLOAT for i in values if type(i) == int):
+                return None
+            return NUMERIC, numpy.array(values, dtype=numpy.float64)
+        elif len(types) == 1 and issubclass(types.pop(), str):
+            # NumPy strips trailing null characters
+            if any(i.endswith('\x00') for i in values):
+                return None
+            return STRING, numpy.array(values, dtype=str)
+        return None
+
+
+def selection(relation, expr: str) -> Optional[Set[tuple]]:
+    '''
+    Returns the set of tuples of the relation satisfying expr,
+    or None if it is not possible to evaluate it here.
+    '''
+    if numpy is None or len(relation.content) < MIN_ROWS:
+        return None
+
+    conditions = parse_conditions(expr, relation.header)
+    if conditions is None:
+        return None
+
+    columns = getattr(relation, '_columns', None)
+    if columns is None or not columns.valid(relation.content):
+        columns = relation._columns = Columns(relation.content)
+
+    mask = None
+    for name, op, value in conditions:
+        column = columns.get(relation.header.index(name))
+        if column is None:
+            return None
+        kind, array = column
+        if (kind == STRING) != isinstance(value, str):
+            # Different types, the normal evaluation knows what to do
+            return None
+        if kind == NUMERIC and type(value) == int and abs(value) > _MAX_EXACT_FLOAT:
+            return None
+
+        m = op(array, value)
+        mask = m if mask is None else numpy.logical_and(mask, m)
+
+    return set(compress(columns.rows, mask.tolist()))
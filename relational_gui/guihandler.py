@@ -172,12 +172,11 @@ class relForm(QtWidgets.QMainWindow):
 
         res_rel,query = self.user_interface.split_query(self.ui.txtQuery.text(),None)
         try:
-            trace = []
-            result = optimizer.optimize_all(
+            result, trace = self.user_interface.cache.optimized(
                 query,
-                self.user_interface.relations,
-                debug=trace
+                self.user_interface.relations
             )
+            result = str(result)
             print('==== Optimization steps ====')
             print(query)
             print('\n'.join(trace))
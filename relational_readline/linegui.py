@@ -22,11 +22,12 @@ import readline
 import logging
 import os.path
 import os
+import re
 import sys
 from typing import Optional
 
 from relational import relation, parser, rtypes
-from relational import maintenance
+from relational import maintenance, querycache
 from xtermcolor import colorize
 
 PROMPT_COLOR = 0xffff00
@@ -108,9 +109,10 @@ class SimpleCompleter:
 
 
 relations = {}
+cache = querycache.QueryCache()
 completer = SimpleCompleter(
-    ['SURVEY', 'LIST', 'LOAD ', 'UNLOAD ', 'HELP ', 'QUIT', 'SAVE ', '_PRODUCT ', '_UNION ', '_INTERSECTION ',
-     '_DIFFERENCE ', '_JOIN ', '_LJOIN ', '_RJOIN ', '_FJOIN ', '_PROJECTION ', '_RENAME_TO ', '_SELECTION ', '_RENAME ', '_DIVISION ', '_SEMIJOIN '])
+    ['SURVEY', 'LIST', 'CACHE', 'STATS ', 'REFRESH', 'LOAD ', 'UNLOAD ', 'HELP ', 'QUIT', 'SAVE ', '_PRODUCT ', '_UNION ', '_INTERSECTION ',
+     '_DIFFERENCE ', '_JOIN ', '_LJOIN ', '_RJOIN ', '_FJOIN ', '_PROJECTION ', '_RENAME_TO ', '_SELECTION ', '_RENAME ', '_DIVISION ', '_SEMIJOIN ', '_ANTIJOIN ', '_THETAJOIN ', '_MULTIJOIN ', '_REDUCEDJOIN '])
 
 
 def load_relation(filename: str, defname:Optional[str]=None) -> Optional[str]:
@@ -180,6 +182,9 @@ def help(command: str) -> None:
     cmdhelp = {
         'QUIT': 'Quits the program',
         'LIST': 'Lists the relations loaded',
+        'CACHE': 'Shows how many times parsed queries were reused',
+        'STATS': 'STATS relationame\nShows the statistics on a relation',
+        'REFRESH': 'REFRESH [relationame]\nComputes again the statistics on a relation, or on all of them',
         'LOAD': 'LOAD filename [relationame]\nLoads a relation into memory',
         'UNLOAD': 'UNLOAD relationame\nUnloads a relation from memory',
         'SAVE': 'SAVE filename relationame\nSaves a relation in a file',
@@ -207,6 +212,24 @@ def exec_line(command: str) -> None:
         for i in relations:
             if not i.startswith('_'):
                 print(i)
+    elif command == 'CACHE':
+        print(cache)
+    elif command.startswith('STATS '):
+        pars = command.split(' ')
+        if pars[1] not in relations:
+            print(colorize("No such relation %s" % pars[1], ERROR_COLOR))
+            return
+        rel = relations[pars[1]]
+        print(rel.statistics().describe(rel.header))
+    elif command == 'REFRESH' or command.startswith('REFRESH '):
+        pars = command.split(' ')
+        names = pars[1:] or list(relations)
+        for i in names:
+            if i not in relations:
+                print(colorize("No such relation %s" % i, ERROR_COLOR))
+                return
+            relations[i].refresh_statistics()
+        cache.clear_optimized()
     elif command == 'SURVEY':
         survey()
     elif command.startswith('LOAD '):  # Loads a relation
@@ -259,6 +282,9 @@ def replacements(query: str) -> str:
         ('_UNION', parser.UNION),
         ('_INTERSECTION', parser.INTERSECTION),
         ('_DIFFERENCE', parser.DIFFERENCE),
+        ('_THETAJOIN', parser.THETAJOIN),
+        ('_MULTIJOIN', parser.MULTIJOIN),
+        ('_REDUCEDJOIN', parser.REDUCEDJOIN),
         ('_JOIN', parser.JOIN),
         ('_LJOIN', parser.JOIN_LEFT),
         ('_RJOIN', parser.JOIN_RIGHT),
@@ -269,6 +295,7 @@ def replacements(query: str) -> str:
         ('_RENAME', parser.RENAME),
         ('_DIVISION', parser.DIVISION),
         ('_SEMIJOIN', parser.SEMIJOIN),
+        ('_ANTIJOIN', parser.ANTIJOIN),
     )
     for asciiop, op in rules:
         query = query.replace(asciiop, op)
@@ -318,27 +345,32 @@ def exec_query(command: str) -> None:
         command += table
         command += ")"
 
-    if "semijoin" in command:
+    # Only at the start, or after the name of the result, since the
+    # operators can also be used as words in a query
+    call = re.match(r'(?:\w+\s*=\s*)?(semijoin|antijoin)\s*\(', command.strip())
+    if call:
         command = command.strip()
-        idx = command.find('semijoin',0)
+        idx = call.start(1)
         #expecting string like: semijoin(table1,table2,list_of_fields) with or without spaces
-        #convert to string like: table1, _SEMIJOIN, table2 (list_of_fields)
+        #antijoin(table1,table2,list_of_fields) works the same way
         first_part = command[:idx] #don't change. Q1 = select(....
         last_part = command[idx:]
         idx2 = last_part.find('(',0)
-        operator = last_part[:idx2].strip() #operator = "semijoin"
+        operator = last_part[:idx2].strip() #operator = "semijoin" or "antijoin"
         rest_q = last_part[idx2+1:]
         rest_q = rest_q.split(",")
         table_name1 = rest_q[0].strip()
         table_name2 = rest_q[1].strip()
-        list_of_fields = rest_q[2][:-1].strip()
+        list_of_fields = ','.join(rest_q[2:]).strip()[:-1].strip()
         if "==" not in list_of_fields:
             #add in the second equal sign
             equal_index = list_of_fields.find("=")
             list_of_fields = list_of_fields[:equal_index] + "=" + list_of_fields[equal_index:]
-        first_command = table_name1 + " semijoin " + table_name2
-        tree = parser.tree(first_command)
-        print(relations[table_name1].semijoin(relations[table_name2],list_of_fields))
+        try:
+            method = getattr(relations[table_name1], operator)
+            print(method(relations[table_name2], list_of_fields))
+        except Exception as e:
+            print(colorize(str(e), ERROR_COLOR))
         return
 
     # Performs replacements for weird operators
@@ -357,10 +389,10 @@ def exec_query(command: str) -> None:
 
     '''
     try:
-        pyquery = parser.parse(query)
-        result = pyquery(relations)
+        plan = cache.plan(query)
+        result = eval(plan.code, relations)
 
-        printtty(colorize("-> query: %s" % pyquery, COLOR_GREEN))
+        printtty(colorize("-> query: %s" % plan.python, COLOR_GREEN))
 
         if printrel:
             print()
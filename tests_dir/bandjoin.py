@@ -0,0 +1,26 @@
+from relational import codegen, engine, optimizer, parser
+from relational.relation import Relation, Header
+
+sessions = Relation()
+sessions.header = Header(['start', 'end', 'user'])
+events = Relation()
+events.header = Header(['ts', 'kind'])
+for i in range(30):
+    sessions.insert((str(i * 7), str(i * 7 + i % 5), str(i % 4)))
+for i in range(100):
+    events.insert((str(i * 2), ('click', 'view')[i % 2]))
+events.insert(('4.5', 'click'))
+
+rels = {'sessions': sessions, 'events': events}
+for condition in ('start <= ts and ts < end', 'start <= ts < end and kind == "view"', 'ts > end', 'ts <= start or ts > end'):
+    expected = sessions.product(events).selection(condition)
+    query = 'sessions ⋈θ %s (events)' % condition
+    assert sessions.thetajoin(events, condition) == expected
+    assert engine.execute(parser.tree(query), rels) == expected
+    assert codegen.execute(query, rels) == expected
+
+# Comparisons between the operands of a product become theta joins
+query = 'σ start <= ts and ts < end and user == 1 (sessions * events)'
+optimized = optimizer.optimize_all(query, rels, tostr=False)
+assert optimized.name == parser.THETAJOIN
+assert eval(optimized.toPython(), rels) == eval(parser.parse(query), rels)
@@ -0,0 +1,9 @@
+from relational import codegen
+
+# The result shares the content of people, that is copied on write
+p1 = codegen.execute('ρ id➡i (people)', {'people': people})
+p1.insert((123, 'lala', 0, 31))
+assert len(p1) == len(people) + 1
+people.insert((124, 'lala', 0, 31))
+assert len(p1) == len(people)
+people.delete('id == 124')
@@ -0,0 +1,14 @@
+from relational.rtypes import Rstring, Rdate, column_caster
+
+
+def cast(*values):
+    values = [Rstring(i) for i in values]
+    caster = column_caster(values)
+    return None if caster is None else [caster(i) for i in values]
+
+assert cast('1', '', '-3') == [1, '', -3]
+assert cast('1', '2.5') == [1, 2.5]
+assert all(isinstance(i, Rdate) for i in cast('2020-01-01', '2020/02/29'))
+# Impossible dates are strings, so the column has mixed types
+assert cast('2020-01-01', '2019-02-29') is None
+assert cast('1', 'a') is None
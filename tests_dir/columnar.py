@@ -0,0 +1,20 @@
+from relational.relation import Relation
+
+p = Relation('samples/people.csv', columnar=True)
+assert p == people
+assert people == p
+assert len(p) == len(people)
+assert p.projection('chief') == people.projection('chief')
+assert p.selection('age > 25') == people.selection('age > 25')
+assert p.join(skills) == people.join(skills)
+
+# Copy on write keeps the storage
+p1 = p.rename({'id': 'i'})
+p1.insert((123, 'lala', 0, 31))
+assert len(p1) == len(p) + 1
+assert p1.insert((123, 'lala', 0, 31)) == 0
+
+p1.update('age == 31', {'age': 32})
+assert len(p1.selection('age == 32')) == 1
+p1.delete('i == 123')
+assert p1.rename({'i': 'id'}) == people
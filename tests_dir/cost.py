@@ -0,0 +1,48 @@
+from relational import cost, optimizer, parser
+from relational.relation import Relation, Header
+
+rels = {'people': people, 'skills': skills}
+
+e = cost.estimate(parser.tree('people'), rels)
+assert (e.rows, e.cost) == (len(people), 0)
+assert round(cost.estimate(parser.tree('σ id == 3 (people)'), rels).rows) == 1
+assert cost.estimate(parser.tree('σ age > 100 (people)'), rels).rows == 0
+assert cost.estimate(parser.tree('σ False (people)'), rels).rows == 0
+assert cost.estimate(parser.tree('people ⋈ lala'), rels) is None
+
+query = 'σ age > 25 (people ⋈ skills)'
+steps = []
+optimized = optimizer.optimize_all(query, rels, debug=steps, tostr=False)
+assert optimized.name == parser.JOIN and optimized.left.name == parser.SELECTION
+assert steps[-1].endswith('[cost ~%d]' % round(cost.cost(optimized, rels)))
+assert cost.cost(optimized, rels) < cost.cost(parser.tree(query), rels)
+
+# Without statistics the steps are just the queries
+steps = []
+optimizer.optimize_all('σ age > 25 (σ id > 1 (lala))', rels, specific=False, debug=steps)
+assert steps == ['σ age > 25 and id > 1 (lala)']
+
+# Relations with dates and missing values are optimized
+d = Relation()
+d.header = Header(['id', 'date'])
+d.insert((1, '2020-01-01'))
+d.insert((2, ''))
+assert optimizer.optimize_all('σ id > 1 (d)', {'d': d}) == 'σ id > 1 (d)'
+optimized = optimizer.optimize_all("σ date > '2019-01-01' (d ⋈ people)", {'d': d, 'people': people}, tostr=False)
+assert optimized.name == parser.JOIN and optimized.left.name == parser.SELECTION
+
+
+# Without estimates, only the optimizations not needing them are done
+class Broken(Relation):
+    def statistics(self):
+        raise Exception('No statistics')
+
+b = Broken()
+b.header = people.header
+b.content = people.content
+rels = {'people': b, 'skills': skills}
+assert cost.estimate(parser.tree('σ age > 25 (people ⋈ skills)'), {'people': people, 'skills': skills}) is not None
+steps = []
+optimized = optimizer.optimize_all('σ age > 25 (people ⋈ skills)', rels, debug=steps, tostr=False)
+assert optimized.name == parser.JOIN and optimized.left.name == parser.SELECTION
+assert steps == [str(optimized)]
@@ -0,0 +1,13 @@
+from relational import optimizer
+
+rels = {'people': people, 'skills': skills}
+program = '''a = σ age > 25 (people)
+b = a ⋈ skills
+c = π name (σ skill == 'C' (b)) ∪ π name (σ skill == 'PHP' (b))'''
+
+b = people.selection('age > 25').join(skills)
+expected = b.selection("skill == 'C'").projection('name').union(
+    b.selection("skill == 'PHP'").projection('name')
+)
+assert optimizer.execute_program(program, rels) == expected
+assert set(rels) == {'people', 'skills'}
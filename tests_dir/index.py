@@ -0,0 +1,48 @@
+from relational.relation import Relation, Header
+
+p = Relation('samples/people.csv')
+p.create_index('id')
+p.create_index(('age', ), 'sorted')
+p.create_index(['name', 'chief'])
+
+for expr in ('id == 3', 'age > 25', '20 < age <= 30', "age == 30 and name != 'paul'",
+             "name == 'eve' and chief == 0", "id == '3'", 'age > 25.5'):
+    assert p.selection(expr) == people.selection(expr)
+
+p.insert((123, 'lala', 0, 31))
+assert len(p.selection('id == 123')) == 1
+assert len(p.selection('age >= 31')) == 2
+
+p.update('id == 123', {'age': 19})
+assert len(p.selection('age >= 31')) == 1
+assert len(p.selection('age < 20')) == 1
+
+# The copy shares the indexes until one of them is changed
+p1 = p.rename({'id': 'i'})
+p1.delete('i == 123')
+assert len(p.selection('id == 123')) == 1
+assert len(p1.selection('i == 123')) == 0
+assert p1.selection('age < 25') == people.selection('age < 25').rename({'id': 'i'})
+p.delete('id == 123')
+assert p == people
+
+# Updates and deletes of many tuples rebuild the sorted index at once
+p.update('age > 25', {'age': 26})
+assert p.selection('age >= 26') == people.selection('age > 25').projection('id').join(p)
+assert p.selection('age < 26') == people.selection('age <= 25')
+p.delete('age < 26')
+assert p.selection('age >= 0') == p
+
+# Dates can't be compared with other values, so the index is not used
+d = Relation()
+d.header = Header(['id', 'date'])
+d.insert((1, '2020-01-01'))
+d.insert((2, ''))
+d.create_index('date', 'sorted')
+assert not d._indexes[('date', )].usable(0, 3)
+d.delete('id == 2')
+d.create_index('date', 'sorted')
+d.insert((3, 'x'))
+assert not d._indexes[('date', )].usable(0, 3)
+d.delete('id == 3')
+assert len(d) == 1
@@ -0,0 +1,11 @@
+from relational.relation import Relation, Header, POOL_CHECK_ROWS
+
+# Inserted values are interned only for attributes with few distinct values
+r = Relation()
+r.header = Header(['id', 'kind'])
+for i in range(POOL_CHECK_ROWS):
+    r.insert((i, i % 3))
+assert r._pools[0] is None
+assert len(r._pools[1]) == 3
+a, b = r.selection('id == 3').content.pop(), r.selection('id == 6').content.pop()
+assert a[1] is b[1]
@@ -0,0 +1,28 @@
+from relational import optimizer, optimizations, parser
+from relational.relation import Relation, Header
+
+rels = {'people': people, 'person_room': person_room, 'rooms': rooms, 'skills': skills}
+
+# The selective operands are joined first, and the product is done last
+query = 'people ⋈ skills ⋈ person_room ⋈ σ room == 1 (rooms)'
+optimized = optimizer.optimize_all(query, rels, tostr=False)
+assert optimized.name == parser.PRODUCT
+assert 'skills' in (optimized.left.name, optimized.right.name)
+assert eval(optimized.toPython(), rels) == eval(parser.parse(query), rels)
+
+# A product with attributes in common must still fail
+n = parser.tree('people * person_room ⋈ rooms')
+assert optimizations.join_order(n, rels) == 0
+
+# Long chains are ordered greedily
+chain = {}
+for i in range(12):
+    r = Relation()
+    r.header = Header(['a%d' % i, 'a%d' % (i + 1)])
+    for j in range(3 + i):
+        r.insert((str(j), str(j % 3)))
+    chain['r%d' % i] = r
+query = '⋈'.join('r%d' % i for i in range(11, -1, -1))
+optimized = optimizer.optimize_all(query, chain)
+assert '*' not in optimized
+assert eval(parser.parse(optimized), chain) == eval(parser.parse(query), chain)
@@ -0,0 +1,35 @@
+from relational import codegen, engine, optimizer, parser, querysplit
+from relational.relation import Relation, Header
+
+edges = {}
+for name, header in (('r', ['a', 'b']), ('s', ['b', 'c']), ('t', ['a', 'c'])):
+    edges[name] = Relation()
+    edges[name].header = Header(header)
+for i in range(40):
+    edges['r'].insert((str(i % 7), str(i % 5)))
+    edges['s'].insert((str(i % 5), str(i % 11)))
+    edges['t'].insert((str(i % 7), str(i % 11 + i % 2)))
+
+expected = edges['r'].join(edges['s']).join(edges['t'])
+assert len(expected) != 0
+assert edges['r'].multijoin(edges['s'], edges['t']) == expected
+for query in ('r ⋈* s ⋈* t', 't ⋈* (s ⋈* r)'):
+    assert eval(parser.parse(query), edges) == expected
+    assert engine.execute(parser.tree(query), edges) == expected
+    assert codegen.execute(query, edges) == expected
+
+# The triangle is cyclic, a chain is not
+optimized = optimizer.optimize_all('r ⋈ s ⋈ t', edges, tostr=False)
+assert optimized.name == parser.MULTIJOIN
+assert parser.tree(str(optimized)) == optimized
+assert '⋈*' not in optimizer.optimize_all('r ⋈ s', edges)
+
+# Same as the natural join, also without shared attributes
+assert people.multijoin(person_room) == people.join(person_room)
+assert people.multijoin(skills, person_room) == people.join(skills).join(person_room)
+assert people.multijoin(rooms) == people.product(rooms)
+
+# A program keeps a chain in a single query
+program = querysplit.program(parser.tree('r ⋈* s ⋈* σ a != c (t)'), edges)
+assert len(program.queries) == 2
+assert querysplit.execute(program, edges) == edges['r'].join(edges['s']).join(edges['t'].selection('a != c'))
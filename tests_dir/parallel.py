@@ -0,0 +1,35 @@
+from relational import parser
+from relational.maintenance import UserInterface
+from relational.parallel import PARTITIONED, Scheduler, pack, partition
+
+assert pack(people).unpack() == people
+
+rels = {'people': people, 'skills': skills, 'person_room': person_room}
+query = "(σ age > 20 (people) ⋈ skills) ∪ (people ⋈ σ skill == 'C' (skills))"
+with Scheduler(2, 0) as s:
+    assert len(s._divide(parser.tree(query), rels)) == 2
+    assert s.execute(parser.tree(query), rels) == parser.parse(query)(rels)
+
+with UserInterface(workers=2, min_tuples=0) as u:
+    u.set_relation('people', people)
+    u.set_relation('skills', skills)
+    program = '''a = people ⋈ skills
+b = σ age > 20 (people)
+a = σ skill == 'C' (a)
+π name (a ⋈ b)'''
+    assert u.multi_execute(program) == people.join(skills).selection("skill == 'C' and age > 20").projection('name')
+    assert u.get_relation('a') == people.join(skills).selection("skill == 'C'")
+assert u.scheduler._pool is None
+
+# A single operation is not divided
+with Scheduler(3, 0) as s:
+    assert s.execute(parser.tree('people ⋈ person_room'), rels) == people.join(person_room)
+    assert s._pool is None
+
+# Joins of relations divided in partitions
+with Scheduler(3, 0) as s:
+    lparts = partition(people, ['id'], 3)
+    rparts = partition(person_room, ['id'], 3)
+    assert sum(len(i) for i in lparts) == len(people)
+    for operation in PARTITIONED:
+        assert s.partitioned(operation, lparts, rparts) == getattr(people, operation)(person_room)
@@ -0,0 +1,36 @@
+from relational import optimizer, optimizations, parser
+from relational.relation import Relation, Header
+
+rels = {}
+for name in ('a', 'b'):
+    r = Relation()
+    r.header = Header(['k'] + ['%s%d' % (name, i) for i in range(6)])
+    for i in range(100):
+        r.insert(tuple(str(i * j % 7 if j else i % 20) for j in range(7)))
+    rels[name] = r
+
+# Only the join attribute and the used ones reach the join
+query = 'π a0,b1 (σ a2 == 3 (a ⋈ b))'
+optimized = optimizer.optimize_all(query, rels, tostr=False)
+assert optimized.name == parser.PROJECTION
+join = optimized.child
+while join.name != parser.JOIN:
+    join = join.child
+assert set(join.result_format(rels)) == {'k', 'a0', 'b1'}
+assert eval(optimized.toPython(), rels) == eval(parser.parse(query), rels)
+
+# Projections are narrowed instead of stacked
+n = parser.tree('π a0 (π k,a0,a1 (a) ⋈ b)')
+assert optimizations.projection_pushdown(n, rels) == 2
+assert str(n) == 'π a0 (π k,a0 (a)⋈π k (b))'
+
+# The operands of a union keep the same attributes
+union = {}
+for name, header in (('a', 'kxj'), ('b', 'ky'), ('c', 'jxk'), ('d', 'jy')):
+    union[name] = Relation()
+    union[name].header = Header(list(header))
+    for i in range(10):
+        union[name].insert(tuple(str((i + j) % 4) for j in range(len(header))))
+query = 'π x ((a ⋈ b) ∪ (c ⋈ d))'
+optimized = optimizer.optimize_all(query, union, tostr=False)
+assert eval(optimized.toPython(), union) == eval(parser.parse(query), union)
@@ -0,0 +1,55 @@
+from relational.maintenance import UserInterface
+from relational.querycache import normalize, RESULT_CACHE_SIZE
+
+assert normalize(" π  name\n(people) ") == 'π name (people)'
+assert normalize("σ name == 'a  b' (people)") == "σ name == 'a  b' (people)"
+
+u = UserInterface()
+u.set_relation('people', people)
+u.set_relation('skills', skills)
+
+# Results are not cached by default, queries are pipelined
+assert u.results is None
+r = u.execute('σ age > 25 (people)')
+assert r == people.selection('age > 25')
+assert (u.cache.hits, u.cache.misses) == (0, 1)
+
+u.multi_execute('a = σ  age > 25  (people)\nb = a ⋈ skills')
+assert u.get_relation('b') == people.selection('age > 25').join(skills)
+assert (u.cache.hits, u.cache.misses) == (1, 2)
+
+u.pipelined = False
+assert u.execute('a ⋈ skills') == u.get_relation('b')
+assert (u.cache.hits, u.cache.misses) == (2, 2)
+
+tree, trace = u.cache.optimized('σ age > 25 (people ⋈ skills)', u.relations)
+assert normalize(str(tree)) == 'σ age > 25 (people)⋈skills'
+assert u.cache.optimized('σ age > 25 (people ⋈ skills)', u.relations)[0] is tree
+
+# Results of subexpressions are reused until the relations change
+u = UserInterface(result_cache_size=RESULT_CACHE_SIZE)
+u.set_relation('skills', skills)
+u.set_relation('p', people.rename({}))
+u.results.clear()
+r = u.execute('π name (σ age > 25 (p) ⋈ skills)')
+assert (u.results.hits, u.results.misses) == (0, 3)
+r.insert(('lala', ))
+assert u.execute('π skill (σ age > 25 (p) ⋈ skills)') == people.selection('age > 25').join(skills).projection('skill')
+assert (u.results.hits, u.results.misses) == (1, 4)
+assert u.execute('π name (σ age > 25 (p) ⋈ skills)') == people.selection('age > 25').join(skills).projection('name')
+assert (u.results.hits, u.results.misses) == (2, 4)
+
+u.get_relation('p').insert((123, 'lala', 0, 31))
+u.execute('π name (σ age > 25 (p) ⋈ skills)')
+assert (u.results.hits, u.results.misses) == (2, 7)
+assert len(u.execute('σ age > 30 (p)')) == len(people.selection('age > 30')) + 1
+
+# The optimized tree is computed again when the sizes of the relations change
+u.set_relation('p', people.rename({}))
+tree = u.cache.optimized('σ age > 25 (p ⋈ skills)', u.relations)[0]
+for i in range(len(people)):
+    u.get_relation('p').insert((200 + i, 'lala', 0, 31))
+assert u.cache.optimized('σ age > 25 (p ⋈ skills)', u.relations)[0] is not tree
+tree = u.cache.optimized('σ age > 25 (p ⋈ skills)', u.relations)[0]
+u.refresh_statistics()
+assert u.cache.optimized('σ age > 25 (p ⋈ skills)', u.relations)[0] is not tree
@@ -0,0 +1,37 @@
+from relational import codegen, engine, optimizer, parser
+from relational.relation import Relation, Header
+
+rels = {}
+for name, header in (('r', ['a', 'b']), ('s', ['b', 'c']), ('t', ['c', 'd'])):
+    rels[name] = Relation()
+    rels[name].header = Header(header)
+# Most tuples of s match either r or t, but not both
+for i in range(1, 30):
+    rels['r'].insert((str(i), str(i % 2)))
+    rels['s'].insert(('0', str(i)))
+    rels['s'].insert((str(i), '0'))
+    rels['t'].insert((str(i % 3), str(i)))
+
+r, s, t = rels['r'], rels['s'], rels['t']
+expected = r.join(s).join(t)
+assert len(expected) != 0
+assert r.reduced_join(s, t) == expected
+assert t.reduced_join(r, s) == expected
+for query in ('r ⋈⋉ s ⋈⋉ t', 's ⋈⋉ (t ⋈⋉ r)'):
+    assert eval(parser.parse(query), rels) == expected
+    assert engine.execute(parser.tree(query), rels) == expected
+    assert codegen.execute(query, rels) == expected
+
+assert people.reduced_join(person_room, rooms) == people.join(person_room).join(rooms)
+
+# Cyclic joins can't be reduced, and are done as a multiway join
+u = Relation()
+u.header = Header(['a', 'd'])
+for i in range(1, 30):
+    u.insert((str(i), str(i * 2 % 30)))
+assert r.reduced_join(s, t, u) == expected.join(u)
+
+optimized = optimizer.optimize_all('r ⋈ s ⋈ t', rels, tostr=False, reduce_joins=True)
+assert optimized.name == parser.REDUCEDJOIN
+assert parser.tree(str(optimized)) == optimized
+assert '⋈⋉' not in optimizer.optimize_all('r ⋈ s', rels, reduce_joins=True)
@@ -0,0 +1,45 @@
+from relational.maintenance import UserInterface
+from relational.relation import Relation, Header
+
+p = people.rename({})
+s = p.statistics()
+assert s.rows == len(people)
+# Estimates, two values can end in the same register
+assert all(abs(len(i.distinct) - d) <= 1 for i, d in zip(s.columns, [8, 8, 3, 6]))
+assert (s.columns[3].min, s.columns[3].max) == (20, 33)
+assert s.columns[3].histogram.fraction_below(20) == 0
+assert s.columns[3].histogram.fraction_below(40) == 1
+
+# Kept up to date
+p.insert((123, 'lala', 0, 99))
+assert p.statistics() is s
+assert s.rows == len(people) + 1
+assert s.columns[3].max == 99
+p.update('id == 123', {'age': '---'})
+assert s.rows == len(people) + 1
+assert s.columns[3].nulls == 1
+p.delete('id == 123')
+assert s.rows == len(people)
+assert s.columns[3].nulls == 0
+
+u = UserInterface()
+u.set_relation('p', p)
+u.refresh_statistics()
+assert p.statistics() is not s
+assert p.statistics().columns[3].max == 33
+
+o = people.outer_left(person_room.selection('room == 4'))
+assert o.statistics().columns[-1].nulls == len(o.selection('room == "---"')) > 0
+
+# Dates can't be compared with other values, like a missing date
+d = Relation()
+d.header = Header(['id', 'date'])
+d.insert((1, '2020-01-01'))
+d.insert((2, ''))
+assert not d.statistics().columns[1].comparable
+assert d.statistics().columns[1].min is None
+d.delete('id == 2')
+d.refresh_statistics()
+assert d.statistics().columns[1].comparable
+d.insert((3, 'x'))
+assert not d.statistics().columns[1].comparable
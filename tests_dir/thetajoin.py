@@ -0,0 +1,17 @@
+from relational import optimizer, parser
+
+rels = {'people': people, 'person_room': person_room}
+
+# Equalities between the operands of a product become a hash join
+query = 'σ id == pid and age > 25 and name != r (people * ρ id➡pid,room➡r (person_room))'
+optimized = optimizer.optimize_all(query, rels, tostr=False)
+join = optimized
+while join.kind == parser.UNARY:
+    join = join.child
+assert join.name == parser.THETAJOIN
+assert 'pid' in join.prop and 'r' in join.prop and 'age' not in join.prop
+assert eval(optimized.toPython(), rels) == eval(parser.parse(query), rels)
+
+# Without equalities the condition is evaluated on every pair
+r = people.thetajoin(person_room.rename({'id': 'pid'}), 'age < room * 10')
+assert r == people.product(person_room.rename({'id': 'pid'})).selection('age < room * 10')
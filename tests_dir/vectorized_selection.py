@@ -0,0 +1,27 @@
+from relational.relation import Relation, Header
+from relational import vectorized
+
+r = Relation()
+r.header = Header(('id', 'age', 'name', 'score'))
+for i in range(vectorized.MIN_ROWS * 2):
+    r.insert((i, i % 90, ('jack', 'carl', 'eve')[i % 3], '%d.5' % (i % 10)))
+
+
+def slow(expr):
+    return set(i for i in r.content if eval(expr, {
+        'id': int(i[0]), 'age': int(i[1]), 'name': i[2], 'score': float(i[3])
+    }))
+
+# Conjunctions of comparisons with constants are vectorized
+for expr in ('age > 25', '18 <= age < 30', "name == 'eve' and 7 > score"):
+    fast = vectorized.selection(r, expr)
+    assert fast is not None or vectorized.numpy is None
+    assert fast is None or fast == slow(expr)
+    assert r.selection(expr).content == slow(expr)
+
+# Anything else falls back to evaluating one tuple at a time
+for expr in ('age > 25 and id % 2 == 0', 'age > 25 or id < 3', 'age > score'):
+    assert vectorized.selection(r, expr) is None
+    assert r.selection(expr).content == slow(expr)
+# Also comparisons that would raise an exception in Python
+assert vectorized.selection(r, 'name > 3') is None